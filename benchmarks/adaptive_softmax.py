@@ -0,0 +1,72 @@
+""" Adaptive Softmax vs Full Softmax
+
+Compares the time of a training step (loss + gradients) and the inference time (full distribution) of an
+`AdaptiveSoftmax` output layer with a full softmax over the vocabulary (`Linear` + `categorical_cross_entropy`).
+
+run with:
+    python benchmarks/adaptive_softmax.py
+"""
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import timeit
+import tensorflow as tf
+import tensorx as tx
+
+batch_size = 256
+n_hidden = 512
+vocab_size = 100000
+cutoffs = [2000, 10000, 40000]
+n_runs = 20
+
+# zipf distributed targets, ids are sorted by frequency
+ranks = tf.range(1, vocab_size + 1, dtype=tf.float32)
+zipf_logits = tf.math.log(1. / ranks)[None, :]
+labels = tf.random.categorical(zipf_logits, batch_size, dtype=tf.int64)[0]
+hidden = tf.random.uniform([batch_size, n_hidden])
+
+x = tx.Input(hidden, n_units=n_hidden, constant=False)
+
+full = tx.Linear(x, vocab_size)
+adaptive = tx.AdaptiveSoftmax(x, vocab_size, cutoffs=cutoffs)
+
+
+@tf.function
+def full_step():
+    with tf.GradientTape() as tape:
+        logits = full.compute(hidden)
+        loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels, logits))
+    return tape.gradient(loss, full.trainable_variables)
+
+
+@tf.function
+def adaptive_step():
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_mean(adaptive.nll(hidden, labels))
+    return tape.gradient(loss, adaptive.trainable_variables)
+
+
+@tf.function
+def full_inference():
+    return tf.nn.log_softmax(full.compute(hidden))
+
+
+@tf.function
+def adaptive_inference():
+    return adaptive.compute(hidden)
+
+
+def bench(fn):
+    fn()  # trace
+    return timeit.timeit(fn, number=n_runs) / n_runs * 1000
+
+
+def n_params(layer):
+    return sum(int(tf.size(v)) for v in layer.trainable_variables)
+
+
+print(f"vocab {vocab_size} hidden {n_hidden} batch {batch_size} cutoffs {cutoffs}")
+print(f"{'':>10} {'params':>12} {'train (ms)':>12} {'infer (ms)':>12}")
+print(f"{'full':>10} {n_params(full):>12} {bench(full_step):>12.2f} {bench(full_inference):>12.2f}")
+print(f"{'adaptive':>10} {n_params(adaptive):>12} {bench(adaptive_step):>12.2f} {bench(adaptive_inference):>12.2f}")
@@ -0,0 +1,44 @@
+""" Grouped and depthwise-separable Conv1D
+
+Reports the number of parameters, the FLOPs per sequence, and the time of a forward pass of a standard `Conv1D`,
+grouped convolutions, and a depthwise-separable convolution for different numbers of channels.
+
+run with:
+    python benchmarks/conv1d.py
+"""
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import timeit
+import tensorflow as tf
+import tensorx as tx
+
+batch_size = 32
+seq_len = 256
+filter_size = 5
+channels = [128, 512, 1024]
+n_runs = 5
+
+configs = {
+    "standard": dict(),
+    "groups=4": dict(groups=4),
+    "groups=16": dict(groups=16),
+    "separable": dict(separable=True),
+}
+
+
+def bench(fn, *args):
+    fn(*args)  # trace
+    return min(timeit.repeat(lambda: fn(*args), number=n_runs, repeat=5)) / n_runs * 1000
+
+
+print(f"batch {batch_size} seq {seq_len} filter {filter_size}")
+print(f"{'channels':>8} {'conv':>10} {'params':>10} {'MFLOPs':>10} {'ms':>8}")
+for n_channels in channels:
+    seq = tf.random.uniform([batch_size, seq_len, n_channels])
+    x = tx.Input(n_units=n_channels)
+    for name, config in configs.items():
+        conv = tx.Conv1D(x, n_units=n_channels, filter_size=filter_size, **config)
+        t = bench(tf.function(conv.compute), seq)
+        print(f"{n_channels:>8} {name:>10} {conv.n_params:>10} {conv.flops(seq_len) / 1e6:>10.1f} {t:>8.2f}")
@@ -0,0 +1,57 @@
+""" RNN loop unrolling
+
+Compares the time of a forward + backward pass of an `RNN` with an `LSTMCell` with the default `tf.while_loop`,
+a partially unrolled loop (`unroll=4`), and a fully unrolled graph (`unroll=True`) for different sequence lengths
+and batch sizes, along with the time of the loop with `parallel_iterations=32`.
+
+run with:
+    python benchmarks/rnn_unroll.py
+"""
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import timeit
+import tensorflow as tf
+import tensorx as tx
+
+n_features = 64
+n_hidden = 128
+seq_lengths = [4, 16, 32, 64]
+batch_sizes = [1, 32, 128]
+n_runs = 20
+
+configs = {
+    "loop": dict(),
+    "loop pi=32": dict(parallel_iterations=32),
+    "unroll=4": dict(unroll=4),
+    "unroll": dict(unroll=True),
+}
+
+
+def bench(fn, *args):
+    fn(*args)  # trace
+    return timeit.timeit(lambda: fn(*args), number=n_runs) / n_runs * 1000
+
+
+def train_step(rnn):
+    @tf.function
+    def step(seq):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_sum(rnn.compute(seq, *[s() for s in rnn.previous_state]))
+        return tape.gradient(loss, rnn.trainable_variables)
+
+    return step
+
+
+print(f"lstm features {n_features} hidden {n_hidden}, train step (ms)")
+print(f"{'seq':>4} {'batch':>6}" + "".join(f"{name:>12}" for name in configs))
+for seq_len in seq_lengths:
+    for batch_size in batch_sizes:
+        seq = tf.random.uniform([seq_len, batch_size, n_features])
+        rnn = tx.RNN(seq, cell_config=tx.LSTMCell.config(n_units=n_hidden))
+        times = []
+        for config in configs.values():
+            layer = tx.RNN(seq, cell_config=tx.LSTMCell.config(n_units=n_hidden), share_state_with=rnn, **config)
+            times.append(bench(train_step(layer), seq))
+        print(f"{seq_len:>4} {batch_size:>6}" + "".join(f"{t:>12.2f}" for t in times))
@@ -0,0 +1,66 @@
+""" TransformerBlock vs composed layers
+
+Compares the throughput of a training step (forward + gradients) and inference with a `TransformerBlock` and the
+same (post-norm) block composed from `MHAttention`, `Residual`, `LayerNorm` and `FC` layers in a `Module`, for
+different hidden sizes. Inference is measured both compiled with `tf.function` and executing eagerly, where the
+overhead of each layer call is not traced away.
+
+run with:
+    python benchmarks/transformer_block.py
+"""
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import timeit
+import tensorflow as tf
+import tensorx as tx
+
+batch_size = 32
+seq_len = 32
+n_heads = 4
+hidden_sizes = [32, 64, 128, 256]
+n_runs = 20
+
+
+def composed_block(x, n_units):
+    attention = tx.MHAttention(x, x, x, n_units=n_units, n_heads=n_heads)
+    h = tx.LayerNorm(tx.Residual(x, attention))
+    ffn = tx.FC(tx.FC(h, 4 * n_units, activation=tx.gelu), n_units)
+    return tx.Module(x, tx.LayerNorm(tx.Residual(h, ffn)))
+
+
+def train_step(layer, seq):
+    @tf.function
+    def step():
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_sum(layer.compute(seq))
+        return tape.gradient(loss, layer.trainable_variables)
+
+    return step
+
+
+def inference(layer, seq, compiled=True):
+    fn = lambda: layer.compute(seq)
+    return tf.function(fn) if compiled else fn
+
+
+def bench(fn):
+    fn()  # trace
+    seconds = min(timeit.repeat(fn, number=n_runs, repeat=5)) / n_runs
+    return batch_size * seq_len / seconds
+
+
+print(f"batch {batch_size} seq {seq_len} heads {n_heads}, tokens/s")
+print(f"{'units':>6}" + "".join(f"{name:>16}" for name in ["composed train", "block train", "composed infer",
+                                                            "block infer", "composed eager", "block eager"]))
+for n_units in hidden_sizes:
+    seq = tf.random.uniform([batch_size, seq_len, n_units])
+    x = tx.Input(seq, n_units=n_units, constant=False)
+    composed = composed_block(x, n_units)
+    block = tx.TransformerBlock(x, n_heads=n_heads)
+
+    results = [bench(train_step(composed, seq)), bench(train_step(block, seq)),
+               bench(inference(composed, seq)), bench(inference(block, seq)),
+               bench(inference(composed, seq, compiled=False)), bench(inference(block, seq, compiled=False))]
+    print(f"{n_units:>6}" + "".join(f"{r:>16.0f}" for r in results))
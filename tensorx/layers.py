@@ -1,6 +1,6 @@
 from abc import ABC
 from collections import Counter
-from functools import partial
+from functools import partial, lru_cache
 import threading
 
 import tensorflow as tf
@@ -14,14 +14,14 @@ from typing import Union, Type, Callable, Optional, List, Hashable, Dict, Set, A
 import inspect
 from contextlib import ExitStack
 
-from tensorx.activation import identity
+from tensorx.activation import identity, gelu
 from tensorx.init import zeros_init, ones_init, glorot_uniform_init
 from tensorx.utils import as_tensor, as_list, Graph, fix_reshape_dimensions
 from tensorx.ops import embedding_lookup_sparse, to_sparse, alpha_dropout, dropout, sparse_dropout, binary_random_mask, \
     empty_sparse_tensor, sparse_matrix_indices, sparse_indices, matrix_indices, apply_gate, SparseVariable, \
-    dense_one_hot
+    dense_one_hot, blockwise_attention, local_attention, linear_attention, elu_features, random_features
 from tensorx.train.callbacks import OnValueChange
-from tensorflow.python.training import moving_averages
+from tensorx.random import hash_uniform
 
 
 class LayerState(AutoTrackable):
@@ -61,6 +61,13 @@ class LayerState(AutoTrackable):
             elif isinstance(obj, tf.Variable):
                 ref: Hashable = obj.ref()
                 all_vars[ref] = obj
+            elif isinstance(obj, (list, tuple)):
+                # lists are wrapped by AutoTrackable, layers with a variable number of parameters store them in lists
+                for item in obj:
+                    if isinstance(item, Layer):
+                        all_vars.update(item.layer_state.var_dict())
+                    elif isinstance(item, tf.Variable):
+                        all_vars[item.ref()] = item
         return all_vars
 
     def __str__(self):
@@ -453,6 +460,15 @@ class Layer(AutoTrackable, ABC):
         kwargs["share_state_with"] = self
         return self.config(*layers, **kwargs)
 
+    def _reuse_with_inputs(self, *inputs):
+        """ calls `reuse_with` with new layers in the same order as `self.inputs`
+
+        Used to rebuild the layers of a graph (e.g. by `Module.reuse_with` or `fold_batch_norm`). Layers with
+        inputs that are not positional parameters of `reuse_with` (e.g. `sequence_length`) override this to pass
+        them as keyword arguments.
+        """
+        return self.reuse_with(*inputs)
+
     @property
     def inputs(self):
         return list(self._inputs)
@@ -1295,17 +1311,28 @@ class VariableLayer(Layer):
             else:
                 return self.layer_state.variable.value()
 
-    def reset(self):
+    def reset(self, mask=None):
         """ reset
 
         resets the variable using its initializer
 
+        Args:
+            mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size]`, if given only the rows where
+                mask is `True` are reset.
+
         Returns:
             an op that can be run to reinitialize the variable
         """
         with layer_scope(self):
-            self.layer_state.variable.assign(self.init(self.shape))
-            self.layer_state.counter.assign(0)
+            if mask is None:
+                self.layer_state.variable.assign(self.init(self.shape))
+                self.layer_state.counter.assign(0)
+            else:
+                variable = self.layer_state.variable
+                mask = tf.convert_to_tensor(mask, dtype=tf.bool)
+                mask = tf.reshape(mask, [-1] + [1] * (len(variable.shape) - 1))
+                init_value = self.init(tf.shape(variable), dtype=self.dtype)
+                variable.assign(tf.where(mask, init_value, variable))
 
     def reuse_with(self, input_layer=None, init_from_input=None, name=None):
         input_layer = self.inputs[0] if input_layer is None else input_layer
@@ -1810,7 +1837,7 @@ class Module(Layer):
         for node in dep_iter:
             if node not in self.graph.in_nodes:
                 new_inputs = [layer_map[lr] for lr in node.inputs]  # if lr not in other_inputs]
-                layer_map[node] = node.reuse_with(*new_inputs)
+                layer_map[node] = node._reuse_with_inputs(*new_inputs)
 
         new_output = layer_map[self.output]
 
@@ -1944,6 +1971,19 @@ class DropConnect(ViewLayer):
                            name=name)
 
 
+def _layer_norm(x, scale, bias, epsilon=1e-12):
+    """ layer normalization over the last axis with single-pass statistics
+
+    The mean and variance are computed from the same pass over the data shifted by its first element, which
+    avoids the loss of precision of `E[x²]-E[x]²` when the mean is large compared to the variance, and the
+    shifted data is normalized directly.
+    """
+    shifted = x - tf.stop_gradient(x[..., :1])
+    mean = tf.reduce_mean(shifted, axis=-1, keepdims=True)
+    variance = tf.maximum(tf.reduce_mean(tf.square(shifted), axis=-1, keepdims=True) - tf.square(mean), 0.)
+    return (shifted - mean) * (tf.math.rsqrt(variance + epsilon) * scale) + bias
+
+
 class LayerNorm(Layer):
     """ Layer Normalization
 
@@ -1956,6 +1996,11 @@ class LayerNorm(Layer):
 
     def __init__(self, input_layer, share_state_with=None):
         self.share_state_with = share_state_with
+
+        # state attributes
+        self.bias = None
+        self.scale = None
+
         super().__init__(inputs=input_layer,
                          n_units=input_layer.n_units,
                          dtype=tf.float32,
@@ -1963,10 +2008,6 @@ class LayerNorm(Layer):
                          share_state_with=share_state_with
                          )
 
-        # state attributes
-        self.bias = None
-        self.scale = None
-
     def compute_shape(self):
         return self.input.shape
 
@@ -1986,16 +2027,89 @@ class LayerNorm(Layer):
         input_tensor = input_tensors[0]
 
         with layer_scope(self):
-            mean, variance = tf.nn.moments(input_tensor, -1, keepdims=True)
-            variance_epsilon = 1e-12
+            return _layer_norm(input_tensor, self.scale, self.bias)
+
+
+class ResidualLayerNorm(Layer):
+    """ Residual Layer Normalization
+
+    Computes `LayerNorm(x + Dropout(h))`, the residual sub-block used in transformers and deep recurrent networks,
+    as a single layer: the dropout, residual connection, and normalization are computed in the same `compute` call
+    and the mean and variance are computed in a single pass over the data.
+
+    !!! cite "Reference"
+        Lei Ba J., Kiros, J., Hinton, G. [Layer Normalization](https://arxiv.org/abs/1607.06450), 2016
+
+    Args:
+        x_layer (`Layer`): residual input layer
+        h_layer (`Layer`): layer added to the residual, with the same number of units as `x_layer`
+        dropout (`float`): dropout probability applied to `h_layer`
+        regularized (`bool`): if `True` applies dropout
+        share_state_with (`Optional[ResidualLayerNorm]`): layer with which the scale and bias are shared
+    """
+
+    def __init__(self,
+                 x_layer,
+                 h_layer,
+                 dropout=0.0,
+                 regularized=False,
+                 share_state_with=None,
+                 name="residual_layer_norm"):
+        x_layer, h_layer = as_layer(x_layer), as_layer(h_layer)
+        if x_layer.n_units != h_layer.n_units:
+            raise ValueError(f"x_layer and h_layer must have the same number of units: "
+                             f"{x_layer.n_units} != {h_layer.n_units}")
+        if share_state_with is not None and not isinstance(share_state_with, ResidualLayerNorm):
+            raise TypeError(f"can only share state with a ResidualLayerNorm: {type(share_state_with)} found")
+
+        self.dropout = dropout
+        self.regularized = regularized
+        self.share_state_with = share_state_with
+
+        # state attributes
+        self.bias = None
+        self.scale = None
+
+        super().__init__(inputs=[x_layer, h_layer],
+                         n_units=x_layer.n_units,
+                         dtype=tf.float32,
+                         name=name,
+                         dropout=dropout,
+                         regularized=regularized,
+                         share_state_with=share_state_with)
+
+    def compute_shape(self):
+        return self.inputs[0].shape
+
+    def init_state(self):
+        if self.share_state_with is None:
+            state = super().init_state()
+            with layer_scope(self):
+                state.bias = tf.Variable(zeros_init()([self.n_units]), trainable=True, name="beta")
+                state.scale = tf.Variable(ones_init()([self.n_units]), trainable=True, name="gamma")
+        else:
+            state = self.share_state_with.layer_state
+
+        return state
+
+    def compute(self, x, h):
+        with layer_scope(self):
+            x = as_tensor(x, dtype=self.dtype)
+            h = as_tensor(h, dtype=self.dtype)
+            if self.regularized and self.dropout > 0:
+                h = dropout(h, probability=self.dropout, scale=True)
+            return _layer_norm(x + h, self.scale, self.bias)
+
+    def reuse_with(self, x_layer, h_layer, regularized=None, name=None):
+        name = self.name if name is None else name
+        regularized = self.regularized if regularized is None else regularized
+        share_state_with = self if self.share_state_with is None else self.share_state_with
 
-            return tf.nn.batch_normalization(
-                input_tensor,
-                mean,
-                variance,
-                offset=self.bias,
-                scale=self.scale,
-                variance_epsilon=variance_epsilon)
+        return ResidualLayerNorm(x_layer, h_layer,
+                                 dropout=self.dropout,
+                                 regularized=regularized,
+                                 share_state_with=share_state_with,
+                                 name=name)
 
 
 class BatchNorm(Layer):
@@ -2043,6 +2157,9 @@ class BatchNorm(Layer):
         training (`bool`): if True uses the current mini-batch mean and variance to compute the batch-normalised output and
         updates the population estimates. Else, computes the batch normalisation using the estimates.
         eps (`float`): eps or epsilon
+        sync (`bool`): if True and the layer is computed in a replica context of a `tf.distribute.Strategy`, the
+            batch statistics are computed over the batches of all replicas. The sum, sum of squares and count of the
+            local batch are all-reduced in a single collective.
         name: Name of the layer.
     """
 
@@ -2051,7 +2168,8 @@ class BatchNorm(Layer):
 
     def reset_estimates(self):
         self.moving_mean.assign(tf.zeros_like(self.moving_mean))
-        self.moving_average.assign(tf.zeros_like(self.moving_average))
+        self.moving_variance.assign(tf.zeros_like(self.moving_variance))
+        self.n_updates.assign(0)
 
     def __init__(self,
                  input_layer,
@@ -2064,6 +2182,7 @@ class BatchNorm(Layer):
                  decay_rate=0.99,
                  eps=0.001,
                  share_state_with=None,
+                 sync=False,
                  name="BatchNorm"):
 
         self.axis = axis
@@ -2075,6 +2194,7 @@ class BatchNorm(Layer):
         self.share_state_with = share_state_with
         self.gamma_init = gamma_init
         self.beta_init = beta_init
+        self.sync = sync
 
         if input_layer.dtype not in (tf.float32, tf.float64, tf.float16):
             raise TypeError("Expected float layer got {} instead".format(input_layer.dtype))
@@ -2092,7 +2212,8 @@ class BatchNorm(Layer):
                          gamma_init=gamma_init,
                          beta_init=beta_init,
                          training=training,
-                         share_state_with=share_state_with
+                         share_state_with=share_state_with,
+                         sync=sync
                          )
 
     def init_state(self):
@@ -2123,50 +2244,52 @@ class BatchNorm(Layer):
                 state.moving_mean = tf.Variable(initial_value=zeros_init()(param_shape),
                                                 name="moving_mean",
                                                 trainable=False,
+                                                aggregation=tf.VariableAggregation.MEAN,
                                                 dtype=self.dtype)
 
             if not hasattr(state, "moving_variance"):
                 state.moving_variance = tf.Variable(initial_value=zeros_init()(param_shape),
                                                     name="moving_variance",
                                                     trainable=False,
+                                                    aggregation=tf.VariableAggregation.MEAN,
                                                     dtype=self.dtype)
 
+            if not hasattr(state, "n_updates"):
+                state.n_updates = tf.Variable(initial_value=0,
+                                              name="n_updates",
+                                              trainable=False,
+                                              aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA,
+                                              dtype=tf.int64)
+
         return state
 
+    def update_estimates(self, mean, variance):
+        """ updates the moving mean and variance with a zero-debiased exponential moving average
+
+        The debiased average is kept in the moving estimates with a single update counter, so that the estimates are
+        not biased towards their zero initialization during the first updates.
+
+        Args:
+            mean (`Tensor`): batch mean
+            variance (`Tensor`): batch variance
+
+        Returns:
+            update (`Operation`): an op that groups the update of both estimates
+        """
+        step = tf.cast(self.n_updates.assign_add(1), self.dtype)
+        decay = tf.cast(self.decay_rate, self.dtype)
+        rate = (1. - decay) / (1. - tf.pow(decay, step))
+        return tf.group(self.moving_mean.assign_add((mean - self.moving_mean) * rate),
+                        self.moving_variance.assign_add((variance - self.moving_variance) * rate))
+
     def compute(self, input_tensor):
-        input_tensor = tf.convert_to_tensor(input_tensor, dtype=self.dtype)
-        input_shape = input_tensor.shape
+        input_tensor = as_tensor(input_tensor, dtype=self.dtype)
 
         with layer_scope(self):
             if isinstance(input_tensor, tf.SparseTensor):
                 input_tensor = tf.sparse.to_dense(input_tensor)
 
-            axis = list(range(len(input_shape) - 1)) if self.axis is None else self.axis
-
-            # Calculate the moments based on the individual batch.
-            batch_mean, batch_variance = tf.nn.moments(x=input_tensor,
-                                                       axes=axis,
-                                                       shift=self.moving_mean,
-                                                       name="moments")
-
-            if self.training:
-                # zero de-bias ema update
-                moving_averages.assign_moving_average(variable=self.moving_mean,
-                                                      value=batch_mean,
-                                                      decay=self.decay_rate,
-                                                      zero_debias=True)
-                moving_averages.assign_moving_average(variable=self.moving_variance,
-                                                      value=batch_variance,
-                                                      decay=self.decay_rate,
-                                                      zero_debias=True)
-
-                return tf.nn.batch_normalization(x=input_tensor,
-                                                 mean=batch_mean,
-                                                 variance=batch_variance,
-                                                 offset=self.beta,
-                                                 scale=self.gamma,
-                                                 variance_epsilon=self.eps)
-            else:
+            if not self.training:
                 return tf.nn.batch_normalization(x=input_tensor,
                                                  mean=self.moving_mean,
                                                  variance=self.moving_variance,
@@ -2174,6 +2297,61 @@ class BatchNorm(Layer):
                                                  scale=self.gamma,
                                                  variance_epsilon=self.eps)
 
+            axis = list(range(len(input_tensor.shape) - 1)) if self.axis is None else self.axis
+            replica_context = tf.distribute.get_replica_context()
+
+            if self.sync and replica_context is not None and replica_context.num_replicas_in_sync > 1:
+                # sufficient statistics of the input shifted by the moving mean (the same in every replica)
+                shift = tf.stop_gradient(tf.convert_to_tensor(self.moving_mean))
+                shifted = input_tensor - shift
+                local_sum = tf.reduce_sum(shifted, axis=axis, keepdims=True)
+                local_squares = tf.reduce_sum(tf.square(shifted), axis=axis, keepdims=True)
+                count = tf.size(input_tensor) // tf.size(local_sum)
+
+                # single collective for all the statistics
+                stats_shape = tf.shape(local_sum)
+                stats = tf.concat([tf.reshape(local_sum, [-1]),
+                                   tf.reshape(local_squares, [-1]),
+                                   tf.cast([count], self.dtype)], axis=0)
+                stats = replica_context.all_reduce(tf.distribute.ReduceOp.SUM, stats)
+                total_sum, total_squares, count = tf.split(stats, [tf.size(local_sum), tf.size(local_sum), 1])
+
+                batch_mean = tf.reshape(total_sum / count, stats_shape)
+                batch_variance = tf.maximum(tf.reshape(total_squares / count, stats_shape) - tf.square(batch_mean), 0.)
+                output = (shifted - batch_mean) * (tf.math.rsqrt(batch_variance + self.eps) * self.gamma) + self.beta
+                batch_mean = tf.squeeze(batch_mean, axis=axis) + shift
+                batch_variance = tf.squeeze(batch_variance, axis=axis)
+            elif self.axis is None and self.dtype == tf.float32:
+                # the fused kernel normalizes a [batch,1,1,n_units] view over all but the last axis
+                input_shape = tf.shape(input_tensor)
+                n_units = input_shape[-1]
+                output, batch_mean, batch_variance = tf.compat.v1.nn.fused_batch_norm(
+                    tf.reshape(input_tensor, [-1, 1, 1, n_units]),
+                    scale=self.gamma,
+                    offset=self.beta,
+                    epsilon=self.eps,
+                    is_training=True)
+                output = tf.reshape(output, input_shape)
+                # the fused kernel returns the unbiased batch variance
+                n = tf.cast(tf.size(input_tensor) // n_units, self.dtype)
+                batch_variance = batch_variance * (n - 1.) / tf.maximum(n, 1.)
+            else:
+                # single pass moments of the input shifted by its first element along the reduced axes
+                shift = input_tensor
+                for i in axis:
+                    shift = shift[(slice(None),) * (i % len(input_tensor.shape)) + (slice(0, 1),)]
+                shift = tf.stop_gradient(shift)
+                shifted = input_tensor - shift
+                batch_mean = tf.reduce_mean(shifted, axis=axis, keepdims=True)
+                batch_variance = tf.maximum(
+                    tf.reduce_mean(tf.square(shifted), axis=axis, keepdims=True) - tf.square(batch_mean), 0.)
+                output = (shifted - batch_mean) * (tf.math.rsqrt(batch_variance + self.eps) * self.gamma) + self.beta
+                batch_mean = tf.squeeze(batch_mean + shift, axis=axis)
+                batch_variance = tf.squeeze(batch_variance, axis=axis)
+
+            self.update_estimates(batch_mean, batch_variance)
+            return output
+
     def reuse_with(self, input_layer, training=None, name=None):
         if self.training is None:
             training = self.training
@@ -2190,9 +2368,111 @@ class BatchNorm(Layer):
                          decay_rate=self.decay_rate,
                          eps=self.eps,
                          share_state_with=self if self.share_state_with is None else self.share_state_with,
+                         sync=self.sync,
                          name=self.name if name is None else name)
 
 
+def fold_batch_norm(outputs, inputs=None):
+    """ fold_batch_norm
+
+    Folds inference `BatchNorm` layers (`training=False`) into the `Linear` or `Conv1D` layer that precedes them,
+    removing the normalization pass from the graph. With $s = \\gamma / \\sqrt{\\sigma^2 + \\epsilon}$ computed from
+    the moving variance $\\sigma^2$, the folded layer has weights $W s$ and bias $(b - \\mu) s + \\beta$.
+
+    Returns new output layers, the layers that depend on a folded `BatchNorm` are rebuilt with `reuse_with` and share
+    state with the original layers. The folded weights and biases are new variables with a snapshot of the current
+    values, the original layers are not modified, so a training graph that shares their state is unaffected, but the
+    folded graph must be built again to reflect further training.
+
+    !!! example
+        ```python
+        x = tx.Input(n_units=4)
+        h = tx.BatchNorm(tx.Linear(x, 8), training=False)
+        y = tx.Linear(tx.Activation(h, tx.relu), 2)
+        # ... train ...
+        folded_y = tx.fold_batch_norm(y)
+        ```
+
+    Args:
+        outputs (`Layer` or `List[Layer]`): output layers of the graph to be folded
+        inputs (`Layer` or `List[Layer]`): optional input layers where the graph stops, if None the graph goes from
+            the outputs to every input found
+
+    Returns:
+        outputs (`Layer` or `List[Layer]`): the new output layers, a single layer if `outputs` is a `Layer`.
+    """
+    graph = Graph.build(inputs=inputs, outputs=outputs)
+    layer_map = {node: node for node in graph.in_nodes}
+
+    def foldable(node):
+        return isinstance(node, BatchNorm) and not node.training and node.axis is None and \
+               isinstance(node.input, (Linear, Conv1D))
+
+    for node in graph.dependency_iter():
+        if node in graph.in_nodes:
+            continue
+        new_inputs = [layer_map[input_layer] for input_layer in node.inputs]
+        if foldable(node):
+            layer_map[node] = _fold_batch_norm(node, new_inputs[0])
+        elif any(new is not old for new, old in zip(new_inputs, node.inputs)):
+            layer_map[node] = node._reuse_with_inputs(*new_inputs)
+        else:
+            layer_map[node] = node
+
+    if isinstance(outputs, Layer):
+        return layer_map[outputs]
+    return [layer_map[output] for output in outputs]
+
+
+def _fold_batch_norm(batch_norm, linear):
+    """ returns a copy of a `Linear` or `Conv1D` layer with the inference `BatchNorm` statistics folded into its
+    weights and bias
+    """
+    scale = batch_norm.gamma * tf.math.rsqrt(batch_norm.moving_variance + batch_norm.eps)
+    bias = linear.bias if linear.add_bias else tf.zeros_like(scale)
+    bias = tf.Variable((bias - batch_norm.moving_mean) * scale + batch_norm.beta, name="bias")
+
+    if isinstance(linear, Conv1D):
+        if linear.separable:
+            # the depthwise filters are unchanged, the pointwise filters map to the output units
+            filters = tf.Variable(linear.filters, name="filters")
+            pointwise_filters = tf.Variable(linear.pointwise_filters * scale, name="pointwise_filters")
+        else:
+            filters = tf.Variable(linear.filters * scale, name="filters")
+            pointwise_filters = None
+        return Conv1D(linear.input,
+                      n_units=linear.n_units,
+                      filter_size=linear.filter_size,
+                      stride=linear.stride,
+                      dilation_rate=linear.dilation_rate,
+                      same_padding=linear.same_padding,
+                      causal=linear.causal,
+                      add_bias=True,
+                      filters=filters,
+                      bias=bias,
+                      groups=linear.groups,
+                      separable=linear.separable,
+                      pointwise_filters=pointwise_filters,
+                      name=linear.name)
+    else:
+        weights = tf.convert_to_tensor(linear.weights)
+        # as in Linear.compute, the stored weights are normalized before being transposed
+        if linear.weight_norm:
+            weights = tf.math.l2_normalize(weights, axis=[0])
+        if linear.transpose_weights:
+            weights = tf.transpose(weights)
+        weights = tf.Variable(weights * scale, name="weights")
+        return Linear(linear.input,
+                      n_units=linear.n_units,
+                      weights=weights,
+                      add_bias=True,
+                      bias=bias,
+                      sparse_weights=linear.sparse_weights,
+                      shape=linear.shape,
+                      dtype=linear.dtype,
+                      name=linear.name)
+
+
 class Dropout(Layer):
     """ Dropout
 
@@ -2364,21 +2644,42 @@ class DropLookup(Layer):
     the lookup ids in a sample are [1,2,1] and id 1 is selected for dropout,
     the first and last vectors will be set to 0 for this sample.
 
-    !!! warning
-        contrary to Dropout, this lookup cannot be shared, meaning that reuse_with will just apply a new random mask to
-        the new Lookup layer, instead of sharing the same mask.
-
-    Args:
-        lookup_layer: a Lookup input layer
-        scale: if scale is True, scales the non-dropped lookups by x / (1 - probability)
+    The mask is not drawn for the `[batch_size, n_unique]` space of possible `(sample, id)` pairs, instead each
+    `(seed, sample, id)` coordinate is hashed into a uniform value (see `tx.hash_uniform`), so only a mask with the
+    shape of the indices is ever computed. The seed is drawn at each evaluation by a `mask_seed` layer, stored in
+    the layer state, if `locked=True`, `reuse_with` shares this seed, meaning that the same ids in the same samples
+    are dropped in the new Lookup.
 
+    For sparse indices, each sparse row is a sequence position and the dropout is applied to the lookup weights
+    (the values of the sparse tensor) before the lookup is computed, this also drops ids that are summed together
+    in the same position.
 
+    Args:
+        lookup_layer (`Lookup`): a Lookup input layer
+        indices (`Layer`): the indices used by the lookup layer, if None uses the input of the lookup layer
+        probability (`float`): probability of dropping an id from a sample
+        scale (`bool`): if scale is True, scales the non-dropped lookups by x / (1 - probability)
+        locked (`bool`): if True, layers created with `reuse_with` share the dropout mask with the current layer
+        seed (`int`): op-level seed used to draw the seed for the hashed mask
+        share_state_with (`DropLookup`): a DropLookup layer with which this layer shares the mask seed
+        name (`str`): layer name
     """
 
-    def __init__(self, lookup_layer, indices=None, probability=0.5, scale=True, name="drop_lookup"):
+    def __init__(self,
+                 lookup_layer,
+                 indices=None,
+                 probability=0.5,
+                 scale=True,
+                 locked=True,
+                 seed=None,
+                 share_state_with=None,
+                 name="drop_lookup"):
         if not isinstance(lookup_layer, Lookup):
             raise TypeError("input layer should be a {} layer {} found instead".format(str(Lookup), type(lookup_layer)))
 
+        if share_state_with is not None and not isinstance(share_state_with, DropLookup):
+            raise TypeError(f"share_state_with should be a {DropLookup} layer: {type(share_state_with)} found instead")
+
         # DropLookup gets the input layer of the lookup layer to get it's indices
         # because it's a lookup layer, it must have indices
         if indices is None:
@@ -2386,42 +2687,109 @@ class DropLookup(Layer):
 
         self.scale = scale
         self.probability = probability
-        super().__init__(inputs=[lookup_layer, indices], n_units=lookup_layer.n_units, name=name)
+        self.locked = locked
+        self.seed = seed
+        self.share_state_with = share_state_with
+        super().__init__(inputs=[lookup_layer, indices],
+                         n_units=lookup_layer.n_units,
+                         dtype=lookup_layer.dtype,
+                         name=name)
 
     def compute_shape(self):
         return self.input.shape
 
-    def compute(self, input_value, indices):
-        if self.probability == 1:
-            return tf.zeros_like(input_value, dtype=tf.float32)
-        elif self.probability > 0:
-            lookup_shape = tf.shape(input_value)
-            batch_size, seq_size = lookup_shape[0], lookup_shape[1]
+    def init_state(self):
+        indices = self.inputs[1]
 
-            if isinstance(indices, tf.SparseTensor):
-                _, ids = tf.split(indices.indices, 2, axis=-1)
-            else:
-                ids = indices
+        if self.share_state_with is None:
+            layer_state = super().init_state()
+
+            @layer(n_units=0, dtype=tf.int64, name="mask_seed")
+            def mask_seed(_):
+                return tf.random.uniform([], maxval=2 ** 31 - 1, dtype=tf.int64, seed=self.seed)
+
+            with layer_scope(self):
+                layer_state.mask_seed = mask_seed(indices)
+        else:
+            layer_state = self.share_state_with.layer_state
 
-            unique_ids, indices = tf.unique(tf.reshape(ids, [-1]))
-            mask_shape = tf.stack([batch_size, tf.size(unique_ids)])
-            unique_mask = tf.random.uniform(mask_shape, dtype=tf.float32)
+        # the mask seed is a new dependency computed once per evaluation, shared by all the layers in this state
+        self._inputs.append(layer_state.mask_seed)
 
-            batch_wise = tf.broadcast_to(tf.expand_dims(tf.range(batch_size), axis=-1),
-                                         tf.stack([batch_size, seq_size]))
-            unique_batch_wise = tf.reshape(indices, [batch_size, seq_size])
+        return layer_state
 
-            # gather mask and convert it to binary mask
-            mask_indices = tf.stack([batch_wise, unique_batch_wise], axis=-1)
-            binary_mask = tf.floor(tf.gather_nd(unique_mask, mask_indices) + (1 - self.probability))
-            if self.scale:
-                binary_mask /= (1 - self.probability)
+    def compute(self, input_value, indices, mask_seed=None):
+        if mask_seed is None:
+            mask_seed = self.layer_state.mask_seed.compute(indices)
 
-            dropped_lookup = input_value * tf.expand_dims(binary_mask, axis=-1)
-        else:
-            dropped_lookup = input_value
+        lookup = self.inputs[0]
+        with layer_scope(self):
+            if self.probability == 1:
+                return tf.zeros_like(input_value, dtype=self.dtype)
+            elif self.probability > 0:
+                keep_prob = 1 - self.probability
+
+                if isinstance(indices, tf.SparseTensor):
+                    if indices.shape.rank == 1:
+                        # 1D sparse lookups have one id per row (see Lookup)
+                        rows = tf.range(tf.shape(indices.indices, out_type=tf.int64)[0])
+                        ids = indices.indices[:, 0]
+                        indices = tf.SparseTensor(tf.stack([rows, ids], axis=-1),
+                                                  indices.values,
+                                                  tf.stack([tf.size(rows, out_type=tf.int64), indices.dense_shape[0]]))
+                    else:
+                        rows, ids = indices.indices[:, 0], indices.indices[:, 1]
+
+                    # each sparse row is a sequence position
+                    samples = rows // lookup.seq_size
+                    keep = hash_uniform(samples, ids, seed=mask_seed, dtype=tf.float64) >= self.probability
+
+                    # sparse lookups sum the entries of each row, the lookup of the dropped entries is subtracted
+                    # from the input lookup instead of computing the lookup of all the kept entries again
+                    # (without updating the lookup frequency of the dropped ids a second time)
+                    dropped = lookup._lookup(tf.sparse.retain(indices, tf.logical_not(keep)))
+                    # the lookup of the dropped entries can have less rows
+                    padding = tf.shape(input_value)[0] - tf.shape(dropped)[0]
+                    dropped = tf.pad(dropped, tf.stack([[0, padding], [0, 0], [0, 0]]))
+                    dropped_lookup = input_value - tf.cast(dropped, self.dtype)
+                    if self.scale:
+                        dropped_lookup /= keep_prob
+                else:
+                    ids = tf.reshape(indices, tf.stack([tf.shape(indices)[0], -1]))
+                    samples = tf.expand_dims(tf.range(tf.shape(ids, out_type=ids.dtype)[0]), axis=-1)
+
+                    binary_mask = tf.cast(hash_uniform(samples, ids, seed=mask_seed, dtype=tf.float64) >= self.probability,
+                                          self.dtype)
+                    if self.scale:
+                        binary_mask /= keep_prob
+
+                    # lookups can be padded both in batch and sequence dimensions
+                    padding = tf.shape(input_value)[:2] - tf.shape(binary_mask)
+                    binary_mask = tf.pad(binary_mask, tf.stack([[0, padding[0]], [0, padding[1]]]))
+
+                    dropped_lookup = input_value * tf.expand_dims(binary_mask, axis=-1)
+            else:
+                dropped_lookup = input_value
+
+            return dropped_lookup
 
-        return dropped_lookup
+    def _reuse_with_inputs(self, lookup_layer, indices, *mask_seed):
+        # the mask seed is added by init_state from the (shared) layer state
+        return self.reuse_with(lookup_layer, indices)
+
+    def reuse_with(self, lookup_layer, indices=None, locked=None, name=None):
+        locked = self.locked if locked is None else locked
+        name = self.name if name is None else name
+        share_state_with = self if locked else None
+
+        return DropLookup(lookup_layer,
+                          indices=indices,
+                          probability=self.probability,
+                          scale=self.scale,
+                          locked=locked,
+                          seed=self.seed,
+                          share_state_with=share_state_with,
+                          name=name)
 
 
 class BaseRNNCell(Layer, ABC):
@@ -2434,6 +2802,8 @@ class BaseRNNCell(Layer, ABC):
         n_units (`int`): number of activation units for the RNN cell
         dtype: Layer (output) dtype
     """
+    # cells that implement recurrent_step over the outputs of input_projection
+    supports_projection = False
 
     @staticmethod
     def zero_state(n_units, name="zero_state"):
@@ -2589,6 +2959,80 @@ class BaseRNNCell(Layer, ABC):
         output_shape = (input_shape[0], self.n_units)
         return tf.TensorShape(output_shape)
 
+    @property
+    def projectable(self):
+        """ `True` if the input projections can be computed for an entire sequence before a recurrent loop
+
+        This is not the case if the cell doesn't implement `recurrent_step` (`supports_projection` is `False`), or
+        if the cell is regularized with dropout on the inputs, recurrent state, or outputs, because these are applied
+        to each step by the cell graph.
+        """
+        if not self.supports_projection:
+            return False
+        return not (self.regularized and any(p for p in (self.x_dropout, self.r_dropout, self.y_dropout)))
+
+    def input_projection(self, input_tensor):
+        """ input_projection
+
+        Computes the input-side projections of the cell (which don't depend on the previous state) for an input
+        tensor of any rank, e.g. an entire sequence `[time_step,batch_size,n_inputs]` at once.
+
+        Args:
+            input_tensor (`Tensor`): input tensor with shape `[...,n_inputs]`
+
+        Returns:
+            projection (`Tensor`): projections to be passed to `recurrent_step` or None if the cell doesn't
+            support precomputed projections.
+        """
+        if not self.supports_projection:
+            return None
+        w = getattr(self.layer_state, "w", None)
+        return w.compute(input_tensor) if isinstance(w, Layer) else None
+
+    def step(self, input_tensor, *previous_state):
+        """ step
+
+        Computes a single recurrent step from input and state tensors, using `input_projection` and
+        `recurrent_step` if the cell is `projectable` or the cell output and state layers otherwise.
+
+        Args:
+            input_tensor (`Tensor`): input for the current step with shape `[batch_size,n_inputs]`
+            *previous_state (`Tensor`): previous state tensors
+
+        Returns:
+            output, state (`Tuple[Tensor,Tuple[Tensor]]`): the cell output and the new state
+        """
+        if self.projectable:
+            output, state = self.recurrent_step(self.input_projection(input_tensor), *previous_state)
+            return output, tuple(state)
+        else:
+            output = self.compute(input_tensor, *previous_state)
+            state = tuple(state_i.compute(input_tensor, *previous_state) for state_i in self.state)
+            return output, state
+
+    def assign_gate_weights(self, w, u, bias=None):
+        """ assign_gate_weights
+
+        Loads per-gate weights into the cell fused kernels, with the gates in the same order as the cell
+        projections (e.g. `[i,f,c,o]` for `LSTMCell` and `[z,r,c]` for `GRUCell`). This can be used to load
+        weights from models that used a separate `Linear` layer for each gate, e.g. reading the values from an
+        older checkpoint with `tf.train.load_checkpoint(path).get_tensor(key)`.
+
+        Args:
+            w (`List[Tensor]`): input kernels, each with shape `[n_inputs,n_units]`
+            u (`List[Tensor]`): recurrent kernels, each with shape `[n_units,n_units]`
+            bias (`Optional[List[Tensor]]`): input biases each with shape `[n_units]`
+        """
+        w_layer = self.layer_state.w
+        u_layer = self.layer_state.u
+        w_layer = w_layer.inner_layer if isinstance(w_layer, ViewLayer) else w_layer
+        u_layer = u_layer.inner_layer if isinstance(u_layer, ViewLayer) else u_layer
+
+        w_layer.weights.assign(tf.concat(as_list(w), axis=-1))
+        u_layer.weights.assign(tf.concat(as_list(u), axis=-1))
+        if bias is not None:
+            w_layer.bias.assign(tf.concat(as_list(bias), axis=-1))
+
     def reuse_with(self, input_layer, *previous_state, regularized=None, name=None, **kwargs):
         # because we use objects and not scopes we can use self always on share state with
         share_state_with = self  # self if self.share_state_with is None else self.share_state_with
@@ -2615,6 +3059,44 @@ class BaseRNNCell(Layer, ABC):
         )
 
 
+def _unroll_loop(body, loop_vars, n, start=0, unroll=False, parallel_iterations=10, name="loop"):
+    """ runs `loop_vars = body(k, *loop_vars)` for `k` in `[start, n)`
+
+    If `unroll` is `True` and `n` is a python `int` the loop is unrolled in the graph, if `unroll` is an
+    `int > 1` each iteration of the `tf.while_loop` computes `unroll` steps, with the remaining steps computed
+    by a second loop.
+    """
+    loop_vars = tuple(loop_vars)
+    if unroll is True:
+        if isinstance(n, int):
+            for k in range(start, n):
+                loop_vars = tuple(body(k, *loop_vars))
+            return loop_vars
+        else:
+            # number of steps is not known statically
+            unroll = False
+
+    block = unroll if unroll and unroll > 1 else 1
+
+    def block_body(block_size, k, *block_vars):
+        for j in range(block_size):
+            block_vars = tuple(body(k + j, *block_vars))
+        return (k + block_size,) + block_vars
+
+    k, *loop_vars = tf.while_loop(cond=lambda k, *_: k + block <= n,
+                                  body=partial(block_body, block),
+                                  loop_vars=(start,) + loop_vars,
+                                  parallel_iterations=parallel_iterations,
+                                  name=name)
+    if block > 1:
+        k, *loop_vars = tf.while_loop(cond=lambda k, *_: k < n,
+                                      body=partial(block_body, 1),
+                                      loop_vars=(k,) + tuple(loop_vars),
+                                      parallel_iterations=parallel_iterations,
+                                      name=f"{name}_remainder")
+    return tuple(loop_vars)
+
+
 class RNN(Layer):
     """ Recurrent Layer
 
@@ -2626,6 +3108,16 @@ class RNN(Layer):
 
     Args:
         input_seq: a Layer whose tensor has the shape [time_step,batch_size,feature_size] with time_step>=1
+        sequence_length (`Optional[Layer]`): a layer or tensor with shape `[batch_size]` with the number of valid
+            time steps of each example. If given, the state of each example is frozen after its last step and
+            outputs after that are zero (for `reverse=True` the recurrence starts at the last valid step).
+        compact (`bool`): if `True` and `sequence_length` is given, the batch is sorted by length and each step
+            only computes the prefix of examples that are still active. Ignored if the cell uses dropout, since
+            dropout masks have a fixed batch size.
+        unroll (`Union[bool,int]`): if `True` and the number of time steps is known statically, the loop over
+            the sequence is unrolled in the graph, this is usually faster for short sequences at the cost of a
+            larger graph. If an `int > 1`, each iteration of the loop computes `unroll` time steps.
+        parallel_iterations (`int`): number of loop iterations allowed to run in parallel (see `tf.while_loop`)
 
     Attributes:
         cell: a Layer of type RecurrentCell used in the unrolled steps
@@ -2643,6 +3135,10 @@ class RNN(Layer):
                  regularized=False,
                  stateful=False,
                  return_state=False,
+                 sequence_length=None,
+                 compact=False,
+                 unroll=False,
+                 parallel_iterations=1,
                  name="rnn_layer",
                  share_state_with: Optional['RNN'] = None
                  ):
@@ -2662,9 +3158,16 @@ class RNN(Layer):
         self.stateful = stateful
         self.return_state = return_state
         self.share_state_with = share_state_with
+        self.sequence_length = as_layer(sequence_length) if sequence_length is not None else None
+        self.compact = compact
+        self.unroll = unroll
+        self.parallel_iterations = parallel_iterations
+
+        # sequence length goes before the previous state which can be added in init_state
+        seq_inputs = [input_seq] + as_list(self.sequence_length)
 
         # n_units and shape are set after the first cell is created
-        super().__init__(inputs=[input_seq] + as_list(previous_state),
+        super().__init__(inputs=seq_inputs + as_list(previous_state),
                          n_units=cell_config.kwargs["n_units"],
                          dtype=tf.float32,
                          name=name,
@@ -2673,6 +3176,9 @@ class RNN(Layer):
                          reverse=reverse,
                          stateful=stateful,
                          return_state=return_state,
+                         compact=compact,
+                         unroll=unroll,
+                         parallel_iterations=parallel_iterations,
                          share_state_with=share_state_with)
 
     def compute_shape(self):
@@ -2731,64 +3237,130 @@ class RNN(Layer):
     def compute(self, input_seq, *prev_state):
         # TODO we could call this h_state, c_state (with h being the hidden state of the last layer)
         #
+        if self.sequence_length is not None:
+            sequence_length, *prev_state = prev_state
+        else:
+            sequence_length = None
+
         with layer_scope(self):
-            seq_len = tf.shape(input_seq)[0]
-            input_ta = tf.TensorArray(dtype=input_seq.dtype, size=seq_len, tensor_array_name="inputs",
-                                      clear_after_read=False)
-            input_ta = input_ta.unstack(input_seq)
-            output_ta = tf.TensorArray(dtype=self.dtype, size=seq_len, tensor_array_name="outputs")
-            # state_ta = tf.TensorArray(dtype=self.dtype, size=seq_len, tensor_array_name="states")
+            cell = self.layer_state.cell
+            projection = cell.input_projection(input_seq) if cell.projectable else None
 
-            if self.reverse:
-                i0 = seq_len - 1
-                ii = i0 - 1
-                fi = 0
+            if projection is not None:
+                # input projections are computed for the entire sequence, only the recurrent part is in the loop
+                input_seq = projection
+
+                def cell_step(xt, previous_state):
+                    output_t, state_t = cell.recurrent_step(xt, *previous_state)
+                    return output_t, tuple(state_t)
             else:
-                i0 = 0
-                ii = i0 + 1
-                fi = seq_len
+                def cell_step(xt, previous_state):
+                    return cell.step(xt, *previous_state)
 
-            x0 = input_ta.read(i0)
-            output_ta = output_ta.write(i0, self.cell.compute(x0, *prev_state))
-            state = tuple([state_i.compute(x0, *prev_state) for state_i in self.cell.state])
-            cell = self.layer_state.cell
+            # the initial state might not have the batch dimension, the gradients through the recurrent steps
+            # require the state to have the same shape at every step
+            batch_size = tf.shape(input_seq)[1]
+            if self.stateful:
+                # a fresh (or reset) state variable has shape [1,n] and is assigned the [batch_size,n] state below,
+                # graph optimizations assume the variable is read with the assigned shape, so the initial state is
+                # created with the batch size instead of being read from the variable
+                def initial_state(zero_state, state):
+                    shape = tf.stack([batch_size, tf.shape(state)[-1]])
+                    return tf.cond(zero_state.counter > 0,
+                                   lambda: state,
+                                   lambda: zero_state.init(shape, dtype=state.dtype))
+
+                prev_state = [initial_state(zero_state, s) for zero_state, s in zip(cell.previous_state, prev_state)]
+            else:
+                prev_state = [tf.broadcast_to(s, tf.stack([batch_size, tf.shape(s)[-1]])) for s in prev_state]
 
-            # state_ta = state_ta.write(i0, state)
+            compact = False
+            if sequence_length is None:
+                def step(t, xt, previous_state):
+                    return cell_step(xt, previous_state)
+            else:
+                sequence_length = tf.cast(sequence_length, tf.int32)
+
+                # dropout masks are fixed for the full batch, so we can't compute the steps on a subset of it
+                compact = self.compact and cell.projectable
+                if compact:
+                    # sort by descending length so that the active examples at each step are a prefix of the batch
+                    order = tf.argsort(sequence_length, direction="DESCENDING", stable=True)
+                    sequence_length = tf.gather(sequence_length, order)
+                    input_seq = tf.gather(input_seq, order, axis=1)
+                    prev_state = [tf.gather(s, order) for s in prev_state]
+
+                    def step(t, xt, previous_state):
+                        n = tf.reduce_sum(tf.cast(sequence_length > t, tf.int32))
+                        output_t, state_t = cell_step(xt[:n], tuple(s[:n] for s in previous_state))
+                        output_t = tf.pad(output_t, [[0, batch_size - n], [0, 0]])
+                        state_t = tuple(tf.ensure_shape(tf.concat([s_t, s[n:]], axis=0), s.shape)
+                                        for s_t, s in zip(state_t, previous_state))
+                        return output_t, state_t
+                else:
+                    def step(t, xt, previous_state):
+                        active = tf.expand_dims(t < sequence_length, -1)
+                        output_t, state_t = cell_step(xt, previous_state)
+                        output_t = tf.where(active, output_t, tf.zeros_like(output_t))
+                        state_t = tuple(tf.where(active, s_t, s) for s_t, s in zip(state_t, previous_state))
+                        return output_t, state_t
+
+            seq_len = input_seq.shape[0] if self.unroll is True and input_seq.shape[0] is not None else \
+                tf.shape(input_seq)[0]
+            input_ta = tf.TensorArray(dtype=input_seq.dtype, size=seq_len, tensor_array_name="inputs",
+                                      clear_after_read=False)
+            input_ta = input_ta.unstack(input_seq)
+            output_ta = tf.TensorArray(dtype=self.dtype, size=seq_len, tensor_array_name="outputs")
 
-            def rnn_unroll(seq_i, outputs, previous_state):
+            def rnn_unroll(k, outputs, previous_state):
+                seq_i = seq_len - 1 - k if self.reverse else k
                 xt = input_ta.read(seq_i)
-                c = cell.compute(xt, *previous_state)
-                curr_state = tuple([state_i.compute(xt, *previous_state) for state_i in self.cell.state])
-
+                c, curr_state = step(seq_i, xt, previous_state)
                 outputs = outputs.write(seq_i, c)
-                if self.reverse:
-                    seq_i = seq_i - 1
-                else:
-                    seq_i = seq_i + 1
-                return seq_i, outputs, curr_state
-
-            i, out, last_state = tf.while_loop(cond=lambda step_i, *_: tf.math.not_equal(step_i, fi),
-                                               body=rnn_unroll,
-                                               loop_vars=(ii, output_ta, state),
-                                               name="rnn_unroll",
-                                               parallel_iterations=1)
+                return outputs, curr_state
+
+            # the first step is outside the loop, the initial state might not have the batch dimension
+            output_ta, state = rnn_unroll(0, output_ta, tuple(prev_state))
+            out, last_state = _unroll_loop(rnn_unroll,
+                                           loop_vars=(output_ta, state),
+                                           n=seq_len,
+                                           start=1,
+                                           unroll=self.unroll,
+                                           parallel_iterations=self.parallel_iterations,
+                                           name="rnn_unroll")
+
+            if compact:
+                # restore the original batch order
+                inverse = tf.argsort(order)
+                last_state = tuple(tf.gather(s, inverse) for s in last_state)
 
             # getting the results and store them in the previous state
             if self.stateful:
-                for zero_state, last_state in zip(cell.previous_state, last_state):
-                    zero_state.variable.assign(last_state)
+                for zero_state, last_state_i in zip(cell.previous_state, last_state):
+                    zero_state.variable.assign(last_state_i)
+                    zero_state.counter.assign_add(1)
                 out = out.stack()
             else:
                 out = out.stack()
 
+            if compact:
+                out = tf.gather(out, inverse, axis=1)
+
             # TODO another solution would be to have a separate var for the last state and another for previous state
             if self.return_state:
                 return out, last_state
             else:
                 return out
 
+    def _reuse_with_inputs(self, input_seq, *inputs):
+        if self.sequence_length is not None:
+            sequence_length, *previous_state = inputs
+        else:
+            sequence_length, previous_state = None, inputs
+        return self.reuse_with(input_seq, *previous_state, sequence_length=sequence_length)
+
     def reuse_with(self, input_seq, *previous_state, regularized=None, reverse=None, stateful=None,
-                   return_state=None, name=None):
+                   return_state=None, sequence_length=None, name=None):
         name = self.name if name is None else None
         regularized = self.regularized if regularized is None else regularized
         reverse = self.reverse if reverse is None else reverse
@@ -2796,6 +3368,7 @@ class RNN(Layer):
         previous_state = self.previous_state if not previous_state else previous_state
         return_state = self.return_state if return_state is None else return_state
         stateful = self.stateful if stateful is None else stateful
+        sequence_length = self.sequence_length if sequence_length is None else sequence_length
 
         return RNN(input_seq=input_seq,
                    previous_state=previous_state,
@@ -2804,75 +3377,407 @@ class RNN(Layer):
                    stateful=stateful,
                    reverse=reverse,
                    return_state=return_state,
+                   sequence_length=sequence_length,
+                   compact=self.compact,
+                   unroll=self.unroll,
+                   parallel_iterations=self.parallel_iterations,
                    share_state_with=share_state_with,
                    name=name)
 
-    def reset(self):
+    def reset(self, mask=None):
+        """ reset
+
+        resets the state of a stateful recurrent layer
+
+        Args:
+            mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size]`, if given only the states of the
+                examples where mask is `True` are reset.
+        """
         if self.stateful:
-            return tf.group([state.reset() for state in self.cell.previous_state])
+            return tf.group([state.reset(mask) for state in self.cell.previous_state])
         else:
             return None
 
+    def step_fn(self, compile=True):
+        """ step_fn
 
-class RNNCell(BaseRNNCell):
-    """ Recurrent Cell
-        Corresponds to a single step on an unrolled RNN network
+        Creates a function `step(x_t, *state) -> (y_t, state)` that computes a single recurrent step with the
+        (non-regularized) cell of this layer. Unlike calling the layer on a sequence of length 1, this doesn't
+        build a loop over the sequence or read and write the state variables of stateful layers, the state is
+        given explicitly, which is useful for incremental inference (see `SessionState`).
 
         Args:
-                input_layer: the input layer to the RNN Cell
-                n_units: number of output units for this RNN Cell
-                previous_state: a RNNCell from which we can extract output
-                activation: activation function to be used in the cell
-                share_state_with: a ``Layer`` with the same number of units than this Cell
-                name: name for the RNN cell
-                share_state_with (`RNNCell or None`):
+            compile (`bool`): if True returns a `tf.function` for inputs with any batch size
+
+        Returns:
+            step (`Callable`): step function receiving an input with shape `[batch_size,n_inputs]` and the state
+            tensors each with shape `[batch_size,state_size]`
         """
+        cell = self.cell
+        if cell.regularized:
+            cell = cell.reuse_with(cell.input, *cell.previous_state, regularized=False)
 
-    def __init__(self,
-                 input_layer,
-                 n_units,
-                 previous_state=None,
-                 activation=tf.tanh,
-                 w_init=tf.initializers.glorot_uniform(),
-                 u_init=tf.initializers.glorot_uniform(),
-                 bias_init=tf.initializers.zeros(),
-                 share_state_with=None,
-                 w_dropconnect=None,
-                 u_dropconnect=None,
-                 r_dropout=None,
-                 x_dropout=None,
-                 y_dropout=None,
-                 dropout_locked=True,
-                 regularized=False,
-                 name="rnn_cell"):
+        def step(x_t, *state):
+            return cell.step(x_t, *state)
 
-        self.share_state_with = share_state_with
+        if compile:
+            signature = [tf.TensorSpec([None, self.input.shape[-1]], dtype=self.input.dtype)]
+            signature += [tf.TensorSpec([None, n], dtype=self.dtype) for n in cell.state_size]
+            step = tf.function(step, input_signature=signature)
+        return step
 
-        # TODO add all attributes here for readability
-        #  consider adding a get config method where users can add the params manually to each class
 
-        # attributes
-        self.output = None
-        self.state = None
+class SessionState:
+    """ SessionState
 
-        # variables
-        # TODO careful because putting this after state being created will overwrite it
-        self.w = None
-        self.u = None
+    Container for the recurrent state of multiple concurrent sessions (e.g. streams being decoded one token at a
+    time), stored in variables with one row per session. Each call to `step` gathers the state of the given
+    sessions, runs a single recurrent step for all of them in a batch, and writes back the new state, all in a
+    single compiled function.
 
-        super().__init__(input_layer=input_layer,
-                         previous_state=previous_state,
-                         state_size=[n_units],
-                         n_units=n_units,
-                         activation=activation,
-                         bias_init=bias_init,
-                         dtype=tf.float32,
-                         w_init=w_init,
-                         u_init=u_init,
-                         w_dropconnect=w_dropconnect,
-                         u_dropconnect=u_dropconnect,
-                         x_dropout=x_dropout,
-                         r_dropout=r_dropout,
+    Example:
+        ```python
+        sessions = tx.SessionState(rnn, capacity=1000)
+        a, b = sessions.open(2)
+        y = sessions.step(x, [a, b])  # x has shape [2, n_inputs]
+        sessions.close(a)
+        ```
+
+    Args:
+        rnn (`Union[RNN,BaseRNNCell]`): recurrent layer or cell used to compute each step
+        capacity (`int`): maximum number of concurrent sessions
+    """
+
+    def __init__(self, rnn, capacity):
+        if isinstance(rnn, RNN):
+            step_fn = rnn.step_fn(compile=False)
+            cell = rnn.cell
+            n_inputs = rnn.input.shape[-1]
+            input_dtype = rnn.input.dtype
+        elif isinstance(rnn, BaseRNNCell):
+            cell = rnn
+            step_fn = cell.step
+            n_inputs = cell.input.shape[-1]
+            input_dtype = cell.input.dtype
+        else:
+            raise TypeError(f"expected RNN or BaseRNNCell, got {type(rnn)} instead")
+
+        self.capacity = capacity
+        self.state = [tf.Variable(tf.zeros([capacity, n], dtype=cell.dtype), trainable=False, name="session_state")
+                      for n in cell.state_size]
+        self._free = list(reversed(range(capacity)))
+
+        @tf.function(input_signature=[tf.TensorSpec([None, n_inputs], dtype=input_dtype),
+                                      tf.TensorSpec([None], dtype=tf.int32)])
+        def step(x_t, sessions):
+            indices = tf.expand_dims(sessions, -1)
+            previous_state = [tf.gather(state, sessions) for state in self.state]
+            output, state = step_fn(x_t, *previous_state)
+            for var, state_i in zip(self.state, state):
+                var.scatter_nd_update(indices, state_i)
+            return output
+
+        self._step = step
+
+    @property
+    def active(self):
+        """ number of open sessions """
+        return self.capacity - len(self._free)
+
+    def open(self, n=1):
+        """ opens `n` new sessions with zero state
+
+        Returns:
+            sessions (`List[int]`): session ids
+        """
+        if n > len(self._free):
+            raise ValueError(f"cannot open {n} sessions: only {len(self._free)} of {self.capacity} available")
+        sessions = [self._free.pop() for _ in range(n)]
+        self.reset(sessions)
+        return sessions
+
+    def close(self, sessions):
+        """ closes the given sessions, releasing their state """
+        for session in as_list(sessions):
+            if session in self._free:
+                raise ValueError(f"session {session} is not open")
+            self._free.append(session)
+
+    def reset(self, sessions):
+        """ resets the state of the given sessions to zero """
+        indices = tf.expand_dims(tf.constant(as_list(sessions), dtype=tf.int32), -1)
+        for var in self.state:
+            var.scatter_nd_update(indices, tf.zeros([tf.shape(indices)[0], var.shape[-1]], dtype=var.dtype))
+
+    def read(self, sessions):
+        """ returns the state tensors of the given sessions """
+        sessions = tf.constant(as_list(sessions), dtype=tf.int32)
+        return tuple(tf.gather(var, sessions) for var in self.state)
+
+    def step(self, x_t, sessions):
+        """ step
+
+        Computes a recurrent step for the given sessions and updates their state
+
+        Args:
+            x_t (`Tensor`): input for each session with shape `[len(sessions),n_inputs]`
+            sessions (`List[int]`): session ids, each session should appear only once
+
+        Returns:
+            output (`Tensor`): output for each session with shape `[len(sessions),n_units]`
+        """
+        return self._step(x_t, tf.constant(as_list(sessions), dtype=tf.int32))
+
+
+class BiRNN(Layer):
+    """ Bidirectional Recurrent Layer
+
+    Runs a forward and a backward (`reverse=True`) `RNN` over the same time-major sequence
+    `[time_step,batch_size,feature_size]` and merges their outputs. The two directions have no data dependencies
+    between them, so when the layer is compiled to a graph (e.g. with `Graph.as_function` or `tf.function`) both
+    recurrent loops can be scheduled concurrently.
+
+    Args:
+        input_seq (`Layer`): a layer with shape `[time_step,batch_size,feature_size]`
+        cell_config (`LayerConfig`): recurrent cell configuration for the forward direction
+        backward_config (`Optional[LayerConfig]`): recurrent cell configuration for the backward direction, if None
+            uses `cell_config`
+        n_units (`Optional[int]`): number of units for a default `RNNCell` if `cell_config` is None
+        merge_mode (`str`): `"concat"` or `"sum"` of the forward and backward outputs
+        regularized (`bool`): if True, uses the regularized version of the cells
+        stateful (`bool`): if True, both directions store their last state as the initial state for the next call
+        return_state (`bool`): if True, also returns the last state of each direction `(fw_state, bw_state)`
+        sequence_length (`Optional[Layer]`): number of valid time steps of each example (see `RNN`)
+        compact (`bool`): if True, computes each step only on active examples (see `RNN`)
+        share_state_with (`Optional[BiRNN]`): a `BiRNN` layer with which the recurrent cells are shared
+
+    Attributes:
+        forward (`RNN`): forward recurrent layer
+        backward (`RNN`): backward recurrent layer
+    """
+
+    def __init__(self,
+                 input_seq,
+                 cell_config: Optional[LayerConfig] = None,
+                 backward_config: Optional[LayerConfig] = None,
+                 n_units=None,
+                 merge_mode="concat",
+                 regularized=False,
+                 stateful=False,
+                 return_state=False,
+                 sequence_length=None,
+                 compact=False,
+                 share_state_with: Optional['BiRNN'] = None,
+                 name="birnn"):
+        if not cell_config and not n_units:
+            raise ValueError("cell config and n_units cannot both be None")
+        if not cell_config:
+            cell_config = RNNCell.config(n_units=n_units)
+        backward_config = cell_config if backward_config is None else backward_config
+        if merge_mode not in ("concat", "sum"):
+            raise ValueError(f"merge_mode must be \"concat\" or \"sum\": {merge_mode} found")
+
+        fw_units = cell_config.kwargs["n_units"]
+        bw_units = backward_config.kwargs["n_units"]
+        if merge_mode == "sum" and fw_units != bw_units:
+            raise ValueError(f"sum merge requires the same number of units in both directions: "
+                             f"{fw_units} != {bw_units}")
+
+        self.cell_config = cell_config
+        self.backward_config = backward_config
+        self.merge_mode = merge_mode
+        self.regularized = regularized
+        self.stateful = stateful
+        self.return_state = return_state
+        self.sequence_length = as_layer(sequence_length) if sequence_length is not None else None
+        self.compact = compact
+        self.share_state_with = share_state_with
+
+        super().__init__(inputs=[input_seq] + as_list(self.sequence_length),
+                         n_units=fw_units + bw_units if merge_mode == "concat" else fw_units,
+                         dtype=tf.float32,
+                         name=name,
+                         cell_config=cell_config,
+                         backward_config=backward_config,
+                         merge_mode=merge_mode,
+                         regularized=regularized,
+                         stateful=stateful,
+                         return_state=return_state,
+                         compact=compact,
+                         share_state_with=share_state_with)
+
+    def compute_shape(self):
+        return self.input.shape[:-1] + self.n_units
+
+    def init_state(self):
+        layer_state = super().init_state()
+        input_seq = self.input
+
+        with layer_scope(self):
+            if self.share_state_with is not None:
+                def shared(rnn):
+                    # not rnn.reuse_with, which keeps the sequence_length of rnn if this layer has none
+                    return RNN(input_seq,
+                               previous_state=rnn.previous_state,
+                               cell_config=rnn.cell_config,
+                               regularized=self.regularized,
+                               stateful=self.stateful,
+                               reverse=rnn.reverse,
+                               return_state=True,
+                               sequence_length=self.sequence_length,
+                               compact=rnn.compact,
+                               unroll=rnn.unroll,
+                               parallel_iterations=rnn.parallel_iterations,
+                               share_state_with=rnn.share_state_with if rnn.share_state_with is not None else rnn,
+                               name=rnn.name)
+
+                fw = shared(self.share_state_with.layer_state.forward)
+                bw = shared(self.share_state_with.layer_state.backward)
+            else:
+                fw = RNN(input_seq,
+                         cell_config=self.cell_config,
+                         regularized=self.regularized,
+                         stateful=self.stateful,
+                         return_state=True,
+                         sequence_length=self.sequence_length,
+                         compact=self.compact,
+                         name="forward")
+                bw = RNN(input_seq,
+                         cell_config=self.backward_config,
+                         reverse=True,
+                         regularized=self.regularized,
+                         stateful=self.stateful,
+                         return_state=True,
+                         sequence_length=self.sequence_length,
+                         compact=self.compact,
+                         name="backward")
+
+            layer_state.forward = fw
+            layer_state.backward = bw
+
+        # the states of both directions are inputs to this layer
+        self._inputs += as_list(fw.previous_state) + as_list(bw.previous_state)
+        return layer_state
+
+    def compute(self, input_seq, *args):
+        fw = self.layer_state.forward
+        bw = self.layer_state.backward
+        args = list(args)
+        seq_len = [args.pop(0)] if self.sequence_length is not None else []
+        n_fw = len(fw.previous_state)
+        fw_state, bw_state = args[:n_fw], args[n_fw:]
+
+        with layer_scope(self):
+            # no dependencies between directions
+            fw_out, fw_last = fw.compute(input_seq, *seq_len, *fw_state)
+            bw_out, bw_last = bw.compute(input_seq, *seq_len, *bw_state)
+
+            if self.merge_mode == "concat":
+                output = tf.concat([fw_out, bw_out], axis=-1)
+            else:
+                output = fw_out + bw_out
+
+            if self.return_state:
+                return output, (fw_last, bw_last)
+            else:
+                return output
+
+    def _reuse_with_inputs(self, input_seq, *inputs):
+        n_seq = 1 if self.sequence_length is not None else 0
+        sequence_length = inputs[0] if n_seq else None
+        # the states of both directions come from the shared forward and backward layers
+        if any(new is not old for new, old in zip(inputs[n_seq:], self.inputs[1 + n_seq:])):
+            raise ValueError(f"cannot rebuild {self.name}: the previous states of a BiRNN can't be replaced")
+        return self.reuse_with(input_seq, sequence_length=sequence_length)
+
+    def reuse_with(self, input_seq, regularized=None, stateful=None, return_state=None, sequence_length=None,
+                   name=None):
+        regularized = self.regularized if regularized is None else regularized
+        stateful = self.stateful if stateful is None else stateful
+        return_state = self.return_state if return_state is None else return_state
+        sequence_length = self.sequence_length if sequence_length is None else sequence_length
+        share_state_with = self.share_state_with if self.share_state_with is not None else self
+        name = self.name if name is None else name
+
+        return BiRNN(input_seq=input_seq,
+                     cell_config=self.cell_config,
+                     backward_config=self.backward_config,
+                     merge_mode=self.merge_mode,
+                     regularized=regularized,
+                     stateful=stateful,
+                     return_state=return_state,
+                     sequence_length=sequence_length,
+                     compact=self.compact,
+                     share_state_with=share_state_with,
+                     name=name)
+
+    def reset(self, mask=None):
+        if self.stateful:
+            return tf.group([self.layer_state.forward.reset(mask), self.layer_state.backward.reset(mask)])
+        else:
+            return None
+
+
+class RNNCell(BaseRNNCell):
+    """ Recurrent Cell
+        Corresponds to a single step on an unrolled RNN network
+
+        Args:
+                input_layer: the input layer to the RNN Cell
+                n_units: number of output units for this RNN Cell
+                previous_state: a RNNCell from which we can extract output
+                activation: activation function to be used in the cell
+                share_state_with: a ``Layer`` with the same number of units than this Cell
+                name: name for the RNN cell
+                share_state_with (`RNNCell or None`):
+        """
+    supports_projection = True
+
+    def __init__(self,
+                 input_layer,
+                 n_units,
+                 previous_state=None,
+                 activation=tf.tanh,
+                 w_init=tf.initializers.glorot_uniform(),
+                 u_init=tf.initializers.glorot_uniform(),
+                 bias_init=tf.initializers.zeros(),
+                 share_state_with=None,
+                 w_dropconnect=None,
+                 u_dropconnect=None,
+                 r_dropout=None,
+                 x_dropout=None,
+                 y_dropout=None,
+                 dropout_locked=True,
+                 regularized=False,
+                 name="rnn_cell"):
+
+        self.share_state_with = share_state_with
+
+        # TODO add all attributes here for readability
+        #  consider adding a get config method where users can add the params manually to each class
+
+        # attributes
+        self.output = None
+        self.state = None
+
+        # variables
+        # TODO careful because putting this after state being created will overwrite it
+        self.w = None
+        self.u = None
+
+        super().__init__(input_layer=input_layer,
+                         previous_state=previous_state,
+                         state_size=[n_units],
+                         n_units=n_units,
+                         activation=activation,
+                         bias_init=bias_init,
+                         dtype=tf.float32,
+                         w_init=w_init,
+                         u_init=u_init,
+                         w_dropconnect=w_dropconnect,
+                         u_dropconnect=u_dropconnect,
+                         x_dropout=x_dropout,
+                         r_dropout=r_dropout,
                          y_dropout=y_dropout,
                          dropout_locked=dropout_locked,
                          regularized=regularized,
@@ -2939,6 +3844,11 @@ class RNNCell(BaseRNNCell):
         output = self.output.compute(input_layer, *previous_state)
         return output
 
+    def recurrent_step(self, projection, *previous_state):
+        previous_h, = previous_state
+        h = self.activation(projection + self.layer_state.u.compute(previous_h))
+        return h, (h,)
+
 
 # TODO needs tests
 class Gate(Layer):
@@ -3029,6 +3939,8 @@ class Lookup(Layer):
         name (`str`): layer name
         share_state_with (`Lookup`): a `Lookup` layer with which this layer shares its state
         batch_padding (`bool`): if True, pads the output according to `seq_size` and given (or inferred) `batch_size`
+        track_frequency (`bool`): if True, counts how many times each row is looked up in a `frequency` variable
+            (see `compact_lookup`)
 
     Returns:
         embeddings (`Tensor`): output tensor
@@ -3049,7 +3961,8 @@ class Lookup(Layer):
                  dtype=tf.float32,
                  name="lookup",
                  share_state_with=None,
-                 batch_padding=True
+                 batch_padding=True,
+                 track_frequency=False
                  ):
 
         self.weight_init = weight_init
@@ -3067,6 +3980,7 @@ class Lookup(Layer):
 
         self.weights = weights
         self.share_state_with = share_state_with
+        self.track_frequency = track_frequency
 
         super().__init__(inputs=input_layer,
                          n_units=n_units,
@@ -3131,6 +4045,16 @@ class Lookup(Layer):
                 bias = None
 
             layer_state.bias = bias
+
+            frequency = None
+            if self.share_state_with is not None:
+                frequency = getattr(self.share_state_with.layer_state, "frequency", None)
+            if frequency is None and self.track_frequency:
+                frequency = tf.Variable(initial_value=tf.zeros([self.embedding_shape[0]], dtype=tf.int64),
+                                        name="frequency", trainable=False)
+            if frequency is not None:
+                layer_state.frequency = frequency
+
         return layer_state
 
     def compute(self, input_tensor):
@@ -3158,6 +4082,19 @@ class Lookup(Layer):
                                      "if n_units < seq_size the lookup will be padded".format(shape[-1],
                                                                                               self.seq_size))
 
+        with layer_scope(self):
+            if self.track_frequency:
+                # on device histogram of row accesses, scatter_add accumulates repeated ids
+                if isinstance(input_tensor, tf.SparseTensor):
+                    ids = input_tensor.indices[:, -1]
+                else:
+                    ids = tf.reshape(tf.cast(input_tensor, tf.int64), [-1])
+                self.layer_state.frequency.scatter_add(tf.IndexedSlices(tf.ones_like(ids), ids))
+
+        return self._lookup(input_tensor)
+
+    def _lookup(self, input_tensor):
+        """ computes the lookup of a validated input tensor without updating the `frequency` of the ids """
         with layer_scope(self):
             # batch size is unknown for sparse lookups
             # y = xW
@@ -3324,7 +4261,373 @@ class Lookup(Layer):
                       dtype=self.dtype,
                       name=name,
                       share_state_with=share_state_with,
-                      batch_padding=self.batch_padding)
+                      batch_padding=self.batch_padding,
+                      track_frequency=self.track_frequency)
+
+
+def compact_lookup(lookup, min_count=1, n_buckets=1, counts=None, tied_layers=None, name=None):
+    """ compact_lookup
+
+    Builds a smaller `Lookup` that keeps a row for each id with at least `min_count` accesses and maps the remaining
+    (rare) ids to `n_buckets` shared rows (`id % n_buckets`), initialized with the mean of the rows in each bucket.
+    The new lookup takes the original ids as input: a remap table is gathered before the lookup.
+
+    Tied output layers (`Linear` layers using the lookup weights with `transpose_weights=True`) are rewritten to use the
+    compacted weights, their outputs are indexed by compacted ids, use `inverse` to map the kept ids back to the
+    original ids (buckets map to `-1`).
+
+    !!! example
+        ```python
+        lookup = tx.Lookup(ids, seq_size=4, embedding_shape=[vocab_size, 64], track_frequency=True)
+        logits = tx.Linear(h, weights=lookup.weights, transpose_weights=True)
+        # ... train ...
+        small_lookup, (small_logits,), remap, inverse = tx.compact_lookup(lookup, min_count=5, n_buckets=16,
+                                                                          tied_layers=[logits])
+        ```
+
+    Args:
+        lookup (`Lookup`): lookup layer to be compacted
+        min_count (`int`): minimum number of accesses for an id to keep its own row
+        n_buckets (`int`): number of shared rows for rare ids
+        counts (`Tensor`): access counts for each id, if None uses the `frequency` tracked by the lookup layer
+        tied_layers (`List[Linear]`): `Linear` layers tied to the lookup weights with `transpose_weights=True`
+        name (`str`): name for the new lookup, defaults to the original name
+
+    Returns:
+        lookup, tied_layers, remap, inverse (`Tuple[Lookup,List[Linear],Tensor,Tensor]`): the compacted lookup, the
+        rewritten tied layers, the remap table from original to compacted ids, and the inverse table from compacted
+        to original ids.
+    """
+    if not isinstance(lookup, Lookup):
+        raise TypeError(f"expected a Lookup layer: {type(lookup)} found")
+    if n_buckets < 1:
+        raise ValueError(f"n_buckets should be at least 1: {n_buckets} found")
+
+    if counts is None:
+        if not hasattr(lookup.layer_state, "frequency"):
+            raise ValueError("lookup is not tracking frequency (track_frequency=False) and counts were not given")
+        counts = lookup.layer_state.frequency
+    counts = tf.convert_to_tensor(counts)
+
+    vocab_size = lookup.embedding_shape[0]
+    ids = tf.range(vocab_size, dtype=tf.int64)
+    keep = counts >= min_count
+    kept_ids = tf.boolean_mask(ids, keep)
+    rare_ids = tf.boolean_mask(ids, tf.logical_not(keep))
+    n_kept = tf.shape(kept_ids, out_type=tf.int64)[0]
+
+    rare_buckets = rare_ids % n_buckets
+    remap = tf.tensor_scatter_nd_update(tf.zeros([vocab_size], dtype=tf.int64),
+                                        tf.expand_dims(kept_ids, -1),
+                                        tf.range(n_kept))
+    remap = tf.tensor_scatter_nd_update(remap, tf.expand_dims(rare_ids, -1), n_kept + rare_buckets)
+    inverse = tf.concat([kept_ids, tf.fill([n_buckets], tf.constant(-1, tf.int64))], axis=0)
+
+    def compact(param):
+        param = tf.convert_to_tensor(param)
+        buckets = tf.math.unsorted_segment_mean(tf.gather(param, rare_ids), rare_buckets, n_buckets)
+        return tf.concat([tf.gather(param, kept_ids), buckets], axis=0)
+
+    new_size = int(n_kept) + n_buckets
+    weights = tf.Variable(compact(lookup.weights), name="weights", trainable=True)
+    bias = tf.Variable(compact(lookup.bias), name="bias", trainable=True) if lookup.bias is not None else None
+
+    def remap_ids(x):
+        if isinstance(x, tf.SparseTensor):
+            columns = tf.gather(remap, x.indices[:, -1])
+            indices = tf.concat([x.indices[:, :-1], tf.expand_dims(columns, -1)], axis=-1)
+            dense_shape = tf.concat([x.dense_shape[:-1], [new_size]], axis=0)
+            return tf.sparse.reorder(tf.SparseTensor(indices, x.values, dense_shape))
+        else:
+            return tf.gather(remap, tf.cast(x, tf.int64))
+
+    input_layer = lookup.input
+    sparse_input = getattr(input_layer, "sparse", False)
+    n_units = new_size if sparse_input else input_layer.n_units
+    remapped = Lambda(input_layer,
+                      fn=remap_ids,
+                      n_units=n_units,
+                      shape=input_layer.shape[:-1] + [n_units],
+                      dtype=tf.int64,
+                      name="remap")
+
+    new_lookup = Lookup(remapped,
+                        seq_size=lookup.seq_size,
+                        embedding_shape=[new_size, lookup.n_units],
+                        batch_size=lookup.batch_size,
+                        weights=weights,
+                        add_bias=bias is not None,
+                        bias=bias,
+                        dtype=lookup.dtype,
+                        name=lookup.name if name is None else name,
+                        batch_padding=lookup.batch_padding,
+                        track_frequency=lookup.track_frequency)
+
+    new_tied = []
+    for linear in as_list(tied_layers):
+        if not isinstance(linear, Linear) or not linear.transpose_weights or linear.weights is not lookup.weights:
+            raise ValueError(f"{linear} is not tied to the lookup weights with transpose_weights=True")
+        tied_bias = tf.Variable(compact(linear.bias), name="bias") if linear.add_bias else None
+        new_tied.append(Linear(linear.input,
+                               n_units=new_size,
+                               weights=weights,
+                               transpose_weights=True,
+                               add_bias=linear.add_bias,
+                               bias=tied_bias,
+                               weight_norm=linear.weight_norm,
+                               dtype=linear.dtype,
+                               name=linear.name))
+
+    return new_lookup, new_tied, remap, inverse
+
+
+class AdaptiveSoftmax(Layer):
+    """ AdaptiveSoftmax
+
+    Efficient softmax approximation for large vocabularies [1]. Word ids are assumed to be sorted by decreasing
+    frequency, and `cutoffs` split the vocabulary into a **head**, with the `cutoffs[0]` most frequent words, and
+    a set of **tail** clusters `[cutoffs[i], cutoffs[i+1])`. The head predicts the frequent words plus one logit per
+    tail cluster, each tail predicts the words in its cluster from a lower dimensional projection of the input:
+
+    $$
+        \\log p(w|h) = \\log p_{head}(c(w)|h) + \\log p_{c(w)}(w|h)
+    $$
+
+    Calling this layer computes the exact log-probabilities over the entire vocabulary (inference mode). For training,
+    use `tx.AdaptiveSoftmaxLoss` (or `AdaptiveSoftmax.nll`) which evaluates each tail cluster only for the examples
+    whose targets fall in that cluster.
+
+    If a `Lookup` layer is given in `tied_lookup`, its embeddings are used as the output word vectors. The input is
+    projected to the embedding dimension, once for the head (only if the input and embedding dimensions differ)
+    and once for each tail cluster.
+
+    Args:
+        input_layer (`Layer`): input layer with the hidden representations `[...,n_hidden]`
+        n_units (`int`): vocabulary size
+        cutoffs (`List[int]`): increasing list of word ids (`0 < cutoffs[i] < n_units`) where each cluster starts
+        proj_factor (`int`): tail cluster `i` uses a projection with `n_hidden // proj_factor ** (i+1)` dimensions,
+            ignored if `tied_lookup` is given
+        tied_lookup (`Lookup`): optional `Lookup` layer with which the output word vectors are tied
+        add_bias (`bool`): if True adds a bias to the head and tail logits
+        weight_init (`Callable`): weights initializer
+        dtype (`tf.DType`): type for layer variables
+        name (`str`): layer name
+        share_state_with (`AdaptiveSoftmax`): `AdaptiveSoftmax` layer with which this layer shares its state
+
+    Returns:
+        log_probs (`Tensor`): log-probabilities for the entire vocabulary with shape `[...,n_units]`
+
+    References:
+        1. [Efficient softmax approximation for GPUs](https://arxiv.org/abs/1609.04309)
+    """
+
+    def __init__(self,
+                 input_layer,
+                 n_units,
+                 cutoffs,
+                 proj_factor=4,
+                 tied_lookup=None,
+                 add_bias=True,
+                 weight_init=glorot_uniform_init(),
+                 dtype=tf.float32,
+                 name="adaptive_softmax",
+                 share_state_with=None):
+
+        input_layer = as_layer(input_layer)
+        cutoffs = list(cutoffs)
+
+        if not cutoffs or cutoffs != sorted(set(cutoffs)) or cutoffs[0] <= 0 or cutoffs[-1] >= n_units:
+            raise ValueError(f"cutoffs should be a sorted list of unique ids in ]0,{n_units}[: {cutoffs} found")
+
+        if tied_lookup is not None:
+            if not isinstance(tied_lookup, Lookup):
+                raise TypeError(f"tied_lookup should be a {Lookup} layer: {type(tied_lookup)} found")
+            if tied_lookup.embedding_shape[0] != n_units:
+                raise ValueError(f"tied_lookup vocabulary size {tied_lookup.embedding_shape[0]} "
+                                 f"does not match n_units {n_units}")
+
+        if share_state_with is not None and not isinstance(share_state_with, AdaptiveSoftmax):
+            raise TypeError("Layer can only share variables with other layer of the same type (AdaptiveSoftmax)")
+
+        self.cutoffs = cutoffs
+        self.proj_factor = proj_factor
+        self.tied_lookup = tied_lookup
+        self.add_bias = add_bias
+        self.weight_init = weight_init
+        self.share_state_with = share_state_with
+
+        super().__init__(inputs=input_layer,
+                         n_units=n_units,
+                         dtype=dtype,
+                         name=name,
+                         cutoffs=cutoffs,
+                         proj_factor=proj_factor,
+                         tied_lookup=tied_lookup,
+                         add_bias=add_bias,
+                         weight_init=weight_init,
+                         share_state_with=share_state_with)
+
+    @property
+    def clusters(self):
+        """ list of `(start, end)` word id ranges for each tail cluster """
+        bounds = self.cutoffs + [self.n_units]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def compute_shape(self):
+        return self.input.shape[:-1] + [self.n_units]
+
+    def init_state(self):
+        if self.share_state_with is not None:
+            return self.share_state_with.layer_state
+
+        layer_state = super().init_state()
+        n_hidden = self.input.n_units
+        head_size = self.cutoffs[0]
+        n_clusters = len(self.clusters)
+
+        def variable(shape, name):
+            return tf.Variable(initial_value=self.weight_init(shape, dtype=self.dtype), name=name, trainable=True)
+
+        def bias(size, name):
+            return tf.Variable(initial_value=tf.zeros([size], dtype=self.dtype), name=name, trainable=True)
+
+        with layer_scope(self):
+            if self.tied_lookup is None:
+                layer_state.head_weights = variable([n_hidden, head_size + n_clusters], "head_weights")
+                dims = [max(1, n_hidden // self.proj_factor ** (i + 1)) for i in range(n_clusters)]
+                layer_state.tail_weights = [variable([dim, end - start], f"tail_weights_{i}")
+                                            for i, (dim, (start, end)) in enumerate(zip(dims, self.clusters))]
+            else:
+                embed_dim = self.tied_lookup.n_units
+                if n_hidden != embed_dim:
+                    layer_state.head_proj = variable([n_hidden, embed_dim], "head_proj")
+                layer_state.cluster_weights = variable([n_hidden, n_clusters], "cluster_weights")
+                dims = [embed_dim] * n_clusters
+
+            layer_state.tail_proj = [variable([n_hidden, dim], f"tail_proj_{i}") for i, dim in enumerate(dims)]
+
+            if self.add_bias:
+                layer_state.head_bias = bias(head_size + n_clusters, "head_bias")
+                layer_state.tail_bias = [bias(end - start, f"tail_bias_{i}")
+                                         for i, (start, end) in enumerate(self.clusters)]
+
+        return layer_state
+
+    def head_logits(self, hidden):
+        """ head logits with shape `[batch_size, cutoffs[0] + n_clusters]`
+
+        Args:
+            hidden (`Tensor`): 2D input tensor `[batch_size,n_hidden]`
+        """
+        state = self.layer_state
+        if self.tied_lookup is None:
+            logits = tf.matmul(hidden, state.head_weights)
+        else:
+            embeddings = self.tied_lookup.layer_state.weights[:self.cutoffs[0]]
+            projected = tf.matmul(hidden, state.head_proj) if hasattr(state, "head_proj") else hidden
+            logits = tf.concat([tf.matmul(projected, embeddings, transpose_b=True),
+                                tf.matmul(hidden, state.cluster_weights)], axis=-1)
+        if self.add_bias:
+            logits = tf.nn.bias_add(logits, state.head_bias)
+        return logits
+
+    def tail_logits(self, hidden, cluster):
+        """ logits for the words in a given tail cluster with shape `[batch_size,cluster_size]`
+
+        Args:
+            hidden (`Tensor`): 2D input tensor `[batch_size,n_hidden]`
+            cluster (`int`): tail cluster index
+        """
+        state = self.layer_state
+        projected = tf.matmul(hidden, state.tail_proj[cluster])
+        if self.tied_lookup is None:
+            logits = tf.matmul(projected, state.tail_weights[cluster])
+        else:
+            start, end = self.clusters[cluster]
+            embeddings = self.tied_lookup.layer_state.weights[start:end]
+            logits = tf.matmul(projected, embeddings, transpose_b=True)
+        if self.add_bias:
+            logits = tf.nn.bias_add(logits, state.tail_bias[cluster])
+        return logits
+
+    def compute(self, input_tensor):
+        input_tensor = as_tensor(input_tensor, dtype=self.dtype)
+        with layer_scope(self):
+            hidden = tf.reshape(input_tensor, [-1, self.input.n_units])
+            head_size = self.cutoffs[0]
+
+            head_log_probs = tf.nn.log_softmax(self.head_logits(hidden))
+            log_probs = [head_log_probs[:, :head_size]]
+            for i in range(len(self.clusters)):
+                cluster_log_prob = head_log_probs[:, head_size + i:head_size + i + 1]
+                log_probs.append(tf.nn.log_softmax(self.tail_logits(hidden, i)) + cluster_log_prob)
+
+            log_probs = tf.concat(log_probs, axis=-1)
+            output_shape = tf.concat([tf.shape(input_tensor)[:-1], [self.n_units]], axis=0)
+            return tf.reshape(log_probs, output_shape)
+
+    def nll(self, input_tensor, labels):
+        """ Negative log-likelihood of the target labels
+
+        Computes the head log-probabilities for all the examples, but evaluates each tail cluster only on the
+        examples whose target words belong to that cluster.
+
+        Args:
+            input_tensor (`Tensor`): input tensor with shape `[...,n_hidden]`
+            labels (`Tensor` or `SparseTensor`): integer word ids with shape `input_tensor.shape[:-1]`, or a
+                `SparseTensor` with shape `[batch_size,n_units]` (e.g. from `Input(n_active=...)`) in which case the
+                loss for a row is the sum of the losses for its active ids.
+
+        Returns:
+            nll (`Tensor`): negative log-likelihood with shape `input_tensor.shape[:-1]`
+        """
+        input_tensor = as_tensor(input_tensor, dtype=self.dtype)
+        with tf.name_scope(f"{self.name}_nll"):
+            hidden = tf.reshape(input_tensor, [-1, self.input.n_units])
+            batch_size = tf.shape(hidden)[0]
+
+            if isinstance(labels, tf.SparseTensor):
+                rows, labels = labels.indices[:, 0], labels.indices[:, -1]
+                hidden = tf.gather(hidden, rows)
+            else:
+                rows = None
+                labels = tf.reshape(labels, [-1])
+            labels = tf.cast(labels, tf.int64)
+
+            # cluster 0 is the head, cluster i+1 is tail cluster i
+            head_size = self.cutoffs[0]
+            cluster_ids = tf.searchsorted(tf.constant(self.cutoffs, dtype=tf.int64), labels, side="right",
+                                          out_type=tf.int64)
+            head_targets = tf.where(cluster_ids == 0, labels, head_size + cluster_ids - 1)
+
+            head_log_probs = tf.nn.log_softmax(self.head_logits(hidden))
+            nll = -tf.gather(head_log_probs, head_targets, batch_dims=1)
+
+            for i, (start, _) in enumerate(self.clusters):
+                idx = tf.where(tf.equal(cluster_ids, i + 1))
+                tail_hidden = tf.gather_nd(hidden, idx)
+                tail_targets = tf.gather_nd(labels, idx) - start
+                tail_log_probs = tf.nn.log_softmax(self.tail_logits(tail_hidden, i))
+                tail_nll = -tf.gather(tail_log_probs, tail_targets, batch_dims=1)
+                nll = tf.tensor_scatter_nd_add(nll, idx, tail_nll)
+
+            if rows is not None:
+                nll = tf.math.unsorted_segment_sum(nll, rows, num_segments=batch_size)
+
+            return tf.reshape(nll, tf.shape(input_tensor)[:-1])
+
+    def reuse_with(self, input_layer, name=None):
+        share_state_with = self if self.share_state_with is None else self.share_state_with
+        return AdaptiveSoftmax(input_layer,
+                               n_units=self.n_units,
+                               cutoffs=self.cutoffs,
+                               proj_factor=self.proj_factor,
+                               tied_lookup=self.tied_lookup,
+                               add_bias=self.add_bias,
+                               weight_init=self.weight_init,
+                               dtype=self.dtype,
+                               name=self.name if name is None else name,
+                               share_state_with=share_state_with)
 
 
 class SeqConcat(Layer):
@@ -3448,6 +4751,7 @@ class GRUCell(BaseRNNCell):
         The first defines how much do we use the values from the recurrent connection to predict the current state
         The second
     """
+    supports_projection = True
 
     def __init__(self, input_layer,
                  n_units,
@@ -3502,95 +4806,48 @@ class GRUCell(BaseRNNCell):
                     previous_h = self.r_reg(previous_h)
 
             if self.share_state_with is None:
-                # update gate kernel
-                w_z = Linear(input_layer,
-                             n_units=self.n_units,
-                             add_bias=True,
-                             bias_init=self.bias_init,
-                             weight_init=self.w_init,
-                             name="w_z")
-                u_z = Linear(previous_h,
-                             n_units=self.n_units,
-                             weight_init=self.u_init,
-                             add_bias=False,
-                             name="u_z")
-
-                # reset kernel
-                w_r = Linear(input_layer,
-                             n_units=self.n_units,
-                             add_bias=True,
-                             bias_init=self.bias_init,
-                             weight_init=self.w_init,
-                             name="w_r")
-                u_r = Linear(previous_h,
-                             n_units=self.n_units,
-                             add_bias=False,
-                             weight_init=self.u_init,
-                             name="u_r")
-
-                # output candidate kernel
-                w_c = Linear(input_layer,
-                             n_units=self.n_units,
-                             add_bias=True,
-                             bias_init=self.bias_init,
-                             weight_init=self.w_init,
-                             name="w_c")
-                u_c = Linear(previous_h,
-                             n_units=self.n_units,
-                             add_bias=False,
-                             bias_init=self.bias_init,
-                             weight_init=self.u_init,
-                             name="u_c")
-
-                w = [w_z, w_r, w_c]
-                u = [u_z, u_r, u_c]
+                # fused [z, r, c] kernels
+                w = Linear(input_layer,
+                           n_units=3 * self.n_units,
+                           add_bias=True,
+                           bias_init=self.bias_init,
+                           weight_init=self.w_init,
+                           name="w")
+                u = Linear(previous_h,
+                           n_units=3 * self.n_units,
+                           add_bias=False,
+                           weight_init=self.u_init,
+                           name="u")
             else:
                 w = self.share_state_with.layer_state.w
                 u = self.share_state_with.layer_state.u
 
                 # in case the layer with which we share the state has a regularized state
-                # TODO store both regularized ViewLayers in the state and normal layers
-                # this way we can just retrieve the regularized state
                 if not self.regularized:
-                    w = list(map(lambda lr: lr.inner_layer if isinstance(lr, ViewLayer) else lr, w))
-                    u = list(map(lambda lr: lr.inner_layer if isinstance(lr, ViewLayer) else lr, u))
-
-                w = [wi.reuse_with(input_layer) for wi in w]
-                u = [ui.reuse_with(previous_h) for ui in u]
+                    w = w.inner_layer if isinstance(w, ViewLayer) else w
+                    u = u.inner_layer if isinstance(u, ViewLayer) else u
 
-                w_z, w_r, w_c = w
-                u_z, u_r, u_c = u
+                w = w.reuse_with(input_layer)
+                u = u.reuse_with(previous_h)
 
             if self.regularized:
                 if self.w_dropconnect is not None and self.w_dropconnect > 0:
-                    w = self.w_reg(*w)
+                    w = self.w_reg(w)
                 if self.u_dropconnect is not None and self.u_dropconnect > 0:
-                    u = self.u_reg(*u)
-
-                w_z, w_r, w_c = w
-                u_z, u_r, u_c = u
+                    u = self.u_reg(u)
 
-            layer_state.w_r = w_r
-            layer_state.w_c = w_c
-            layer_state.w_z = w_z
-            layer_state.u_r = u_r
-            layer_state.u_c = u_c
-            layer_state.u_z = u_z
             layer_state.w = w
             layer_state.u = u
 
-            r = Add(w_r, u_r, name="r")
-            r_uc = Gate(u_c, r, name="gated_previous")
-            candidate = Activation(Add(w_c, r_uc, name="candidate"), fn=self.activation, name="candidate")
-            z = Add(w_z, u_z, name="z")
             # Note:
             #   (it's indifferent after training but) keras implementation is:
             #       h = z * prev_h + (1-z) * candidate
             #   and I had:
             #       h = z * candidate + (1-z) * prev_h
-            #       (CoupledGate(candidate,previous_h z, name="output")
             #   but changed it to have comparable cells
-            output = CoupledGate(previous_h, candidate, z, name="output")
+            output_shape = tf.TensorShape([input_layer.shape[0], self.n_units])
+            output = Lambda(w, u, previous_h, fn=self._update, n_units=self.n_units, shape=output_shape,
+                            name="output")
 
             h = Module(inputs=[input_layer, previous_h],
                        output=output,
@@ -3609,10 +4866,24 @@ class GRUCell(BaseRNNCell):
 
         return layer_state
 
+    def _update(self, w_projection, u_projection, previous_h):
+        x_z, x_r, x_c = tf.split(w_projection, 3, axis=-1)
+        u_z, u_r, u_c = tf.split(u_projection, 3, axis=-1)
+
+        z = self.gate_activation(x_z + u_z)
+        r = self.gate_activation(x_r + u_r)
+        candidate = self.activation(x_c + r * u_c)
+        return z * previous_h + (1 - z) * candidate
+
     def compute(self, input_layer, *previous_state):
         output = self.output.compute(input_layer, *previous_state)
         return output
 
+    def recurrent_step(self, projection, *previous_state):
+        previous_h, = previous_state
+        h = self._update(projection, self.layer_state.u.compute(previous_h), previous_h)
+        return h, (h,)
+
     def reuse_with(self, input_layer, *previous_state, regularized=None, name=None):
         return super().reuse_with(input_layer,
                                   *previous_state,
@@ -3629,6 +4900,7 @@ class LSTMCell(BaseRNNCell):
         previous_state (`Optional[Tuple[Layer]]`): (prev_h, prev_mem)
         previous_memory is the memory state output for the previous cell or None if the current cell is the first step
     """
+    supports_projection = True
 
     def __init__(self,
                  input_layer,
@@ -3692,84 +4964,59 @@ class LSTMCell(BaseRNNCell):
 
             # create new weights
             if self.share_state_with is None:
-
-                # input gate linear
-                w_i = Linear(input_layer, self.n_units, add_bias=True, bias_init=self.bias_init, name="w_i")
-                u_i = Linear(previous_h, self.n_units, add_bias=False, name="u_i")
-
-                # forget gate linear
                 # http://proceedings.mlr.press/v37/jozefowicz15.pdf bias forget = 1
                 forget_bias_init = self.bias_init if self.forget_bias_init is None else self.forget_bias_init
-                w_f = Linear(input_layer, self.n_units, add_bias=True, bias_init=forget_bias_init, name="w_f")
-                u_f = Linear(previous_h, self.n_units, add_bias=False, name="u_f")
-
-                # candidate linear
-                w_c = Linear(input_layer, self.n_units, add_bias=True, bias_init=self.bias_init, name="w_c")
-                u_c = Linear(previous_h, self.n_units, add_bias=False, name="u_c")
-
-                # output gate
-                w_o = Linear(input_layer, self.n_units, add_bias=True, bias_init=self.bias_init, name="w_o")
-                u_o = Linear(previous_h, self.n_units, add_bias=False, name="u_o")
-
-                w = [w_i, w_f, w_c, w_o]
-                u = [u_i, u_f, u_c, u_o]
 
+                def bias_init(shape, dtype=tf.float32):
+                    gate_shape = [shape[-1] // 4]
+                    return tf.concat([self.bias_init(gate_shape, dtype=dtype),
+                                      forget_bias_init(gate_shape, dtype=dtype),
+                                      self.bias_init(gate_shape, dtype=dtype),
+                                      self.bias_init(gate_shape, dtype=dtype)], axis=-1)
+
+                # fused [i, f, c, o] kernels
+                w = Linear(input_layer, 4 * self.n_units,
+                           add_bias=True,
+                           weight_init=self.w_init,
+                           bias_init=bias_init,
+                           name="w")
+                u = Linear(previous_h, 4 * self.n_units,
+                           add_bias=False,
+                           weight_init=self.u_init,
+                           name="u")
             else:
                 w = self.share_state_with.layer_state.w
                 u = self.share_state_with.layer_state.u
 
                 # get inner state of dropconnect or other views
                 if not self.regularized:
-                    w = list(map(lambda lr: lr.inner_layer if isinstance(lr, ViewLayer) else lr, w))
-                    u = list(map(lambda lr: lr.inner_layer if isinstance(lr, ViewLayer) else lr, u))
-
-                w = [wi.reuse_with(input_layer) for wi in w]
-                u = [ui.reuse_with(previous_h) for ui in u]
+                    w = w.inner_layer if isinstance(w, ViewLayer) else w
+                    u = u.inner_layer if isinstance(u, ViewLayer) else u
 
-                w_i, w_f, w_c, w_o = w
-                u_i, u_f, u_c, u_o = u
+                w = w.reuse_with(input_layer)
+                u = u.reuse_with(previous_h)
 
             # apply regularizers to weights
             if self.regularized:
                 if self.w_dropconnect is not None and self.w_dropconnect > 0:
-                    w = self.w_reg(*w)
+                    w = self.w_reg(w)
                 if self.u_dropconnect is not None and self.u_dropconnect > 0:
-                    u = self.u_reg(*u)
-
-                w_i, w_f, w_c, w_o = w
-                u_i, u_f, u_c, u_o = u
-
-            layer_state.w_f = w_f
-            layer_state.w_i = w_i
-            layer_state.w_c = w_c
-            layer_state.w_o = w_o
-            layer_state.u_f = u_f
-            layer_state.u_i = u_i
-            layer_state.u_c = u_c
-            layer_state.u_o = u_o
+                    u = self.u_reg(u)
+
             layer_state.w = w
             layer_state.u = u
 
-            with tf.name_scope("memory_forget"):
-                gate_f = Add(w_f, u_f, name="add_f")
-                memory_state = Gate(previous_memory, gate_f, gate_fn=self.gate_activation, name="gated_memory")
-
-            with tf.name_scope("candidate_store"):
-                gate_i = Add(w_i, u_i, name="candidate_gate")
-                candidate = Activation(Add(w_c, u_c), fn=self.activation,
-                                       name="candidate_activation")
-                candidate = Gate(candidate, gate_i, gate_fn=self.gate_activation, name="gated_candidate")
-                memory_state = Add(memory_state, candidate, name="add_to_memory")
-
-                # wrap memory transformation with something that can be treated as a layer
-                memory_state = Module(inputs=[input_layer, previous_h, previous_memory],
-                                      output=memory_state,
-                                      name=self.name + "_memory")
+            output_shape = tf.TensorShape([input_layer.shape[0], self.n_units])
+            gates = Add(w, u, name="gates")
+            memory_state = Lambda(gates, previous_memory, fn=self._memory, n_units=self.n_units, shape=output_shape,
+                                  name="memory")
+            # wrap memory transformation with something that can be treated as a layer
+            memory_state = Module(inputs=[input_layer, previous_h, previous_memory],
+                                  output=memory_state,
+                                  name=self.name + "_memory")
 
-            with tf.name_scope("output"):
-                gate_o = Add(w_o, u_o, name="add_o")
-                output = Activation(memory_state, fn=self.activation, name="output")
-                output = Gate(output, gate_o, gate_fn=self.gate_activation, name="gated_output")
+            output = Lambda(gates, memory_state, fn=self._output, n_units=self.n_units, shape=output_shape,
+                            name="gated_output")
 
             h = Module(inputs=[input_layer, previous_h, previous_memory],
                        output=output,
@@ -3789,6 +5036,15 @@ class LSTMCell(BaseRNNCell):
         self.state = (h, memory_state)
         return layer_state
 
+    def _memory(self, gates, previous_memory):
+        gate_i, gate_f, candidate, _ = tf.split(gates, 4, axis=-1)
+        candidate = self.activation(candidate) * self.gate_activation(gate_i)
+        return previous_memory * self.gate_activation(gate_f) + candidate
+
+    def _output(self, gates, memory):
+        gate_o = tf.split(gates, 4, axis=-1)[-1]
+        return self.activation(memory) * self.gate_activation(gate_o)
+
     def compute(self, input_tensor, *previous_state):
         """ compute layer value based on input `Tensor` values
 
@@ -3804,6 +5060,13 @@ class LSTMCell(BaseRNNCell):
         output = self.output.compute(input_tensor, previous_h, previous_memory)
         return output
 
+    def recurrent_step(self, projection, *previous_state):
+        previous_h, previous_memory = previous_state
+        gates = projection + self.layer_state.u.compute(previous_h)
+        memory = self._memory(gates, previous_memory)
+        h = self._output(gates, memory)
+        return h, (h, memory)
+
     def reuse_with(self, input_layer, *previous_state, regularized=None, name=None):
         # TODO change reuse_with with input_layer, *previous_state
         return super().reuse_with(input_layer,
@@ -4104,6 +5367,14 @@ class Conv1D(Layer):
         input_layer: input `Layer` with shape (batch,time_step,dim)
         n_units: number of output units for this layer (number of filters)
         filter_size: convolution filter size
+        causal (`bool`): if True, the input is padded on the left with `(filter_size-1)*dilation_rate` steps so that
+            each output step only depends on the current and previous input steps. Overrides `same_padding`.
+        groups (`int`): number of groups in a grouped convolution, the input and output units are split into `groups`
+            and each output group only depends on the corresponding input group, with filters of shape
+            `[filter_size,input_dim//groups,n_units]`.
+        separable (`bool`): if True, computes a depthwise-separable convolution: a depthwise convolution with filters
+            of shape `[filter_size,input_dim,1]` followed by a pointwise projection with shape `[input_dim,n_units]`.
+        pointwise_filters (`tf.Variable`): pointwise projection to be used if `separable` is True
     """
 
     def __init__(self, input_layer,
@@ -4112,21 +5383,34 @@ class Conv1D(Layer):
                  stride=1,
                  dilation_rate=1,
                  same_padding=True,
+                 causal=False,
                  filter_init=tf.initializers.glorot_uniform(),
                  bias_init=tf.initializers.zeros(),
                  add_bias=True,
                  name="conv1D",
                  share_state_with=None,
                  filters=None,
-                 bias=None):
+                 bias=None,
+                 groups=1,
+                 separable=False,
+                 pointwise_filters=None):
+
+        if separable and groups != 1:
+            raise ValueError(f"separable convolutions cannot be grouped: groups={groups}")
+        if n_units % groups != 0:
+            raise ValueError(f"n_units {n_units} is not divisible by groups {groups}")
 
         # TODO should shared bias and shared weights/filters etc be in the config? I guess pickling this requires
         #   the storage of the respective weights
         # self.shared_bias = shared_bias
         # self.share_state_with = share_state_with
         # self.shared_filters = shared_filters
-        self.padding = "SAME" if same_padding else "VALID"
+        if causal:
+            self.padding = "CAUSAL"
+        else:
+            self.padding = "SAME" if same_padding else "VALID"
         self.same_padding = same_padding
+        self.causal = causal
         self.dilation_rate = dilation_rate
         self.stride = stride
         self.filter_size = filter_size
@@ -4135,6 +5419,9 @@ class Conv1D(Layer):
         self.add_bias = add_bias
         self.bias = bias
         self.filters = filters
+        self.groups = groups
+        self.separable = separable
+        self.pointwise_filters = pointwise_filters
         self.share_state_with = share_state_with
 
         super().__init__(inputs=input_layer,
@@ -4149,9 +5436,47 @@ class Conv1D(Layer):
         output_shape = _conv_out_shape(input_shape, filter_shape, self.padding, self.stride, self.dilation_rate)
         return tf.TensorShape(output_shape)
 
+    @property
+    def filter_shape(self):
+        """ shape of the filters variable """
+        if self.separable:
+            return [self.filter_size, self.input.n_units, 1]
+        return [self.filter_size, self.input.n_units // self.groups, self.n_units]
+
+    @property
+    def n_params(self):
+        """ number of parameters of the layer """
+        n_params = self.filter_size * self.filter_shape[1] * self.filter_shape[2]
+        if self.separable:
+            n_params += self.input.n_units * self.n_units
+        if self.add_bias:
+            n_params += self.n_units
+        return n_params
+
+    def flops(self, input_length):
+        """ flops
+
+        Number of floating point operations (counting multiply and add separately) of the convolution for a single
+        input sequence, without the bias.
+
+        Args:
+            input_length (`int`): number of input time steps
+
+        Returns:
+            flops (`int`): number of floating point operations
+        """
+        output_length = _conv_output_length(input_length, self.filter_size, self.padding, self.stride,
+                                            self.dilation_rate)
+        macs = self.filter_size * self.filter_shape[1] * self.filter_shape[2]
+        if self.separable:
+            macs += self.input.n_units * self.n_units
+        return 2 * output_length * macs
+
     def init_state(self):
         input_layer = self.input
-        filter_shape = [self.filter_size, input_layer.n_units, self.n_units]
+        if input_layer.n_units % self.groups != 0:
+            raise ValueError(f"input n_units {input_layer.n_units} is not divisible by groups {self.groups}")
+        filter_shape = self.filter_shape
 
         if self.share_state_with is not None:
             if not isinstance(self.share_state_with, Conv1D):
@@ -4173,6 +5498,17 @@ class Conv1D(Layer):
             if not hasattr(layer_state, "filters"):
                 layer_state.filters = filters
 
+            if self.separable:
+                pointwise_filters = getattr(layer_state, "pointwise_filters", self.pointwise_filters)
+                if pointwise_filters is None:
+                    init_value = self.filter_init([input_layer.n_units, self.n_units], dtype=self.dtype)
+                    pointwise_filters = tf.Variable(initial_value=init_value,
+                                                    dtype=self.dtype,
+                                                    name="pointwise_filters")
+
+                if not hasattr(layer_state, "pointwise_filters"):
+                    layer_state.pointwise_filters = pointwise_filters
+
             bias = getattr(layer_state, "bias", self.bias)
             if self.add_bias:
                 if bias is None:
@@ -4192,12 +5528,29 @@ class Conv1D(Layer):
             # if input_tensor.dtype == tf.float64:
             #     input_tensor = tf.cast(input_tensor, tf.float32)
 
-            output = tf.nn.convolution(input=input_tensor,
-                                       filters=self.layer_state.filters,
-                                       padding=self.padding,
-                                       strides=(self.stride,),
-                                       dilations=(self.dilation_rate,),
-                                       data_format="NWC")
+            if self.causal:
+                pad = (self.filter_size - 1) * self.dilation_rate
+                input_tensor = tf.pad(input_tensor, [[0, 0], [pad, 0], [0, 0]])
+
+            padding = "VALID" if self.causal else self.padding
+            if self.separable:
+                # (batch,1,time_step,dim) with (1,filter_size,dim,1) and (1,1,dim,n_units) filters
+                output = tf.nn.separable_conv2d(input=tf.expand_dims(input_tensor, 1),
+                                                depthwise_filter=tf.expand_dims(self.layer_state.filters, 0),
+                                                pointwise_filter=self.layer_state.pointwise_filters[None, None],
+                                                strides=(1, 1, self.stride, 1),
+                                                padding=padding,
+                                                dilations=(1, self.dilation_rate),
+                                                data_format="NHWC")
+                output = tf.squeeze(output, 1)
+            else:
+                # grouped if the filters have input_dim // groups input units
+                output = tf.nn.convolution(input=input_tensor,
+                                           filters=self.layer_state.filters,
+                                           padding=padding,
+                                           strides=(self.stride,),
+                                           dilations=(self.dilation_rate,),
+                                           data_format="NWC")
 
             if self.add_bias:
                 output = tf.nn.bias_add(output, self.layer_state.bias, name="add_b")
@@ -4215,15 +5568,208 @@ class Conv1D(Layer):
                       stride=self.stride,
                       dilation_rate=self.dilation_rate,
                       same_padding=self.same_padding,
+                      causal=self.causal,
                       filter_init=self.filter_init,
                       bias_init=self.bias_init,
                       add_bias=self.add_bias,
                       name=name,
                       bias=self.bias,
                       filters=self.filters,
+                      groups=self.groups,
+                      separable=self.separable,
+                      pointwise_filters=self.pointwise_filters,
                       share_state_with=share_state_with)
 
 
+def _conv_dense_filters(conv):
+    """ returns the filters of a standard convolution equivalent to a grouped or separable `Conv1D` with shape
+    `[filter_size,input_dim,n_units]`
+    """
+    filters = tf.convert_to_tensor(conv.filters)
+    if conv.separable:
+        return tf.einsum("ki,io->kio", filters[..., 0], conv.pointwise_filters)
+    if conv.groups == 1:
+        return filters
+
+    # block diagonal filters
+    group_units = conv.n_units // conv.groups
+    blocks = tf.split(filters, conv.groups, axis=-1)
+    paddings = [[[0, 0], [0, 0], [i * group_units, conv.n_units - (i + 1) * group_units]] for i in range(conv.groups)]
+    return tf.concat([tf.pad(block, padding) for block, padding in zip(blocks, paddings)], axis=1)
+
+
+def convert_conv1d(conv, groups=1, separable=False, name=None):
+    """ convert_conv1d
+
+    Builds a `Conv1D` layer with the same input and configuration as the given layer, but with a different filter
+    structure (standard, grouped or depthwise-separable), initialized from the filters of the given layer, e.g. to
+    fine-tune a cheaper convolution from a trained standard convolution.
+
+    The filters are first expanded to standard filters, which is exact, and then projected to the closest (in
+    the least squares sense) filters with the new structure: grouped filters keep the block diagonal of the standard
+    filters, and separable filters take the best rank-1 approximation of the `[filter_size,n_units]` filters of
+    each input unit. The conversion is exact if the standard filters already have the new structure, e.g.
+    converting a grouped or separable convolution to a standard convolution.
+
+    Args:
+        conv (`Conv1D`): convolution layer to be converted
+        groups (`int`): number of groups of the new layer
+        separable (`bool`): if True the new layer is a depthwise-separable convolution
+        name (`str`): name for the new layer, defaults to the name of the given layer
+
+    Returns:
+        conv (`Conv1D`): a new layer with new variables for its filters and bias
+    """
+    if not isinstance(conv, Conv1D):
+        raise TypeError(f"expected Conv1D, got {type(conv)} instead")
+
+    filters = _conv_dense_filters(conv)
+    pointwise_filters = None
+    if separable:
+        # best rank-1 approximation of (filter_size,n_units) for each input unit
+        s, u, v = tf.linalg.svd(tf.transpose(filters, [1, 0, 2]))
+        s = tf.sqrt(s[:, :1])
+        filters = tf.expand_dims(tf.transpose(u[:, :, 0] * s), -1)
+        pointwise_filters = tf.Variable(v[:, :, 0] * s, name="pointwise_filters")
+    elif groups > 1:
+        input_units = conv.input.n_units // groups
+        output_units = conv.n_units // groups
+        filters = tf.concat([filters[:, i * input_units:(i + 1) * input_units, i * output_units:(i + 1) * output_units]
+                             for i in range(groups)], axis=-1)
+
+    return Conv1D(conv.input,
+                  n_units=conv.n_units,
+                  filter_size=conv.filter_size,
+                  stride=conv.stride,
+                  dilation_rate=conv.dilation_rate,
+                  same_padding=conv.same_padding,
+                  causal=conv.causal,
+                  filter_init=conv.filter_init,
+                  bias_init=conv.bias_init,
+                  add_bias=conv.add_bias,
+                  filters=tf.Variable(filters, name="filters"),
+                  bias=tf.Variable(conv.bias, name="bias") if conv.add_bias else None,
+                  groups=groups,
+                  separable=separable,
+                  pointwise_filters=pointwise_filters,
+                  name=conv.name if name is None else name)
+
+
+class Conv1DStream:
+    """ Conv1DStream
+
+    Streaming inference for a causal `Conv1D` layer. Keeps a ring buffer with the last
+    `(filter_size-1)*dilation_rate` input steps of each sequence in a batch, so that each `step` applies the filters
+    once to the new input step and the buffered steps it depends on, instead of convolving the entire input again.
+    The buffer starts with zeros, so the outputs of consecutive steps are the same as the outputs of the layer on the
+    full sequence.
+
+    Example:
+        ```python
+        conv = tx.Conv1D(x, n_units=16, filter_size=3, dilation_rate=2, causal=True)
+        stream = tx.Conv1DStream(conv, batch_size=4)
+        for x_t in steps:  # x_t has shape [4, x.n_units]
+            y_t = stream.step(x_t)
+        ```
+
+    Args:
+        conv (`Conv1D`): causal convolution layer with `stride=1`
+        batch_size (`int`): number of sequences computed in parallel
+
+    Attributes:
+        buffer (`tf.Variable`): ring buffer with the previous input steps with shape
+            `[batch_size,(filter_size-1)*dilation_rate,n_inputs]`
+        position (`tf.Variable`): number of steps computed since the last reset
+    """
+
+    def __init__(self, conv, batch_size):
+        if not isinstance(conv, Conv1D):
+            raise TypeError(f"expected Conv1D, got {type(conv)} instead")
+        if not conv.causal or conv.stride != 1:
+            raise ValueError(f"streaming requires a causal Conv1D with stride 1: "
+                             f"causal={conv.causal}, stride={conv.stride}")
+
+        self.conv = conv
+        self.batch_size = batch_size
+        self.buffer_size = (conv.filter_size - 1) * conv.dilation_rate
+        n_inputs = conv.input.n_units
+
+        self.buffer = tf.Variable(tf.zeros([batch_size, self.buffer_size, n_inputs], dtype=conv.dtype),
+                                  trainable=False,
+                                  name="conv_buffer")
+        self.position = tf.Variable(0, dtype=tf.int32, trainable=False, name="conv_position")
+
+        # offsets of the previous steps used by each filter tap (except the last, which is the current step)
+        offsets = tf.range(conv.filter_size - 1, 0, -1) * conv.dilation_rate
+
+        @tf.function(input_signature=[tf.TensorSpec([batch_size, n_inputs], dtype=conv.dtype)])
+        def step(input_t):
+            window = tf.expand_dims(input_t, 1)
+            if self.buffer_size > 0:
+                position = self.position % self.buffer_size
+                previous = tf.gather(self.buffer, (position - offsets) % self.buffer_size, axis=1)
+                window = tf.concat([previous, window], axis=1)
+                self.buffer[:, position].assign(input_t)
+            self.position.assign_add(1)
+
+            filters = self.conv.filters
+            if conv.separable:
+                # (batch_size, filter_size, n_inputs) x (filter_size, n_inputs) x (n_inputs, n_units)
+                output = tf.matmul(tf.einsum("bki,ki->bi", window, filters[..., 0]), self.conv.pointwise_filters)
+            elif conv.groups > 1:
+                # (batch_size, filter_size, groups, n_inputs//groups) x (filter_size, n_inputs//groups, groups, ...)
+                window = tf.reshape(window, [batch_size, conv.filter_size, conv.groups, -1])
+                filters = tf.reshape(filters, [conv.filter_size, -1, conv.groups, conv.n_units // conv.groups])
+                output = tf.reshape(tf.einsum("bkgi,kigo->bgo", window, filters), [batch_size, conv.n_units])
+            else:
+                # (batch_size, filter_size, n_inputs) x (filter_size, n_inputs, n_units)
+                output = tf.einsum("bki,kio->bo", window, filters)
+            if self.conv.add_bias:
+                output = tf.nn.bias_add(output, self.conv.bias)
+            return output
+
+        self._step = step
+
+    def reset(self):
+        """ clears the buffered input steps """
+        self.buffer.assign(tf.zeros_like(self.buffer))
+        self.position.assign(0)
+
+    def step(self, input_t):
+        """ step
+
+        Computes the convolution output for a new input step of each sequence and adds it to the buffer.
+
+        Args:
+            input_t (`Tensor`): input step with shape `[batch_size,n_inputs]`
+
+        Returns:
+            output (`Tensor`): output step with shape `[batch_size,n_units]`
+        """
+        return self._step(as_tensor(input_t, self.conv.dtype))
+
+
+_MASK_VALUE = -2 ** 32 + 1
+
+
+def _build_causal_bias(tq, tk, dtype):
+    causal = tf.range(tk)[None, :] <= tf.range(tq)[:, None]
+    return tf.where(causal, tf.zeros([], dtype), tf.constant(_MASK_VALUE, dtype))
+
+
+_cached_causal_bias = lru_cache(maxsize=32)(_build_causal_bias)
+
+
+def _causal_bias(tq, tk, dtype=tf.float32):
+    """ additive causal mask with shape `[tq,tk]`, `0` where key step `j <= i` and a large negative value otherwise
+
+    When executing eagerly with static `tq` and `tk` the masks are cached, and built only once for each shape.
+    """
+    if tf.executing_eagerly() and isinstance(tq, int) and isinstance(tk, int):
+        return _cached_causal_bias(tq, tk, dtype)
+    return _build_causal_bias(tq, tk, dtype)
+
+
 class MHAttention(Layer):
     """ Scaled Dot Product MultiHead Attention Layer
 
@@ -4237,6 +5783,25 @@ class MHAttention(Layer):
         key:
         value:
         n_units: output number of units, each attention head has `n_units // n_head` units
+        block_size (`Optional[int]`): if given, the attention is computed in blocks of `block_size` query and key
+            steps with `blockwise_attention`, which doesn't materialize the full attention scores in the forward
+            or backward passes. Requires `attention_fn=tf.nn.softmax` and no attention dropout.
+        key_mask (`Optional[Layer]`): boolean layer with shape `[batch_size,tk]`, keys where the mask is `False`
+            (e.g. padding) are ignored.
+        key_length (`Optional[Layer]`): layer with shape `[batch_size]` with the number of valid keys of each
+            example, an alternative to `key_mask` for padded sequences.
+        window (`Optional[int]`): if given, uses a sparse self-attention pattern computed with `local_attention`
+            where each step attends only to the `window` steps before and after it (sliding window), in
+            `O(seq_len·window)` time and memory. Requires `attention_fn=tf.nn.softmax` and no attention dropout.
+        stride (`int`): distance between the steps attended in the window, `stride>1` results in a dilated window
+        n_global (`int`): number of global tokens at the start of the sequence, which attend to and are attended
+            by all the steps
+        feature_map (`Optional[Union[str,Callable]]`): if given, uses kernelized linear attention computed with
+            `linear_attention` in `O(seq_len·d²)` instead of the softmax attention. Can be `"elu"` for the
+            `elu(x)+1` feature map, `"random"` for positive random features that approximate the softmax kernel,
+            or a callable positive feature map.
+        n_random_features (`Optional[int]`): number of random features if `feature_map="random"`, defaults to
+            `2*n_units//n_heads`
 
     """
 
@@ -4250,8 +5815,18 @@ class MHAttention(Layer):
                  causality=False,
                  attention_dropout=0.0,
                  regularized=False,
+                 block_size=None,
+                 key_mask=None,
+                 key_length=None,
+                 window=None,
+                 stride=1,
+                 n_global=0,
+                 feature_map=None,
+                 n_random_features=None,
                  name="attention",
                  share_state_with=None):
+        if key_mask is not None and key_length is not None:
+            raise ValueError("key_mask and key_length cannot both be given")
         self.n_heads = n_heads
         n_units = query.n_units if n_units is None else n_units
         self.causality = causality
@@ -4259,6 +5834,25 @@ class MHAttention(Layer):
         self.regularized = regularized
         self.attention_dropout = attention_dropout
         self.attention_fn = attention_fn
+        self.block_size = block_size
+        self.key_mask = as_layer(key_mask) if key_mask is not None else None
+        self.key_length = as_layer(key_length) if key_length is not None else None
+        self.window = window
+        self.stride = stride
+        self.n_global = n_global
+        self.feature_map = feature_map
+
+        if window is None and (stride > 1 or n_global > 0):
+            raise ValueError("stride and n_global require an attention window")
+        if sum(option is not None for option in (block_size, window, feature_map)) > 1:
+            raise ValueError("only one of block_size, window, or feature_map can be given")
+        if isinstance(feature_map, str) and feature_map not in ("elu", "random"):
+            raise ValueError(f"feature_map must be \"elu\", \"random\" or a callable: {feature_map} found")
+        if block_size is not None or window is not None or feature_map is not None:
+            if attention_fn is not tf.nn.softmax:
+                raise ValueError("blockwise, local, and linear attention require attention_fn to be tf.nn.softmax")
+            if attention_dropout > 0:
+                raise ValueError("blockwise, local, and linear attention don't support attention dropout")
 
         if n_units % n_heads != 0:
             raise ValueError(
@@ -4266,13 +5860,17 @@ class MHAttention(Layer):
                 "heads {}".format(self.n_units, n_heads))
 
         self.head_units = n_units // n_heads
+        self.n_random_features = 2 * self.head_units if n_random_features is None else n_random_features
 
         # variables for type hinting
         self.wq = None
         self.wk = None
         self.wv = None
 
-        super().__init__(inputs=[query, key, value], n_units=n_units, name=name)
+        super().__init__(inputs=[query, key, value] + as_list(self.key_mask) + as_list(self.key_length),
+                         n_units=n_units,
+                         dtype=tf.float32,
+                         name=name)
 
     def compute_shape(self):
         return self.inputs[0].shape[:-1] + self.n_units
@@ -4287,7 +5885,7 @@ class MHAttention(Layer):
         else:
             layer_state = super().init_state()
 
-        query, key, value = self.inputs
+        query, key, value = self.inputs[:3]
         h_dim = self.n_units
 
         with layer_scope(self):
@@ -4301,14 +5899,80 @@ class MHAttention(Layer):
                 layer_state.wk = wk
                 layer_state.wv = wv
 
+            if self.feature_map == "random" and not hasattr(layer_state, "projection"):
+                projection = tf.random.normal([self.head_units, self.n_random_features])
+                layer_state.projection = tf.Variable(projection, trainable=False, name="random_projection")
+
         return layer_state
 
-    def compute(self, *input_tensors):
-        query, key, value = input_tensors
+    def _split_heads(self, tensor):
+        # (batch_size, steps, n_units) -> (n_heads*batch_size, steps, n_units//n_heads)
+        return tf.concat(tf.split(tensor, self.n_heads, axis=2), axis=0)
+
+    def _merge_heads(self, tensor):
+        # (n_heads*batch_size, steps, n_units//n_heads) -> (batch_size, steps, n_units)
+        return tf.concat(tf.split(tensor, self.n_heads, axis=0), axis=2)
+
+    def _feature_fn(self):
+        """ returns the feature map of the linear attention """
+        if self.feature_map == "random":
+            # the scaling of the dot products is split between queries and keys
+            def feature_map(x):
+                return random_features(x * self.n_units ** -0.25, self.layer_state.projection)
+
+            return feature_map
+        elif self.feature_map == "elu":
+            return elu_features
+        else:
+            return self.feature_map
+
+    def _attend(self, qh, kh, vh, bias=None, key_bias=None):
+        """ scaled dot product attention
+
+        Args:
+            qh (`Tensor`): query heads with shape `[n_heads*batch_size,tq,n_units//n_heads]`
+            kh (`Tensor`): key heads with shape `[n_heads*batch_size,tk,n_units//n_heads]`
+            vh (`Tensor`): value heads with shape `[n_heads*batch_size,tk,n_units//n_heads]`
+            bias (`Optional[Tensor]`): additive bias for the dot products broadcastable to `[n_heads*batch_size,tq,tk]`
+            key_bias (`Optional[Tensor]`): additive bias with shape `[batch_size,tk]` for the dot products of each
+                head and query
+
+        Returns:
+            context (`Tensor`): context vectors with shape `[n_heads*batch_size,tq,n_units//n_heads]`
+        """
+        # attention scores from scaled dot product
+        dot = tf.matmul(qh, kh, transpose_b=True)
+
+        # hypothesis: for large values of √dk, the dot products grow large in magnitude, pushing the
+        # softmax function into regions with extremely small gradients. To counteract this effect, we scale
+        # the dot products by1 √dk.
+        dot /= self.n_units ** 0.5
 
-        # (n_heads*batch_size, steps, n_units//n_heads)
-        def heads(w):
-            return tf.concat(tf.split(w, self.n_heads, axis=2), axis=0)
+        if bias is not None:
+            dot += bias
+
+        # (batch_size, tk) bias broadcast to (n_heads, batch_size, tq, tk)
+        if key_bias is not None:
+            shape = tf.shape(dot)
+            output = tf.reshape(dot, [self.n_heads, -1, shape[1], shape[2]]) + key_bias[None, :, None, :]
+            output = tf.reshape(output, shape)
+            output.set_shape(dot.shape)
+            dot = output
+
+        scores = self.attention_fn(dot)
+
+        if self.attention_dropout > 0 and self.regularized:
+            scores = dropout(tensor=scores,
+                             probability=self.attention_dropout,
+                             scale=True,
+                             name="dropout")
+
+        # weighted sum (context vectors) weighted by attention scores
+        return tf.matmul(scores, vh)
+
+    def compute(self, *input_tensors):
+        query, key, value, *key_mask = input_tensors
+        heads = self._split_heads
 
         with layer_scope(self):
             dk = self.n_units
@@ -4320,43 +5984,69 @@ class MHAttention(Layer):
             kh = heads(wk)
             vh = heads(wv)
 
-            # attention scores from scaled dot product
-            dot = tf.matmul(qh, tf.transpose(kh, [0, 2, 1]))
-
-            # hypothesis: for large values of √dk, the dot products grow large in magnitude, pushing the
-            # softmax function into regions with extremely small gradients. To counteract this effect, we scale
-            # the dot products by1 √dk.
-            dot /= dk ** 0.5
-            output = dot
-
-            # mask information from the future
-            if self.causality:
-                diag_values = tf.ones_like(output[0, :, :])  # (tq, tk)
-                triangular = tf.linalg.LinearOperatorLowerTriangular(diag_values).to_dense()  # (tq, tk)
-                masks = tf.tile(tf.expand_dims(triangular, 0), [tf.shape(output)[0], 1, 1])  # (N, tq, tk)
-                # mask to - inf before softmax
-                padding = tf.ones_like(masks) * (-2 ** 32 + 1)
-                output = tf.where(tf.equal(masks, 0), padding, output)
-
-            scores = self.attention_fn(output)
-
-            if self.attention_dropout > 0 and self.regularized:
-                scores = dropout(tensor=scores,
-                                 probability=self.attention_dropout,
-                                 scale=True,
-                                 name="dropout")
-
-            # weighted sum (context vectors) weighted by attention scores
-            context_vectors = tf.matmul(scores, vh)
+            tq = query.shape[1] if query.shape[1] is not None else tf.shape(query)[1]
+            tk = key.shape[1] if key.shape[1] is not None else tf.shape(key)[1]
+
+            key_mask = key_mask[0] if key_mask else None
+            if key_mask is not None:
+                if self.key_length is not None:
+                    key_mask = tf.sequence_mask(key_mask, tk)
+                key_mask = tf.cast(key_mask, tf.bool)
+
+            if self.block_size is not None:
+                context_vectors = blockwise_attention(qh, kh, vh,
+                                                      block_size=self.block_size,
+                                                      causal=self.causality,
+                                                      scale=dk ** -0.5,
+                                                      key_mask=tf.tile(key_mask, [self.n_heads, 1])
+                                                      if key_mask is not None else None)
+                return self._merge_heads(context_vectors)
+
+            if self.window is not None:
+                context_vectors = local_attention(qh, kh, vh,
+                                                  window=self.window,
+                                                  stride=self.stride,
+                                                  n_global=self.n_global,
+                                                  causal=self.causality,
+                                                  scale=dk ** -0.5,
+                                                  key_mask=tf.tile(key_mask, [self.n_heads, 1])
+                                                  if key_mask is not None else None)
+                return self._merge_heads(context_vectors)
+
+            if self.feature_map is not None:
+                context_vectors = linear_attention(qh, kh, vh,
+                                                   feature_map=self._feature_fn(),
+                                                   causal=self.causality,
+                                                   key_mask=tf.tile(key_mask, [self.n_heads, 1])
+                                                   if key_mask is not None else None)
+                return self._merge_heads(context_vectors)
+
+            # mask information from the future, (tq, tk) bias broadcast to (N, tq, tk)
+            bias = _causal_bias(tq, tk, qh.dtype) if self.causality else None
+
+            # mask padded keys
+            key_bias = None
+            if key_mask is not None:
+                key_bias = tf.where(key_mask, tf.zeros([], qh.dtype), tf.constant(_MASK_VALUE, qh.dtype))
+
+            context_vectors = self._attend(qh, kh, vh, bias=bias, key_bias=key_bias)
             # restore shape (batch_size, tq, n_units)
-            output = tf.concat(tf.split(context_vectors, self.n_heads, axis=0), axis=2)
+            return self._merge_heads(context_vectors)
 
-            return output
+    def _reuse_with_inputs(self, query, key, value, *inputs):
+        inputs = list(inputs)
+        key_mask = inputs.pop(0) if self.key_mask is not None else None
+        key_length = inputs.pop(0) if self.key_length is not None else None
+        return self.reuse_with(query, key, value, key_mask=key_mask, key_length=key_length)
 
-    def reuse_with(self, query, key, value, regularized=None, causality=None, name=None):
+    def reuse_with(self, query, key, value, regularized=None, causality=None, key_mask=None, key_length=None,
+                   name=None):
         regularized = self.regularized if regularized is None else regularized
         name = self.name if name is None else name
         causality = self.causality if causality is None else causality
+        if key_mask is None and key_length is None:
+            key_mask = self.key_mask
+            key_length = self.key_length
 
         return MHAttention(query=query,
                            key=key,
@@ -4367,10 +6057,431 @@ class MHAttention(Layer):
                            n_heads=self.n_heads,
                            attention_dropout=self.attention_dropout,
                            regularized=regularized,
+                           block_size=self.block_size,
+                           key_mask=key_mask,
+                           key_length=key_length,
+                           window=self.window,
+                           stride=self.stride,
+                           n_global=self.n_global,
+                           feature_map=self.feature_map,
+                           n_random_features=self.n_random_features,
                            name=name,
                            share_state_with=self)
 
 
+class KVCache:
+    """ KVCache
+
+    Key-value cache for autoregressive decoding with `MHAttention`. Stores the projected keys and values of each
+    decoding session in variables with shape `[capacity,max_len,n_units]`, so that each `step` only projects the
+    keys and values of the new time step, appends them to the cache, and attends from the new query to the cached
+    prefix, instead of re-projecting the entire prefix at each step. The result is the same as computing the
+    attention with `causality=True` on the full sequence and taking the output of the last step, including the
+    local, strided, and global attention patterns of an attention with a `window`.
+
+    For linear attention (with a `feature_map`), each session also keeps the running sums `Σφ(k)·vᵀ` and `Σφ(k)`
+    of its keys and values, so that each `step` takes constant time regardless of the length of the session.
+
+    Example:
+        ```python
+        cache = tx.KVCache(attention, capacity=64, max_len=512)
+        beams = cache.open(4)
+        y = cache.step(x, x, x, beams)  # x has shape [4, n_inputs]
+        cache.reorder(beams, [beams[0], beams[0], beams[2], beams[3]])
+        ```
+
+    Args:
+        attention (`MHAttention`): attention layer used to project the queries, keys and values, without `key_mask`
+            or `key_length`
+        capacity (`int`): maximum number of concurrent sessions
+        max_len (`int`): maximum number of time steps stored for each session
+
+    Attributes:
+        keys (`tf.Variable`): cached key projections with shape `[capacity,max_len,n_units]`
+        values (`tf.Variable`): cached value projections with shape `[capacity,max_len,n_units]`
+        lengths (`tf.Variable`): number of cached steps of each session with shape `[capacity]`
+        kv (`Optional[tf.Variable]`): for linear attention, running sum of `φ(k)·vᵀ` of each session with shape
+            `[capacity,n_heads,n_features,n_units//n_heads]`
+        z (`Optional[tf.Variable]`): for linear attention, running sum of `φ(k)` of each session with shape
+            `[capacity,n_heads,n_features]`
+    """
+
+    def __init__(self, attention, capacity, max_len):
+        if not isinstance(attention, MHAttention):
+            raise TypeError(f"expected MHAttention, got {type(attention)} instead")
+        if attention.key_mask is not None or attention.key_length is not None:
+            # the cached keys are the valid steps of each session
+            raise ValueError("KVCache doesn't support MHAttention with key_mask or key_length, "
+                             "use trim to discard steps of a session instead")
+
+        self.attention = attention
+        self.capacity = capacity
+        self.max_len = max_len
+        n_units = attention.n_units
+
+        self.keys = tf.Variable(tf.zeros([capacity, max_len, n_units]), trainable=False, name="cache_keys")
+        self.values = tf.Variable(tf.zeros([capacity, max_len, n_units]), trainable=False, name="cache_values")
+        self.lengths = tf.Variable(tf.zeros([capacity], dtype=tf.int32), trainable=False, name="cache_lengths")
+        self._free = list(reversed(range(capacity)))
+
+        query, key, value = attention.inputs[:3]
+        heads = attention._split_heads
+        n_heads = attention.n_heads
+        self.kv = None
+        self.z = None
+
+        if attention.feature_map is not None:
+            feature_fn = attention._feature_fn()
+            n_features = feature_fn(tf.zeros([1, 1, attention.head_units])).shape[-1]
+            self.kv = tf.Variable(tf.zeros([capacity, n_heads, n_features, attention.head_units]),
+                                  trainable=False,
+                                  name="cache_kv")
+            self.z = tf.Variable(tf.zeros([capacity, n_heads, n_features]), trainable=False, name="cache_z")
+
+        def by_session(x):
+            # (n_heads*batch_size, ...) -> (batch_size, n_heads, ...)
+            x = tf.reshape(x, tf.concat([[n_heads, -1], tf.shape(x)[1:]], axis=0))
+            return tf.transpose(x, [1, 0] + list(range(2, x.shape.rank)))
+
+        def linear_state(keys, values, lengths):
+            """ running sums of φ(k)·vᵀ and φ(k) over the first `lengths` keys and values """
+            mask = tf.cast(tf.sequence_mask(lengths, tf.shape(keys)[1]), keys.dtype)
+            phi_k = by_session(feature_fn(heads(keys))) * mask[:, None, :, None]
+            vh = by_session(heads(values))
+            return tf.einsum("bhtf,bhtd->bhfd", phi_k, vh), tf.reduce_sum(phi_k, axis=2)
+
+        self._linear_state = linear_state
+
+        @tf.function(input_signature=[tf.TensorSpec([None, query.shape[-1]], dtype=query.dtype),
+                                      tf.TensorSpec([None, key.shape[-1]], dtype=key.dtype),
+                                      tf.TensorSpec([None, value.shape[-1]], dtype=value.dtype),
+                                      tf.TensorSpec([None], dtype=tf.int32)])
+        def step(query_t, key_t, value_t, sessions):
+            positions = tf.gather(self.lengths, sessions)
+            indices = tf.stack([sessions, positions], axis=-1)
+            key_t = attention.wk.compute(key_t)
+            value_t = attention.wv.compute(value_t)
+            self.keys.scatter_nd_update(indices, key_t)
+            self.values.scatter_nd_update(indices, value_t)
+            lengths = positions + 1
+            self.lengths.scatter_nd_update(tf.expand_dims(sessions, -1), lengths)
+
+            if self.kv is not None:
+                # (batch_size, n_heads, n_features)
+                phi_q = by_session(feature_fn(heads(attention.wq.compute(query_t)[:, None])))[:, :, 0]
+                phi_k = by_session(feature_fn(heads(key_t[:, None])))[:, :, 0]
+                vh = by_session(heads(value_t[:, None]))[:, :, 0]
+
+                kv = tf.gather(self.kv, sessions) + tf.einsum("bhf,bhd->bhfd", phi_k, vh)
+                z = tf.gather(self.z, sessions) + phi_k
+                self.kv.scatter_nd_update(tf.expand_dims(sessions, -1), kv)
+                self.z.scatter_nd_update(tf.expand_dims(sessions, -1), z)
+
+                numerator = tf.einsum("bhf,bhfd->bhd", phi_q, kv)
+                denominator = tf.einsum("bhf,bhf->bh", phi_q, z)
+                context = numerator / (denominator[..., None] + 1e-6)
+                return tf.reshape(context, [-1, n_units])
+
+            # only attend to the longest prefix in the batch
+            max_len = tf.reduce_max(lengths)
+            kh = heads(tf.gather(self.keys, sessions)[:, :max_len])
+            vh = heads(tf.gather(self.values, sessions)[:, :max_len])
+            qh = heads(tf.expand_dims(attention.wq.compute(query_t), 1))
+
+            # (batch_size, max_len) bias for the steps past the length of each session
+            mask = tf.sequence_mask(lengths, max_len)
+            if attention.window is not None:
+                # causal local pattern: strided steps in the window and global tokens
+                query_position = tf.expand_dims(positions, -1)
+                key_position = tf.range(max_len)[None, :]
+                distance = query_position - key_position
+                local = tf.logical_and(distance % attention.stride == 0,
+                                       distance <= attention.window * attention.stride)
+                if attention.n_global > 0:
+                    local = tf.logical_or(local, tf.logical_or(key_position < attention.n_global,
+                                                               query_position < attention.n_global))
+                mask = tf.logical_and(mask, local)
+            key_bias = tf.where(mask, tf.zeros([], qh.dtype), tf.constant(_MASK_VALUE, qh.dtype))
+
+            context = attention._attend(qh, kh, vh, key_bias=key_bias)
+            return attention._merge_heads(context)[:, 0]
+
+        self._step = step
+
+    @property
+    def active(self):
+        """ number of open sessions """
+        return self.capacity - len(self._free)
+
+    def open(self, n=1):
+        """ opens `n` new sessions with an empty cache
+
+        Returns:
+            sessions (`List[int]`): session ids
+        """
+        if n > len(self._free):
+            raise ValueError(f"cannot open {n} sessions: only {len(self._free)} of {self.capacity} available")
+        sessions = [self._free.pop() for _ in range(n)]
+        self.reset(sessions)
+        return sessions
+
+    def close(self, sessions):
+        """ closes the given sessions, releasing their cache """
+        for session in as_list(sessions):
+            if session in self._free:
+                raise ValueError(f"session {session} is not open")
+            self._free.append(session)
+
+    def reset(self, sessions):
+        """ empties the cache of the given sessions """
+        self.trim(sessions, 0)
+
+    def trim(self, sessions, length):
+        """ trim
+
+        Discards the cached steps of the given sessions after the first `length` steps, the next step is appended
+        at position `length`.
+
+        Args:
+            sessions (`List[int]`): session ids
+            length (`Union[int,List[int]]`): number of steps to keep for all or each of the sessions
+        """
+        sessions = tf.constant(as_list(sessions), dtype=tf.int32)
+        length = tf.broadcast_to(tf.constant(length, dtype=tf.int32), tf.shape(sessions))
+        lengths = tf.minimum(tf.gather(self.lengths, sessions), length)
+        self.lengths.scatter_nd_update(tf.expand_dims(sessions, -1), lengths)
+
+        if self.kv is not None:
+            kv, z = self._linear_state(tf.gather(self.keys, sessions), tf.gather(self.values, sessions), lengths)
+            self.kv.scatter_nd_update(tf.expand_dims(sessions, -1), kv)
+            self.z.scatter_nd_update(tf.expand_dims(sessions, -1), z)
+
+    def reorder(self, sessions, source):
+        """ reorder
+
+        Copies the cache of the `source` sessions to the given `sessions`, e.g. to keep the cache of the
+        hypotheses selected at each step of beam search. Each session in `sessions` gets the cache of the
+        session in the same position in `source`, and a session can be the source of more than one session.
+
+        Args:
+            sessions (`List[int]`): session ids to be updated
+            source (`List[int]`): session ids from which the cache is copied
+        """
+        sessions = tf.expand_dims(tf.constant(as_list(sessions), dtype=tf.int32), -1)
+        source = tf.constant(as_list(source), dtype=tf.int32)
+        variables = [self.keys, self.values, self.lengths]
+        if self.kv is not None:
+            variables += [self.kv, self.z]
+        # gather everything before updating, source and target sessions can overlap
+        updates = [tf.gather(var, source) for var in variables]
+        for var, update in zip(variables, updates):
+            var.scatter_nd_update(sessions, update)
+
+    def read(self, sessions):
+        """ returns the cached keys and values of the given sessions and their lengths """
+        sessions = tf.constant(as_list(sessions), dtype=tf.int32)
+        return tuple(tf.gather(var, sessions) for var in (self.keys, self.values, self.lengths))
+
+    def step(self, query_t, key_t, value_t, sessions):
+        """ step
+
+        Appends the keys and values of a new time step to the cache of each session and computes the attention
+        from the given query to all the cached steps of that session
+
+        Args:
+            query_t (`Tensor`): query for each session with shape `[len(sessions),query_dim]`
+            key_t (`Tensor`): key for each session with shape `[len(sessions),key_dim]`
+            value_t (`Tensor`): value for each session with shape `[len(sessions),value_dim]`
+            sessions (`List[int]`): session ids, each session should appear only once
+
+        Returns:
+            output (`Tensor`): attention output for each session with shape `[len(sessions),n_units]`
+
+        Raises:
+            ValueError: if a session already has `max_len` cached steps
+        """
+        sessions = tf.constant(as_list(sessions), dtype=tf.int32)
+        full = tf.boolean_mask(sessions, tf.gather(self.lengths, sessions) >= self.max_len)
+        if tf.size(full) > 0:
+            raise ValueError(f"sessions {full.numpy().tolist()} reached max_len={self.max_len}, "
+                             f"trim or reset them before the next step")
+        return self._step(query_t, key_t, value_t, sessions)
+
+
+class TransformerBlock(Layer):
+    """ Transformer Block
+
+    Multi-head self-attention followed by a position-wise feed-forward network, each with a residual connection
+    and layer normalization. This is equivalent to composing `MHAttention`, `Residual`, `LayerNorm`, `FC`, and
+    `Dropout` layers, but the entire block is computed by a single compiled function (like a `Module`) where the
+    residual connections are fused with the layer normalization and the bias with the activation in the
+    feed-forward network, without the overhead of each layer call, which is significant for small hidden sizes.
+
+    !!! cite "References"
+        1. Vaswani A., et al. [Attention Is All You Need](https://arxiv.org/abs/1706.03762), 2017
+        2. Xiong R., et al. [On Layer Normalization in the Transformer Architecture](
+        https://arxiv.org/abs/2002.04745), 2020
+
+    Args:
+        input_layer (`Layer`): a layer with shape `[batch_size,seq_len,n_units]`
+        n_heads (`int`): number of attention heads
+        n_hidden (`Optional[int]`): number of units in the hidden layer of the feed-forward network, if None uses
+            `4*n_units`
+        activation (`Callable`): activation function of the feed-forward hidden layer
+        pre_norm (`bool`): if `True` the layer normalization is applied to the input of each sub-layer (pre-norm),
+            otherwise, it's applied to the output of each residual connection (post-norm)
+        causality (`bool`): if `True` each step only attends to previous steps
+        dropout (`float`): dropout probability for the output of each sub-layer
+        attention_dropout (`float`): dropout probability for the attention scores
+        regularized (`bool`): if `True` applies dropout
+        key_length (`Optional[Layer]`): number of valid steps of each example, padded steps are not attended
+        share_state_with (`Optional[TransformerBlock]`): a `TransformerBlock` with which the state is shared
+
+    Attributes:
+        attention (`MHAttention`): self-attention layer
+        attention_norm (`LayerNorm`): layer normalization of the attention sub-layer
+        ffn_hidden (`Linear`): hidden layer of the feed-forward network
+        ffn_output (`Linear`): output layer of the feed-forward network
+        ffn_norm (`LayerNorm`): layer normalization of the feed-forward sub-layer
+    """
+
+    def __init__(self,
+                 input_layer,
+                 n_heads=1,
+                 n_hidden=None,
+                 activation=gelu,
+                 pre_norm=False,
+                 causality=False,
+                 dropout=0.0,
+                 attention_dropout=0.0,
+                 regularized=False,
+                 key_length=None,
+                 share_state_with: Optional['TransformerBlock'] = None,
+                 name="transformer_block"):
+        if share_state_with is not None and not isinstance(share_state_with, TransformerBlock):
+            raise TypeError(f"can only share state with a TransformerBlock: {type(share_state_with)} found")
+
+        input_layer = as_layer(input_layer)
+        self.n_heads = n_heads
+        self.n_hidden = 4 * input_layer.n_units if n_hidden is None else n_hidden
+        self.activation = activation
+        self.pre_norm = pre_norm
+        self.causality = causality
+        self.dropout = dropout
+        self.attention_dropout = attention_dropout
+        self.regularized = regularized
+        self.key_length = as_layer(key_length) if key_length is not None else None
+        self.share_state_with = share_state_with
+        self.block_fn = tf.function(self.compute_block)
+
+        super().__init__(inputs=[input_layer] + as_list(self.key_length),
+                         n_units=input_layer.n_units,
+                         dtype=tf.float32,
+                         name=name,
+                         n_heads=n_heads,
+                         n_hidden=self.n_hidden,
+                         activation=activation,
+                         pre_norm=pre_norm,
+                         causality=causality,
+                         dropout=dropout,
+                         attention_dropout=attention_dropout,
+                         regularized=regularized,
+                         share_state_with=share_state_with)
+
+    def compute_shape(self):
+        return self.input.shape
+
+    def init_state(self):
+        layer_state = super().init_state()
+        input_layer = self.input
+
+        with layer_scope(self):
+            if self.share_state_with is None:
+                attention = MHAttention(input_layer, input_layer, input_layer,
+                                        n_units=self.n_units,
+                                        n_heads=self.n_heads,
+                                        causality=self.causality,
+                                        attention_dropout=self.attention_dropout,
+                                        regularized=self.regularized,
+                                        key_length=self.key_length)
+                attention_norm = LayerNorm(input_layer)
+                ffn_hidden = Linear(input_layer, self.n_hidden, name="ffn_hidden")
+                ffn_output = Linear(ffn_hidden, self.n_units, name="ffn_output")
+                ffn_norm = LayerNorm(input_layer)
+            else:
+                shared = self.share_state_with.layer_state
+                attention = shared.attention.reuse_with(input_layer, input_layer, input_layer,
+                                                        regularized=self.regularized,
+                                                        key_length=self.key_length)
+                attention_norm = shared.attention_norm
+                ffn_hidden = shared.ffn_hidden
+                ffn_output = shared.ffn_output
+                ffn_norm = shared.ffn_norm
+
+            layer_state.attention = attention
+            layer_state.attention_norm = attention_norm
+            layer_state.ffn_hidden = ffn_hidden
+            layer_state.ffn_output = ffn_output
+            layer_state.ffn_norm = ffn_norm
+
+        return layer_state
+
+    def compute(self, input_tensor, *key_length):
+        return self.block_fn(as_tensor(input_tensor, dtype=self.dtype), *key_length)
+
+    def compute_block(self, input_tensor, *key_length):
+        state = self.layer_state
+        attention_norm = state.attention_norm
+        ffn_norm = state.ffn_norm
+
+        def sublayer_dropout(h):
+            if self.regularized and self.dropout > 0:
+                return dropout(h, probability=self.dropout, scale=True)
+            return h
+
+        with layer_scope(self):
+            x = input_tensor
+            shape = tf.shape(x)
+
+            h = _layer_norm(x, attention_norm.scale, attention_norm.bias) if self.pre_norm else x
+            h = sublayer_dropout(state.attention.compute(h, h, h, *key_length))
+            if self.pre_norm:
+                x = x + h
+                h = _layer_norm(x, ffn_norm.scale, ffn_norm.bias)
+            else:
+                x = h = _layer_norm(x + h, attention_norm.scale, attention_norm.bias)
+
+            # feed-forward network on [batch_size*seq_len,n_units]
+            h = tf.reshape(h, [-1, self.n_units])
+            h = self.activation(tf.nn.bias_add(tf.matmul(h, state.ffn_hidden.weights), state.ffn_hidden.bias))
+            h = tf.nn.bias_add(tf.matmul(h, state.ffn_output.weights), state.ffn_output.bias)
+            h = sublayer_dropout(tf.reshape(h, shape))
+
+            if self.pre_norm:
+                return x + h
+            else:
+                return _layer_norm(x + h, ffn_norm.scale, ffn_norm.bias)
+
+    def reuse_with(self, input_layer, key_length=None, regularized=None, name=None):
+        name = self.name if name is None else name
+        regularized = self.regularized if regularized is None else regularized
+        key_length = self.key_length if key_length is None else key_length
+        share_state_with = self if self.share_state_with is None else self.share_state_with
+
+        return TransformerBlock(input_layer,
+                                n_heads=self.n_heads,
+                                n_hidden=self.n_hidden,
+                                activation=self.activation,
+                                pre_norm=self.pre_norm,
+                                causality=self.causality,
+                                dropout=self.dropout,
+                                attention_dropout=self.attention_dropout,
+                                regularized=regularized,
+                                key_length=key_length,
+                                share_state_with=share_state_with,
+                                name=name)
+
+
 class FC(Layer):
     def __init__(self,
                  input_layer,
@@ -4457,6 +6568,21 @@ class SeqMap(Layer):
     """ Applies a given layer configuration to each element in the first dimension (time-major)
     of the input layer
 
+    Args:
+        input_seq (`Layer`): a layer with shape `[time_step,batch_size,...]`
+        layer_config (`LayerConfig`): configuration of the layer applied to each step
+        sequence_length (`Optional[Layer]`): a layer or tensor with shape `[batch_size]` with the number of valid
+            time steps of each example, outputs after that are zero.
+        compact (`bool`): if `True` and `sequence_length` is given, the layer is only applied to the examples
+            that are still active at each step.
+        fold_time (`Optional[bool]`): if `True` the layer is applied once to all the time steps, with time folded
+            into the batch dimension (`[time_step*batch_size,...]`), which is only valid if the layer is stateless
+            and doesn't depend on the batch it is applied to. If `None`, time is folded for layer types known to be
+            time independent (`Linear`, `FC`, `Activation`, and `LayerNorm`).
+        unroll (`Union[bool,int]`): if `True` and the number of time steps is known statically, the loop over
+            the sequence is unrolled in the graph. If an `int > 1`, each iteration of the loop computes `unroll`
+            time steps.
+        parallel_iterations (`int`): number of loop iterations allowed to run in parallel (see `tf.while_loop`)
     """
 
     def __init__(self,
@@ -4465,6 +6591,10 @@ class SeqMap(Layer):
                  parallel_iterations=10,
                  n_units=None,
                  shape=None,
+                 sequence_length=None,
+                 compact=False,
+                 fold_time=None,
+                 unroll=False,
                  share_state_with: Optional['SeqMap'] = None,
                  name="seq_map"):
 
@@ -4477,24 +6607,65 @@ class SeqMap(Layer):
         self.share_state_with = share_state_with
         self.parallel_iterations = parallel_iterations
         self.layer_config = layer_config
+        self.sequence_length = as_layer(sequence_length) if sequence_length is not None else None
+        self.compact = compact
+        self.fold_time = fold_time
+        self.unroll = unroll
 
         # n_units and shape are set after the first cell is created
-        super().__init__(inputs=input_seq,
+        super().__init__(inputs=[input_seq] + as_list(self.sequence_length),
                          n_units=layer_config.kwargs.get('n_units', n_units),
                          shape=shape,
                          dtype=tf.float32,
                          name=name,
                          layer_config=layer_config,
                          parallel_iterations=parallel_iterations,
+                         compact=compact,
+                         fold_time=fold_time,
+                         unroll=unroll,
                          share_state_with=share_state_with)
 
     def compute_shape(self):
         input_shape = self.input.shape
         return input_shape[:-1] + self.n_units
 
+    @property
+    def folded(self):
+        """ True if the time dimension is folded into the batch dimension in a single call of the layer """
+        if self.fold_time is None:
+            return isinstance(self.layer_state.layer_instance, (Linear, FC, Activation, LayerNorm))
+        return self.fold_time
+
+    def compute_folded(self, input_seq, sequence_length=None):
+        layer_instance = self.layer_state.layer_instance
+        input_shape = tf.shape(input_seq)
+        seq_len, batch_size = input_shape[0], input_shape[1]
+
+        if sequence_length is not None:
+            # [time_step, batch_size] mask of valid steps
+            active = tf.transpose(tf.sequence_mask(sequence_length, seq_len))
+            if self.compact:
+                indices = tf.where(active)
+                y = layer_instance.compute(tf.gather_nd(input_seq, indices))
+                output_shape = tf.concat([tf.shape(active, out_type=tf.int64),
+                                          tf.shape(y, out_type=tf.int64)[1:]], axis=0)
+                return tf.scatter_nd(indices, y, output_shape)
+        else:
+            active = None
+
+        flat = tf.reshape(input_seq, tf.concat([[seq_len * batch_size], input_shape[2:]], axis=0))
+        y = layer_instance.compute(flat)
+        y_shape = tf.shape(y)
+        y = tf.reshape(y, tf.concat([[seq_len, batch_size], y_shape[1:]], axis=0))
+
+        if active is not None:
+            mask = tf.reshape(active, tf.concat([tf.shape(active), tf.ones_like(y_shape[1:])], axis=0))
+            y = tf.where(mask, y, tf.zeros_like(y))
+        return y
+
     def init_state(self):
         state = super().init_state()
-        input_seq = self.inputs[-1]
+        input_seq = self.inputs[0]
         x0 = input_seq[0]
 
         # TODO we could pass the layer directly but since right now we only allow to build layers from
@@ -4521,44 +6692,66 @@ class SeqMap(Layer):
 
         return state
 
-    def compute(self, input_seq):
+    def compute(self, input_seq, *sequence_length):
         layer_instance = self.layer_state.layer_instance
         with layer_scope(self):
-            seq_len = tf.shape(input_seq)[0]
+            if self.folded:
+                sequence_length = tf.cast(sequence_length[0], tf.int32) if sequence_length else None
+                return self.compute_folded(input_seq, sequence_length)
+
+            if sequence_length:
+                sequence_length = tf.cast(sequence_length[0], tf.int32)
+
+                def step(t, xt):
+                    active = t < sequence_length
+                    if self.compact:
+                        active = tf.where(active)
+                        yt = layer_instance.compute(tf.gather_nd(xt, active))
+                        output_shape = tf.concat([tf.shape(xt, out_type=tf.int64)[:1], tf.shape(yt, out_type=tf.int64)[1:]], 0)
+                        return tf.scatter_nd(active, yt, output_shape)
+                    else:
+                        yt = layer_instance.compute(xt)
+                        mask = tf.reshape(active, tf.concat([tf.shape(active), tf.ones_like(tf.shape(yt)[1:])], 0))
+                        return tf.where(mask, yt, tf.zeros_like(yt))
+            else:
+                def step(t, xt):
+                    return layer_instance.compute(xt)
+
+            seq_len = input_seq.shape[0] if self.unroll is True and input_seq.shape[0] is not None else \
+                tf.shape(input_seq)[0]
             input_ta = tf.TensorArray(dtype=input_seq.dtype, size=seq_len, tensor_array_name="inputs",
                                       clear_after_read=False)
             input_ta = input_ta.unstack(input_seq)
             output_ta = tf.TensorArray(dtype=self.dtype, size=seq_len, tensor_array_name="outputs")
 
-            i0 = 0
-            ii = i0 + 1
-            fi = seq_len
-
-            x0 = input_ta.read(i0)
-
-            output_ta = output_ta.write(i0, layer_instance.compute(x0))
-
             def compute_step(t, y):
                 xt = input_ta.read(t)
-                c = layer_instance.compute(xt)
+                c = step(t, xt)
                 y = y.write(t, c)
-                t = t + 1
-                return t, y
+                return y,
 
-            i, out = tf.while_loop(cond=lambda t, *_: tf.math.not_equal(t, fi),
-                                   body=compute_step,
-                                   loop_vars=(ii, output_ta),
-                                   name="map_seq",
-                                   parallel_iterations=self.parallel_iterations)
+            output_ta, = compute_step(0, output_ta)
+            out, = _unroll_loop(compute_step,
+                                loop_vars=(output_ta,),
+                                n=seq_len,
+                                start=1,
+                                unroll=self.unroll,
+                                parallel_iterations=self.parallel_iterations,
+                                name="map_seq")
 
             return out.stack()
 
-    def reuse_with(self, input_seq, name=None):
+    def reuse_with(self, input_seq, sequence_length=None, name=None):
         name = self.name if name is None else name
+        sequence_length = self.sequence_length if sequence_length is None else sequence_length
 
         return SeqMap(input_seq=input_seq,
                       layer_config=self.layer_config,
                       parallel_iterations=self.parallel_iterations,
+                      sequence_length=sequence_length,
+                      compact=self.compact,
+                      fold_time=self.fold_time,
+                      unroll=self.unroll,
                       share_state_with=self,
                       name=name)
 
@@ -4620,9 +6813,11 @@ layer_scope: Type[LayerScope] = LayerScope
 
 __all__ = [
     "Input",
+    "AdaptiveSoftmax",
     "Linear",
     "Activation",
     "Lookup",
+    "compact_lookup",
     "Lambda",
     "DropConnect",
     "as_layer",
@@ -4643,17 +6838,25 @@ __all__ = [
     "GRUCell",
     "LSTMCell",
     "RNN",
+    "BiRNN",
+    "SessionState",
     "OneHot",
     "ToDense",
     "ToSparse",
     "Dropout",
     "Conv1D",
+    "Conv1DStream",
+    "convert_conv1d",
     "MHAttention",
+    "KVCache",
+    "TransformerBlock",
     "DropLookup",
     "Residual",
     "FC",
     "SeqConcat",
     "SeqMap",
     "LayerNorm",
-    "BatchNorm"
+    "ResidualLayerNorm",
+    "BatchNorm",
+    "fold_batch_norm"
 ]
@@ -1,6 +1,8 @@
 import tensorflow as tf
 import tensorx as tx
-from tensorx.layers import Lambda
+import numpy as np
+from tensorx.layers import Lambda, AdaptiveSoftmax, Linear, Lookup
+from tensorx.random import alias_table, sample_alias
 
 
 def binary_cross_entropy(labels, logits, name="binary_cross_entropy"):
@@ -222,6 +224,132 @@ def sinkhorn_loss(target, predicted, epsilon, n_iter, cost_fn=None):
     return tx.sinkhorn(target, predicted, epsilon=epsilon, n_iter=n_iter, cost_fn=cost_fn)
 
 
+def sampled_logits(labels,
+                   hidden,
+                   weights,
+                   bias,
+                   sampled,
+                   probs,
+                   n_samples,
+                   class_axis=0,
+                   remove_accidental_hits=True):
+    """ Sampled Logits
+
+    Computes the logits of the true classes and of a set of sampled negative classes, corrected by the log of the
+    expected number of times each class is sampled (`log Q(y)`). Used by `sampled_softmax_loss` and `nce_loss`.
+
+    Args:
+        labels (`Tensor` or `SparseTensor`): integer class ids with shape `[batch_size]` or `[batch_size,num_true]`
+            or a `SparseTensor` with shape `[batch_size,n_classes]` and the same number of active classes per row
+            (e.g. from `Input(n_active=num_true)`)
+        hidden (`Tensor`): input to the output layer with shape `[batch_size,dim]`
+        weights (`Tensor`): output weights with `n_classes` along `class_axis` and `dim` along the other axis
+        bias (`Tensor`): output bias with shape `[n_classes]` or None
+        sampled (`Tensor`): sampled class ids, either `[n_samples]` shared by the entire batch or
+            `[batch_size,n_samples]`
+        probs (`Tensor`): probability of sampling each class with shape `[n_classes]`
+        n_samples (`int`): number of samples drawn per example
+        class_axis (`int`): axis of the classes in the weights (`0` for `Lookup` weights, `1` for `Linear` weights)
+        remove_accidental_hits (`bool`): if True, sampled classes that are true classes for an example are masked
+
+    Returns:
+        true_logits, sampled_logits (`Tuple[Tensor,Tensor]`): tensors with shape `[batch_size,num_true]` and
+        `[batch_size,n_samples]`
+    """
+    hidden = tf.convert_to_tensor(hidden)
+    batch_size = tf.shape(hidden)[0]
+
+    if isinstance(labels, tf.SparseTensor):
+        true_ids = tf.reshape(labels.indices[:, -1], tf.stack([batch_size, -1]))
+    else:
+        true_ids = tf.cast(labels, tf.int64)
+        if true_ids.shape.rank == 1:
+            true_ids = tf.expand_dims(true_ids, -1)
+    sampled = tf.cast(sampled, tf.int64)
+
+    def class_weights(ids):
+        w = tf.gather(weights, ids, axis=class_axis)
+        if class_axis != 0:
+            rank = ids.shape.rank
+            w = tf.transpose(w, list(range(1, rank + 1)) + [0])
+        return tf.cast(w, hidden.dtype)
+
+    def log_expected_count(ids):
+        # classes are sampled with replacement, each class is expected n_samples * p times
+        p = tf.cast(tf.gather(probs, ids), hidden.dtype)
+        return tf.math.log(tf.cast(n_samples, hidden.dtype)) + tf.math.log(p)
+
+    true_logits = tf.einsum("bd,btd->bt", hidden, class_weights(true_ids))
+    if sampled.shape.rank == 1:
+        sampled_logits = tf.matmul(hidden, class_weights(sampled), transpose_b=True)
+    else:
+        sampled_logits = tf.einsum("bd,bnd->bn", hidden, class_weights(sampled))
+
+    if bias is not None:
+        true_logits += tf.gather(bias, true_ids)
+        sampled_logits += tf.gather(bias, sampled)
+
+    true_logits -= log_expected_count(true_ids)
+    sampled_logits -= log_expected_count(sampled)
+
+    if remove_accidental_hits:
+        sampled_ids = tf.broadcast_to(sampled, tf.shape(sampled_logits, out_type=tf.int64))
+        hits = tf.reduce_any(tf.equal(tf.expand_dims(true_ids, -1), tf.expand_dims(sampled_ids, 1)), axis=1)
+        sampled_logits = tf.where(hits, tf.fill(tf.shape(sampled_logits), sampled_logits.dtype.min), sampled_logits)
+
+    return true_logits, sampled_logits
+
+
+def sampled_softmax_loss(true_logits, sampled_logits, name="sampled_softmax_loss"):
+    """ Sampled Softmax Loss
+
+    Approximates the softmax cross-entropy over a large number of classes with a softmax over the true classes and
+    a set of sampled negative classes [1]. Use `sampled_logits` to compute the logits.
+
+    Args:
+        true_logits (`Tensor`): corrected logits for the true classes `[batch_size,num_true]`
+        sampled_logits (`Tensor`): corrected logits for the sampled classes `[batch_size,n_samples]`
+        name (str): op name
+
+    Returns:
+        tensor (`Tensor`): sampled softmax loss with shape `[batch_size]`
+
+    References:
+        1. [On Using Very Large Target Vocabulary for Neural Machine Translation](https://arxiv.org/abs/1412.2007)
+    """
+    with tf.name_scope(name):
+        num_true = tf.shape(true_logits)[-1]
+        logits = tf.concat([true_logits, sampled_logits], axis=-1)
+        labels = tf.concat([tf.ones_like(true_logits) / tf.cast(num_true, true_logits.dtype),
+                            tf.zeros_like(sampled_logits)], axis=-1)
+        return tf.nn.softmax_cross_entropy_with_logits(labels=labels, logits=logits)
+
+
+def nce_loss(true_logits, sampled_logits, name="nce_loss"):
+    """ Noise Contrastive Estimation Loss
+
+    Trains a binary classifier to discriminate the true classes from the sampled (noise) classes [1]. Use
+    `sampled_logits` to compute the logits.
+
+    Args:
+        true_logits (`Tensor`): corrected logits for the true classes `[batch_size,num_true]`
+        sampled_logits (`Tensor`): corrected logits for the sampled classes `[batch_size,n_samples]`
+        name (str): op name
+
+    Returns:
+        tensor (`Tensor`): nce loss with shape `[batch_size]`
+
+    References:
+        1. [Noise-contrastive estimation: A new estimation principle for unnormalized statistical models](
+        http://proceedings.mlr.press/v9/gutmann10a/gutmann10a.pdf)
+    """
+    with tf.name_scope(name):
+        true_xent = tf.nn.sigmoid_cross_entropy_with_logits(labels=tf.ones_like(true_logits), logits=true_logits)
+        sampled_xent = tf.nn.sigmoid_cross_entropy_with_logits(labels=tf.zeros_like(sampled_logits),
+                                                               logits=sampled_logits)
+        return tf.reduce_sum(true_xent, axis=-1) + tf.reduce_sum(sampled_xent, axis=-1)
+
+
 class Loss(Lambda):
     pass
 
@@ -283,11 +411,159 @@ class MSE(Loss):
         super().__init__(target, predicted, fn=mse, name=name)
 
 
+class AdaptiveSoftmaxLoss(Loss):
+    """ AdaptiveSoftmaxLoss
+
+    Training loss for an `AdaptiveSoftmax` output layer: the negative log-likelihood of the labels computed from the
+    input of the `AdaptiveSoftmax` layer, without evaluating the log-probabilities for the entire vocabulary.
+
+    Args:
+        labels (`Layer`): integer word ids with the same outer shape as the adaptive softmax input, or a sparse
+            input with shape `[batch_size,n_units]` (e.g. `Input(n_active=...)`)
+        adaptive_softmax (`AdaptiveSoftmax`): the output layer from which the loss is computed
+        name (`str`): layer name
+    """
+
+    def __init__(self, labels, adaptive_softmax, name="AdaptiveSoftmaxLoss"):
+        if not isinstance(adaptive_softmax, AdaptiveSoftmax):
+            raise TypeError(f"expected an AdaptiveSoftmax layer: {type(adaptive_softmax)} found instead")
+
+        hidden = adaptive_softmax.input
+        super().__init__(labels,
+                         hidden,
+                         n_units=1,
+                         shape=hidden.shape[:-1],
+                         fn=lambda y, h: adaptive_softmax.nll(h, y),
+                         var_list=adaptive_softmax.trainable_variables,
+                         name=name)
+
+
+class SampledLoss(Loss):
+    """ Base class for losses computed from the logits of the true classes and a set of sampled classes
+
+    Args:
+        labels (`Layer`): integer class ids `[batch_size]`, `[batch_size,num_true]`, or a sparse input with shape
+            `[batch_size,n_classes]` (e.g. `Input(n_active=num_true)`)
+        hidden (`Layer`): input to the output layer with shape `[batch_size,dim]`
+        output_layer (`Linear` or `Lookup`): layer with the output weights (and bias) for all the classes
+        n_samples (`int`): number of sampled classes
+        unigrams (`Sequence[float]`): unnormalized class frequencies used as sampling distribution, if None,
+            samples from a log-uniform (Zipfian) distribution which assumes the class ids are sorted by frequency
+        shared_negatives (`bool`): if True, the same negative classes are used for the entire batch, which computes
+            the sampled logits with a single matrix multiplication
+        remove_accidental_hits (`bool`): if True, sampled classes that are true classes for an example are masked
+        seed (`int`): random seed for the sampler
+        loss_fn (`Callable`): function from `(true_logits, sampled_logits)` to a loss with shape `[batch_size]`
+        name (`str`): layer name
+    """
+
+    def __init__(self,
+                 labels,
+                 hidden,
+                 output_layer,
+                 n_samples,
+                 unigrams=None,
+                 shared_negatives=True,
+                 remove_accidental_hits=True,
+                 seed=None,
+                 loss_fn=sampled_softmax_loss,
+                 name="SampledLoss"):
+
+        if isinstance(output_layer, Lookup):
+            n_classes = output_layer.embedding_shape[0]
+            class_axis = 0
+        elif isinstance(output_layer, Linear):
+            n_classes = output_layer.n_units
+            class_axis = 0 if output_layer.transpose_weights else 1
+        else:
+            raise TypeError(f"output_layer should be a Linear or Lookup layer: {type(output_layer)} found")
+
+        if unigrams is None:
+            ids = np.arange(n_classes, dtype=np.float64)
+            unigrams = np.log(ids + 2) - np.log(ids + 1)
+        elif len(unigrams) != n_classes:
+            raise ValueError(f"unigrams size {len(unigrams)} does not match the number of classes {n_classes}")
+
+        self.output_layer = output_layer
+        self.n_samples = n_samples
+        self.shared_negatives = shared_negatives
+        self.remove_accidental_hits = remove_accidental_hits
+        self.seed = seed
+        self.class_axis = class_axis
+        self.probs = tf.constant(np.asarray(unigrams) / np.sum(unigrams), dtype=tf.float32)
+        self.prob_table, self.alias_table = alias_table(unigrams)
+
+        def loss(y, h):
+            if self.shared_negatives:
+                sample_shape = [self.n_samples]
+            else:
+                sample_shape = tf.stack([tf.shape(h)[0], self.n_samples])
+            sampled = sample_alias(self.prob_table, self.alias_table, sample_shape, seed=self.seed)
+            bias = output_layer.bias if getattr(output_layer, "add_bias", False) else None
+            true_logits, neg_logits = sampled_logits(labels=y,
+                                                     hidden=h,
+                                                     weights=output_layer.weights,
+                                                     bias=bias,
+                                                     sampled=sampled,
+                                                     probs=self.probs,
+                                                     n_samples=self.n_samples,
+                                                     class_axis=self.class_axis,
+                                                     remove_accidental_hits=self.remove_accidental_hits)
+            return loss_fn(true_logits, neg_logits)
+
+        super().__init__(labels,
+                         hidden,
+                         n_units=1,
+                         shape=hidden.shape[:-1],
+                         fn=loss,
+                         var_list=output_layer.trainable_variables,
+                         name=name)
+
+
+class SampledSoftmax(SampledLoss):
+    """ Sampled Softmax Loss layer, see `SampledLoss` and `sampled_softmax_loss`
+    """
+
+    def __init__(self, labels, hidden, output_layer, n_samples, unigrams=None, shared_negatives=True,
+                 remove_accidental_hits=True, seed=None, name="SampledSoftmax"):
+        super().__init__(labels, hidden, output_layer,
+                         n_samples=n_samples,
+                         unigrams=unigrams,
+                         shared_negatives=shared_negatives,
+                         remove_accidental_hits=remove_accidental_hits,
+                         seed=seed,
+                         loss_fn=sampled_softmax_loss,
+                         name=name)
+
+
+class NCE(SampledLoss):
+    """ Noise Contrastive Estimation Loss layer, see `SampledLoss` and `nce_loss`
+    """
+
+    def __init__(self, labels, hidden, output_layer, n_samples, unigrams=None, shared_negatives=True,
+                 remove_accidental_hits=True, seed=None, name="NCE"):
+        super().__init__(labels, hidden, output_layer,
+                         n_samples=n_samples,
+                         unigrams=unigrams,
+                         shared_negatives=shared_negatives,
+                         remove_accidental_hits=remove_accidental_hits,
+                         seed=seed,
+                         loss_fn=nce_loss,
+                         name=name)
+
+
 __all__ = [
     "binary_cross_entropy",
     "categorical_cross_entropy",
     "BinaryCrossEntropy",
     "CategoricalCrossEntropy",
+    "AdaptiveSoftmaxLoss",
+    "sampled_logits",
+    "sampled_softmax_loss",
+    "nce_loss",
+    "SampledLoss",
+    "SampledSoftmax",
+    "NCE",
     "mse",
     "MSE"
 ]
@@ -1214,6 +1214,366 @@ def sparse_overlap(sp_tensor1, sp_tensor2, name="sparse_overlap"):
         return filtered
 
 
+def blockwise_attention(query, key, value, block_size=128, causal=False, scale=None, key_mask=None,
+                        name="blockwise_attention"):
+    """ Memory-efficient scaled dot-product attention
+
+    Computes `softmax(query·keyᵀ·scale)·value` without materializing the `[batch_size,tq,tk]` score matrix. Queries
+    are split into blocks of `block_size` steps, and for each query block the keys and values are processed one
+    block at a time with a running maximum and sum of the exponentiated scores (online softmax). The forward
+    computation of each query block is recomputed in the backward pass (see `tf.recompute_grad`), so the memory
+    used by both is `O(block_size·tk)` instead of `O(tq·tk)`.
+
+    Causal masking is computed from the query and key positions of each block, and key blocks entirely in the
+    future of a query block are skipped.
+
+    Args:
+        query (`Tensor`): query tensor with shape `[batch_size,tq,d]`
+        key (`Tensor`): key tensor with shape `[batch_size,tk,d]`
+        value (`Tensor`): value tensor with shape `[batch_size,tk,dv]`
+        block_size (`int`): number of query and key steps in each block
+        causal (`bool`): if `True`, query step `i` only attends to key steps `j <= i`
+        scale (`Optional[float]`): scale of the dot products, defaults to `1/sqrt(d)`
+        key_mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size,tk]`, keys where the mask is `False`
+            are ignored
+        name (`str`): name for this op
+
+    Returns:
+        tensor (`Tensor`): attention output with shape `[batch_size,tq,dv]`
+    """
+    with tf.name_scope(name):
+        query = tf.convert_to_tensor(query)
+        key = tf.convert_to_tensor(key)
+        value = tf.convert_to_tensor(value)
+        dtype = query.dtype
+        if scale is None:
+            scale = tf.math.rsqrt(tf.cast(tf.shape(query)[-1], dtype))
+
+        tq = tf.shape(query)[1]
+        tk = tf.shape(key)[1]
+        nq = (tq + block_size - 1) // block_size
+        nk = (tk + block_size - 1) // block_size
+        offsets = tf.range(block_size)
+
+        def blocks(x, n):
+            # [n, batch_size, block_size, d]
+            x = tf.pad(x, [[0, 0], [0, n * block_size - tf.shape(x)[1]], [0, 0]])
+            x = tf.reshape(x, [tf.shape(x)[0], n, block_size, tf.shape(x)[-1]])
+            return tf.transpose(x, [1, 0, 2, 3])
+
+        q_blocks = blocks(query, nq)
+        k_blocks = blocks(key, nk)
+        v_blocks = blocks(value, nk)
+        if key_mask is not None:
+            # [nk, batch_size, 1, block_size]
+            m_blocks = blocks(tf.cast(key_mask, dtype)[..., None], nk)
+            m_blocks = tf.transpose(m_blocks, [0, 1, 3, 2]) > 0
+        else:
+            m_blocks = None
+
+        @tf.recompute_grad
+        def query_block(qi, q_pos, k_blocks, v_blocks):
+            batch_size = tf.shape(qi)[0]
+            m = tf.fill([batch_size, block_size], dtype.min)
+            l = tf.zeros([batch_size, block_size], dtype=dtype)
+            acc = tf.zeros([batch_size, block_size, tf.shape(v_blocks)[-1]], dtype=dtype)
+
+            # key blocks after the last query position are fully masked
+            n_blocks = tf.minimum(nk, q_pos[-1] // block_size + 1) if causal else nk
+
+            def attend(j, m, l, acc):
+                k_pos = j * block_size + offsets
+                valid = k_pos[None, :] < tk
+                if causal:
+                    # [block_size, block_size]
+                    valid = tf.logical_and(valid, k_pos[None, :] <= q_pos[:, None])
+                if m_blocks is not None:
+                    valid = tf.logical_and(valid, m_blocks[j])
+
+                s = tf.matmul(qi, k_blocks[j], transpose_b=True) * scale
+                s = tf.where(valid, s, dtype.min)
+
+                m_j = tf.maximum(m, tf.reduce_max(s, axis=-1))
+                p = tf.exp(s - m_j[..., None])
+                correction = tf.exp(m - m_j)
+                l = l * correction + tf.reduce_sum(p, axis=-1)
+                acc = acc * correction[..., None] + tf.matmul(p, v_blocks[j])
+                return j + 1, m_j, l, acc
+
+            _, m, l, acc = tf.while_loop(cond=lambda j, *_: j < n_blocks,
+                                         body=attend,
+                                         loop_vars=(0, m, l, acc))
+            return acc / l[..., None]
+
+        q_positions = tf.range(nq)[:, None] * block_size + offsets[None, :]
+        output = tf.map_fn(lambda q: query_block(q[0], q[1], k_blocks, v_blocks),
+                           (q_blocks, q_positions),
+                           fn_output_signature=dtype)
+
+        # [nq, batch_size, block_size, dv] -> [batch_size, tq, dv]
+        output = tf.transpose(output, [1, 0, 2, 3])
+        output = tf.reshape(output, [tf.shape(output)[0], nq * block_size, tf.shape(output)[-1]])
+        return output[:, :tq]
+
+
+def local_attention(query,
+                    key,
+                    value,
+                    window,
+                    stride=1,
+                    n_global=0,
+                    causal=False,
+                    scale=None,
+                    key_mask=None,
+                    name="local_attention"):
+    """ Sliding window, strided, and global token attention
+
+    Sparse scaled dot-product self-attention where each query step `i` attends only to the key steps `j` with
+    `(i-j) % stride == 0` and `|i-j| <= window*stride` (`0 <= i-j <= window*stride` if `causal`). With `stride=1`
+    this is a sliding window (local band) over the sequence, with `stride>1` a dilated window. The first `n_global`
+    steps are global tokens: they attend to all the steps and all the steps attend to them.
+
+    Steps are grouped by `i % stride`, and each group is split into blocks of `window` steps, each block of queries
+    attends to its own block of keys and the neighbouring blocks, so both compute and memory are `O(seq_len·window)`
+    instead of `O(seq_len²)`, plus `O(seq_len·n_global)` for the global tokens.
+
+    Args:
+        query (`Tensor`): query tensor with shape `[batch_size,seq_len,d]`
+        key (`Tensor`): key tensor with shape `[batch_size,seq_len,d]`
+        value (`Tensor`): value tensor with shape `[batch_size,seq_len,dv]`
+        window (`int`): number of (strided) steps before and after each query that it attends to
+        stride (`int`): distance between attended steps
+        n_global (`int`): number of global tokens at the start of the sequence
+        causal (`bool`): if `True`, query step `i` only attends to key steps `j <= i`
+        scale (`Optional[float]`): scale of the dot products, defaults to `1/sqrt(d)`
+        key_mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size,seq_len]`, keys where the mask is
+            `False` are ignored
+        name (`str`): name for this op
+
+    Returns:
+        tensor (`Tensor`): attention output with shape `[batch_size,seq_len,dv]`
+    """
+    with tf.name_scope(name):
+        query = tf.convert_to_tensor(query)
+        key = tf.convert_to_tensor(key)
+        value = tf.convert_to_tensor(value)
+        dtype = query.dtype
+        if scale is None:
+            scale = tf.math.rsqrt(tf.cast(tf.shape(query)[-1], dtype))
+
+        batch_size = tf.shape(query)[0]
+        seq_len = tf.shape(query)[1]
+        if key_mask is None:
+            key_mask = tf.ones([batch_size, seq_len], dtype=tf.bool)
+        key_mask = tf.cast(key_mask, tf.bool)
+        positions = tf.broadcast_to(tf.range(seq_len)[None, :], [batch_size, seq_len])
+
+        # [batch_size, seq_len, ...] -> [batch_size*stride, n, ...] with step t*stride+s in group s
+        n = (seq_len + stride - 1) // stride
+
+        def group(x):
+            x = tf.pad(x, [[0, 0], [0, n * stride - seq_len]] + [[0, 0]] * (x.shape.rank - 2))
+            shape = tf.shape(x)
+            x = tf.reshape(x, tf.concat([[shape[0], n, stride], shape[2:]], axis=0))
+            x = tf.transpose(x, [0, 2, 1] + list(range(3, x.shape.rank)))
+            return tf.reshape(x, tf.concat([[shape[0] * stride, n], shape[2:]], axis=0))
+
+        def ungroup(x):
+            shape = tf.shape(x)
+            x = tf.reshape(x, tf.concat([[batch_size, stride, n], shape[2:]], axis=0))
+            x = tf.transpose(x, [0, 2, 1] + list(range(3, x.shape.rank)))
+            return tf.reshape(x, tf.concat([[batch_size, n * stride], shape[2:]], axis=0))[:, :seq_len]
+
+        # blocks of window steps, [batch_size*stride, n_blocks, window, ...]
+        n_blocks = (n + window - 1) // window
+
+        def query_blocks(x):
+            x = tf.pad(x, [[0, 0], [0, n_blocks * window - n]] + [[0, 0]] * (x.shape.rank - 2))
+            shape = tf.shape(x)
+            return tf.reshape(x, tf.concat([[shape[0], n_blocks, window], shape[2:]], axis=0))
+
+        # each query block attends to the previous, current, and next key blocks
+        def key_blocks(x):
+            x = tf.pad(x, [[0, 0], [window, n_blocks * window - n + window]] + [[0, 0]] * (x.shape.rank - 2))
+            shape = tf.shape(x)
+            x = tf.reshape(x, tf.concat([[shape[0], n_blocks + 2, window], shape[2:]], axis=0))
+            context = [x[:, :-2], x[:, 1:-1]] if causal else [x[:, :-2], x[:, 1:-1], x[:, 2:]]
+            return tf.concat(context, axis=2)
+
+        q_blocks = query_blocks(group(query))
+        k_blocks = key_blocks(group(key))
+        v_blocks = key_blocks(group(value))
+        mask_blocks = key_blocks(group(key_mask))
+        k_positions = key_blocks(group(positions))
+
+        # relative (grouped) position of keys to queries, independent of the block [window, context]
+        context_size = 2 * window if causal else 3 * window
+        relative = tf.range(context_size)[None, :] - window - tf.range(window)[:, None]
+        valid = relative <= 0 if causal else tf.abs(relative) <= window
+        valid = tf.logical_and(tf.logical_and(valid, relative >= -window)[None, None],
+                               mask_blocks[:, :, None, :])
+        if n_global > 0:
+            # global keys are attended separately
+            valid = tf.logical_and(valid, k_positions[:, :, None, :] >= n_global)
+
+        scores = tf.einsum("bnqd,bnkd->bnqk", q_blocks, k_blocks) * scale
+        scores = tf.where(valid, scores, dtype.min)
+
+        if n_global > 0:
+            global_keys = tf.repeat(key[:, :n_global], stride, axis=0)
+            global_values = tf.repeat(value[:, :n_global], stride, axis=0)
+            global_mask = tf.repeat(key_mask[:, :n_global], stride, axis=0)[:, None, None, :]
+            if causal:
+                q_positions = query_blocks(group(positions))
+                global_mask = tf.logical_and(global_mask, tf.range(n_global) <= q_positions[..., None])
+
+            global_scores = tf.einsum("bnqd,bkd->bnqk", q_blocks, global_keys) * scale
+            global_scores = tf.where(global_mask, global_scores, dtype.min)
+            scores = tf.concat([scores, global_scores], axis=-1)
+
+        probs = tf.nn.softmax(scores)
+        output = tf.einsum("bnqk,bnkd->bnqd", probs[..., :context_size], v_blocks)
+        if n_global > 0:
+            output += tf.einsum("bnqk,bkd->bnqd", probs[..., context_size:], global_values)
+
+        # [batch_size*stride, n, dv] -> [batch_size, seq_len, dv]
+        output = tf.reshape(output, [batch_size * stride, n_blocks * window, tf.shape(output)[-1]])[:, :n]
+        output = ungroup(output)
+
+        if n_global > 0:
+            # global tokens attend to all the steps
+            global_scores = tf.matmul(query[:, :n_global], key, transpose_b=True) * scale
+            global_mask = key_mask[:, None, :]
+            if causal:
+                global_mask = tf.logical_and(global_mask, tf.range(seq_len) <= tf.range(n_global)[:, None])
+            global_scores = tf.where(global_mask, global_scores, dtype.min)
+            global_output = tf.matmul(tf.nn.softmax(global_scores), value)
+            output = tf.concat([global_output, output[:, n_global:]], axis=1)
+
+        return output
+
+
+def elu_features(tensor):
+    """ `elu(x)+1` feature map for linear attention
+
+    !!! cite "Reference"
+        Katharopoulos A., et al. [Transformers are RNNs: Fast Autoregressive Transformers with Linear Attention](
+        https://arxiv.org/abs/2006.16236), 2020
+
+    Args:
+        tensor (`Tensor`): input tensor
+
+    Returns:
+        tensor (`Tensor`): positive features with the same shape as the input
+    """
+    return tf.nn.elu(tensor) + 1
+
+
+def random_features(tensor, projection):
+    """ Positive random features approximating the softmax kernel `exp(x·y)`
+
+    Computes `exp(x·W - |x|²/2) / sqrt(m)` where `W` is a random projection with shape `[d,m]` with entries
+    drawn from a standard normal distribution, so that `E[φ(x)·φ(y)] = exp(x·y)`.
+
+    !!! cite "Reference"
+        Choromanski K., et al. [Rethinking Attention with Performers](https://arxiv.org/abs/2009.14794), 2020
+
+    Args:
+        tensor (`Tensor`): input tensor with shape `[...,d]`
+        projection (`Tensor`): random projection with shape `[d,m]`
+
+    Returns:
+        tensor (`Tensor`): positive features with shape `[...,m]`
+    """
+    tensor = tf.convert_to_tensor(tensor)
+    m = tf.cast(tf.shape(projection)[-1], tensor.dtype)
+    norm = tf.reduce_sum(tf.square(tensor), axis=-1, keepdims=True) / 2
+    return tf.exp(tf.tensordot(tensor, projection, axes=[[-1], [0]]) - norm) * tf.math.rsqrt(m)
+
+
+def linear_attention(query,
+                     key,
+                     value,
+                     feature_map=elu_features,
+                     causal=False,
+                     key_mask=None,
+                     chunk_size=64,
+                     epsilon=1e-6,
+                     name="linear_attention"):
+    """ Kernelized linear attention
+
+    Replaces the softmax attention `softmax(q·kᵀ)·v` by `φ(q)·(φ(k)ᵀ·v) / φ(q)·Σφ(k)` for a positive feature map
+    `φ`, which is computed in `O(t·d·dv)` time and memory, without the `[batch_size,tq,tk]` attention matrix.
+
+    The causal variant uses prefix sums of `φ(k)ᵀ·v` over the steps: the sequence is split in chunks of
+    `chunk_size` steps, each chunk attends to the sum of the previous chunks and, within the chunk, to the
+    previous steps, so the memory doesn't grow with the square of the sequence length either.
+
+    Args:
+        query (`Tensor`): query tensor with shape `[batch_size,tq,d]`
+        key (`Tensor`): key tensor with shape `[batch_size,tk,d]`
+        value (`Tensor`): value tensor with shape `[batch_size,tk,dv]`
+        feature_map (`Callable`): positive feature map `φ` applied to queries and keys
+        causal (`bool`): if `True`, query step `i` only attends to key steps `j <= i` (requires `tq == tk`)
+        key_mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size,tk]`, keys where the mask is `False`
+            are ignored
+        chunk_size (`int`): number of steps in each chunk of the causal variant
+        epsilon (`float`): added to the normalization term to avoid divisions by zero
+        name (`str`): name for this op
+
+    Returns:
+        tensor (`Tensor`): attention output with shape `[batch_size,tq,dv]`
+    """
+    with tf.name_scope(name):
+        value = tf.convert_to_tensor(value)
+        phi_q = feature_map(tf.convert_to_tensor(query))
+        phi_k = feature_map(tf.convert_to_tensor(key))
+        if key_mask is not None:
+            phi_k *= tf.cast(key_mask, phi_k.dtype)[..., None]
+
+        if not causal:
+            kv = tf.einsum("btd,bte->bde", phi_k, value)
+            z = tf.reduce_sum(phi_k, axis=1)
+            numerator = tf.einsum("btd,bde->bte", phi_q, kv)
+            denominator = tf.einsum("btd,bd->bt", phi_q, z)
+            return numerator / (denominator[..., None] + epsilon)
+
+        batch_size = tf.shape(phi_q)[0]
+        seq_len = tf.shape(phi_q)[1]
+        n = (seq_len + chunk_size - 1) // chunk_size
+
+        def chunks(x):
+            # [n, batch_size, chunk_size, d]
+            x = tf.pad(x, [[0, 0], [0, n * chunk_size - seq_len], [0, 0]])
+            x = tf.reshape(x, [batch_size, n, chunk_size, tf.shape(x)[-1]])
+            return tf.transpose(x, [1, 0, 2, 3])
+
+        causal_mask = tf.linalg.band_part(tf.ones([chunk_size, chunk_size], dtype=phi_q.dtype), -1, 0)
+
+        def chunk_attention(state, chunk):
+            kv, z, _ = state
+            q_c, k_c, v_c = chunk
+            scores = tf.matmul(q_c, k_c, transpose_b=True) * causal_mask
+            numerator = tf.matmul(q_c, kv) + tf.matmul(scores, v_c)
+            denominator = tf.einsum("bcd,bd->bc", q_c, z) + tf.reduce_sum(scores, axis=-1)
+            output = numerator / (denominator[..., None] + epsilon)
+
+            kv = kv + tf.matmul(k_c, v_c, transpose_a=True)
+            z = z + tf.reduce_sum(k_c, axis=1)
+            return kv, z, output
+
+        d = tf.shape(phi_q)[-1]
+        dv = tf.shape(value)[-1]
+        initial = (tf.zeros([batch_size, d, dv], dtype=phi_q.dtype),
+                   tf.zeros([batch_size, d], dtype=phi_q.dtype),
+                   tf.zeros([batch_size, chunk_size, dv], dtype=phi_q.dtype))
+        _, _, output = tf.scan(chunk_attention, (chunks(phi_q), chunks(phi_k), chunks(value)), initializer=initial)
+
+        # [n, batch_size, chunk_size, dv] -> [batch_size, seq_len, dv]
+        output = tf.reshape(tf.transpose(output, [1, 0, 2, 3]), [batch_size, n * chunk_size, dv])
+        return output[:, :seq_len]
+
+
 __all__ = [
     "matrix_indices",
     "empty_sparse_tensor",
@@ -1241,5 +1601,10 @@ __all__ = [
     "sparse_put",
     "put",
     "filter_nd",
-    "repeat"
+    "repeat",
+    "blockwise_attention",
+    "local_attention",
+    "linear_attention",
+    "elu_features",
+    "random_features"
 ]
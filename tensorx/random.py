@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from typing import Optional, List
 from tensorx.utils import as_tensor
@@ -96,8 +97,121 @@ def sample_sigmoid(logits, n, dtype=None, seed=None, name="sample_sigmoid"):
         return tf.cast(tf.greater(logits, z), tf.float32)
 
 
+def _mix32(x):
+    """ finalizer of a 32 bit integer hash, kept within the int64 range to avoid overflows """
+    mask = 0xFFFFFFFF
+    x = tf.bitwise.bitwise_and(tf.bitwise.bitwise_xor(tf.bitwise.right_shift(x, 16), x) * 0x45d9f3b, mask)
+    x = tf.bitwise.bitwise_and(tf.bitwise.bitwise_xor(tf.bitwise.right_shift(x, 16), x) * 0x45d9f3b, mask)
+    return tf.bitwise.bitwise_xor(tf.bitwise.right_shift(x, 16), x)
+
+
+def hash_uniform(*keys, seed=0, dtype=tf.float32, name="hash_uniform"):
+    """ hash_uniform
+
+    Stateless uniform values in `[0,1)` obtained by hashing integer keys. The same `(seed, *keys)` combination
+    always produces the same value, which means we can draw a random value for an arbitrary set of coordinates
+    (e.g. `(row, id)` pairs) without materializing a random tensor for the entire coordinate space.
+
+    !!! example
+        ```python
+        rows = tf.constant([[0], [1]])
+        ids = tf.constant([[2, 2, 3], [2, 4, 2]])
+        u = tx.hash_uniform(rows, ids, seed=42)
+        # u[0,0] == u[0,1], u[1,0] == u[1,2]
+        ```
+
+    Args:
+        *keys (`Tensor`): integer tensors broadcastable to the same shape
+        seed (`int` or `Tensor`): scalar integer seed
+        dtype (`DType`): output float type
+        name (`str`): name for hash_uniform op
+
+    Returns:
+        tensor (`Tensor`): a tensor with the broadcast shape of the keys with values in `[0,1)`
+    """
+    with tf.name_scope(name):
+        mask = 0xFFFFFFFF
+        h = _mix32(tf.bitwise.bitwise_and(as_tensor(seed, tf.int64), mask))
+        for key in keys:
+            key = tf.bitwise.bitwise_and(as_tensor(key, tf.int64), mask)
+            h = _mix32(tf.bitwise.bitwise_and(h * 31 + key, mask))
+
+        # keep 24 bits so that values are exactly representable in float32 and strictly < 1
+        h = tf.bitwise.right_shift(h, 8)
+        return tf.cast(h, dtype) / float(1 << 24)
+
+
+def alias_table(probs):
+    """ alias_table
+
+    Builds the tables for sampling from a discrete distribution with the alias method [1] (Vose's algorithm).
+    Building the tables is `O(n)` and done once in Python, after which `sample_alias` draws each sample in constant
+    time with two uniform draws and two gathers.
+
+    Args:
+        probs (`Sequence[float]`): unnormalized probabilities (e.g. unigram counts) for each class
+
+    Returns:
+        prob_table, alias_table (`Tuple[Tensor,Tensor]`): a `float32` table with the probability of keeping each
+        bucket and an `int64` table with the alias class for each bucket.
+
+    References:
+        1. [A Linear Algorithm For Generating Random Numbers With a Given Distribution](
+        https://doi.org/10.1109/32.92917)
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    if probs.ndim != 1 or np.any(probs < 0) or probs.sum() <= 0:
+        raise ValueError("probs should be a 1D array of non-negative values with a positive sum")
+
+    n = len(probs)
+    scaled = probs / probs.sum() * n
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+
+    small = list(np.flatnonzero(scaled < 1.))
+    large = list(np.flatnonzero(scaled >= 1.))
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.
+        if scaled[l] < 1.:
+            small.append(l)
+        else:
+            large.append(l)
+
+    # leftovers are 1 up to numerical precision
+    return tf.constant(prob, dtype=tf.float32), tf.constant(alias, dtype=tf.int64)
+
+
+def sample_alias(prob_table, alias_table, shape, seed=None, name="sample_alias"):
+    """ sample_alias
+
+    Samples class ids with replacement from a discrete distribution using the alias method. See `alias_table`.
+
+    Args:
+        prob_table (`Tensor`): probability of keeping each bucket
+        alias_table (`Tensor`): alias class for each bucket
+        shape (`TensorShape`): shape of the output
+        seed (`int`): random seed
+        name (`str`): name for sample_alias op
+
+    Returns:
+        samples (`Tensor`): `int64` tensor with the sampled class ids
+    """
+    with tf.name_scope(name):
+        n = tf.shape(alias_table, out_type=tf.int64)[0]
+        buckets = tf.random.uniform(shape, maxval=n, dtype=tf.int64, seed=seed)
+        # the same op seed would give correlated buckets and acceptance draws
+        u = tf.random.uniform(shape, dtype=prob_table.dtype, seed=None if seed is None else seed + 1)
+        return tf.where(u < tf.gather(prob_table, buckets), buckets, tf.gather(alias_table, buckets))
+
+
 __all__ = [
     "gumbel_top",
+    "alias_table",
+    "sample_alias",
+    "hash_uniform",
     "bernoulli",
     "sample_sigmoid"
 ]
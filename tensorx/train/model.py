@@ -13,6 +13,164 @@ import re
 logger = logging.getLogger('tensorx')
 
 
+def dedup_slices(grad):
+    """ sums the values of repeated indices in an `IndexedSlices` gradient
+
+    Args:
+        grad (`IndexedSlices`): gradient with possibly repeated indices
+
+    Returns:
+        grad (`IndexedSlices`): gradient with unique indices
+    """
+    indices, positions = tf.unique(grad.indices)
+    values = tf.math.unsorted_segment_sum(grad.values, positions, tf.shape(indices)[0])
+    return tf.IndexedSlices(values, indices, grad.dense_shape)
+
+
+def clip_gradients(grads, clipnorm=None, clipvalue=None):
+    """ clips a list of gradients by norm and/or by value
+
+    `IndexedSlices` gradients are never converted to dense tensors, repeated indices are summed first so that
+    the norm and the values being clipped are the same as the ones of the equivalent dense gradient.
+
+    Args:
+        grads (`List[Tensor]`): list of gradients, `Tensor`, `IndexedSlices` or `None`
+        clipnorm (`float`): if not None, each gradient is clipped so that its norm is at most clipnorm
+        clipvalue (`float`): if not None, gradient values are clipped to `[-clipvalue, clipvalue]`
+
+    Returns:
+        grads (`List[Tensor]`): the list of clipped gradients
+    """
+    if clipnorm is None and clipvalue is None:
+        return grads
+
+    def clip(g):
+        if g is None:
+            return g
+        if isinstance(g, tf.IndexedSlices):
+            g = dedup_slices(g)
+            values = g.values
+            if clipnorm is not None:
+                values = tf.clip_by_norm(values, clipnorm)
+            if clipvalue is not None:
+                values = tf.clip_by_value(values, -clipvalue, clipvalue)
+            return tf.IndexedSlices(values, g.indices, g.dense_shape)
+        if clipnorm is not None:
+            g = tf.clip_by_norm(g, clipnorm)
+        if clipvalue is not None:
+            g = tf.clip_by_value(g, -clipvalue, clipvalue)
+        return g
+
+    return [clip(g) for g in grads]
+
+
+class LazyUpdates:
+    """ LazyUpdates
+
+    Applies `IndexedSlices` gradients (e.g. from `Lookup` layers or `Linear` layers with sparse inputs) by updating
+    only the rows touched by the gradient: the optimizer state (slots) for those rows and the variable rows themselves.
+    The remaining rows are left untouched, so the cost of an update is proportional to the number of unique ids in a
+    batch instead of the number of rows in a variable.
+
+    The optimizer hyper-parameters are read from a given optimizer, its update rule is applied to the touched rows
+    only. Supported optimizers are `SGD` (with or without momentum), `Adagrad`, `RMSprop` (without momentum and
+    centering), and `Adam` (without amsgrad). `LazyUpdates` keeps its own slot variables and step counter.
+
+    !!! note
+        For stateful optimizers this is an approximation of the dense update (as in "lazy Adam"): slots for rows not
+        present in a batch don't decay.
+
+    Args:
+        optimizer (`Optimizer`): the optimizer from which the update rule and hyper-parameters are taken
+    """
+
+    def __init__(self, optimizer):
+        name = type(optimizer).__name__
+        if name not in ("SGD", "Adagrad", "RMSprop", "Adam"):
+            raise ValueError(f"lazy updates are not supported for {name} optimizers")
+        if name == "Adam" and getattr(optimizer, "amsgrad", False):
+            raise ValueError("lazy updates are not supported for Adam with amsgrad")
+        if name == "RMSprop" and (getattr(optimizer, "centered", False) or getattr(optimizer, "momentum", 0.)):
+            raise ValueError("lazy updates are not supported for RMSprop with momentum or centered")
+
+        momentum = getattr(optimizer, "momentum", 0.)
+        self.optimizer = optimizer
+        self.rule = name
+        self.momentum = not isinstance(momentum, (int, float)) or momentum > 0
+        self.slots = dict()
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False, name="lazy_step")
+
+    def hyper(self, name, dtype):
+        value = getattr(self.optimizer, name)
+        if isinstance(value, tf.optimizers.schedules.LearningRateSchedule):
+            value = value(self.step)
+        elif callable(value) and not isinstance(value, tf.Variable):
+            value = value()
+        return tf.cast(value, dtype)
+
+    def slot(self, var, name, init=0.):
+        """ gets or creates a slot variable with the same shape as the given variable """
+        slots = self.slots.setdefault(var.ref(), dict())
+        if name not in slots:
+            with tf.init_scope():
+                slots[name] = tf.Variable(tf.fill(var.shape, tf.cast(init, var.dtype)),
+                                          trainable=False,
+                                          name=f"{var.name.split(':')[0]}/{name}")
+        return slots[name]
+
+    def apply_gradients(self, grads_and_vars):
+        """ applies the update rule to the rows in each `IndexedSlices` gradient
+
+        Args:
+            grads_and_vars (`List[Tuple[IndexedSlices,Variable]]`): list of gradient variable pairs
+        """
+        self.step.assign_add(1)
+        for grad, var in grads_and_vars:
+            if not isinstance(grad, tf.IndexedSlices):
+                raise TypeError(f"LazyUpdates expects IndexedSlices gradients: {type(grad)} found for {var.name}")
+            grad = dedup_slices(grad)
+            idx, g = grad.indices, tf.cast(grad.values, var.dtype)
+            lr = self.hyper("learning_rate", var.dtype)
+
+            if self.rule == "SGD":
+                if self.momentum:
+                    momentum = self.hyper("momentum", var.dtype)
+                    m = self.slot(var, "momentum")
+                    m_rows = momentum * tf.gather(m, idx) - lr * g
+                    m.scatter_update(tf.IndexedSlices(m_rows, idx))
+                    if getattr(self.optimizer, "nesterov", False):
+                        m_rows = momentum * m_rows - lr * g
+                    var.scatter_add(tf.IndexedSlices(m_rows, idx))
+                else:
+                    var.scatter_sub(tf.IndexedSlices(lr * g, idx))
+            elif self.rule == "Adagrad":
+                eps = self.hyper("epsilon", var.dtype)
+                acc = self.slot(var, "accumulator", init=getattr(self.optimizer, "initial_accumulator_value", 0.1))
+                acc_rows = tf.gather(acc, idx) + tf.square(g)
+                acc.scatter_update(tf.IndexedSlices(acc_rows, idx))
+                var.scatter_sub(tf.IndexedSlices(lr * g / (tf.sqrt(acc_rows) + eps), idx))
+            elif self.rule == "RMSprop":
+                rho = self.hyper("rho", var.dtype)
+                eps = self.hyper("epsilon", var.dtype)
+                v = self.slot(var, "velocity")
+                v_rows = rho * tf.gather(v, idx) + (1 - rho) * tf.square(g)
+                v.scatter_update(tf.IndexedSlices(v_rows, idx))
+                var.scatter_sub(tf.IndexedSlices(lr * g / (tf.sqrt(v_rows) + eps), idx))
+            else:
+                beta_1 = self.hyper("beta_1", var.dtype)
+                beta_2 = self.hyper("beta_2", var.dtype)
+                eps = self.hyper("epsilon", var.dtype)
+                t = tf.cast(self.step, var.dtype)
+                m = self.slot(var, "m")
+                v = self.slot(var, "v")
+                m_rows = beta_1 * tf.gather(m, idx) + (1 - beta_1) * g
+                v_rows = beta_2 * tf.gather(v, idx) + (1 - beta_2) * tf.square(g)
+                m.scatter_update(tf.IndexedSlices(m_rows, idx))
+                v.scatter_update(tf.IndexedSlices(v_rows, idx))
+                lr_t = lr * tf.sqrt(1 - tf.pow(beta_2, t)) / (1 - tf.pow(beta_1, t))
+                var.scatter_sub(tf.IndexedSlices(lr_t * m_rows / (tf.sqrt(v_rows) + eps), idx))
+
+
 # TODO convert Callable train_loss to layer
 class Model:
     """ Base Model
@@ -79,6 +237,8 @@ class Model:
         self.optimizer_params = dict()
         # model properties accessible to callbacks
         self.optimization_step = dict()
+        # optimizer: LazyUpdates for sparse gradients (see set_optimizer)
+        self.lazy_updates = dict()
 
         self.model_props = set()
 
@@ -119,7 +279,64 @@ class Model:
     def trainable_variables(self):
         return list(itertools.chain(*(layer.trainable_variables for layer in self.train_graph.nodes)))
 
-    def set_optimizer(self, optimizer, **config):
+    def reset_state(self, mask=None):
+        """ Resets the state of stateful layers (e.g. `RNN(stateful=True)`) in the model graphs
+
+        Args:
+            mask (`Optional[Tensor]`): boolean tensor with shape `[batch_size]`, if given only the states of the
+                examples where mask is `True` are reset, e.g. for the examples where a new document starts.
+        """
+        # dict keeps the order and unique layers
+        stateful = dict()
+        for graph in (self.run_graph, self.train_graph, self.eval_graph):
+            for node in graph.nodes:
+                if getattr(node, "stateful", False) and hasattr(node, "reset"):
+                    stateful[node] = None
+
+        for node in stateful:
+            node.reset(mask)
+
+    @staticmethod
+    def tbptt_windows(input_feed, steps, time_axis=1):
+        """ splits an input feed into windows of a given number of time steps
+
+        Values with a dimension `time_axis` with the size of the longest sequence in the feed are sliced, other values
+        are fed to every window. `str` keys (parameters) are only fed to the first window.
+
+        Args:
+            input_feed: a dictionary from `Input` layers or `str` to values, or a list of values
+            steps (`int`): number of time steps in each window
+            time_axis (`int`): time dimension of the sequence inputs
+
+        Returns:
+            windows (`Generator`): input feeds with at most `steps` time steps each
+        """
+        if isinstance(input_feed, dict):
+            keys = list(input_feed.keys())
+            values = list(input_feed.values())
+        else:
+            keys = None
+            values = as_list(input_feed)
+
+        is_param = [isinstance(k, str) for k in keys] if keys is not None else [False] * len(values)
+        values = [v if param else tf.convert_to_tensor(v) for v, param in zip(values, is_param)]
+        lengths = [v.shape[time_axis] for v, param in zip(values, is_param)
+                   if not param and len(v.shape) > time_axis]
+        seq_len = max(lengths, default=0)
+
+        def window(value, param, i):
+            if param or len(value.shape) <= time_axis or value.shape[time_axis] != seq_len:
+                return value
+            return value[(slice(None),) * time_axis + (slice(i, i + steps),)]
+
+        for i in range(0, max(seq_len, 1), steps):
+            feed = [window(v, param, i) for v, param in zip(values, is_param)]
+            if keys is not None:
+                yield {k: v for k, v, param in zip(keys, feed, is_param) if i == 0 or not param}
+            else:
+                yield feed
+
+    def set_optimizer(self, optimizer, lazy=False, **config):
         """ Set the optimizer for this model
 
         !!! Note "Optimizer Hyper-Parameters"
@@ -127,8 +344,14 @@ class Model:
             tensors, or a `callable`. If they are callable, they will called during apply_gradients()
             to get the value for the hyper parameter.
 
+        !!! Note "Lazy Updates"
+            If `lazy=True`, sparse gradients (`IndexedSlices`), e.g. from `Lookup` layers, are applied with
+            `LazyUpdates`, which updates only the rows (and respective optimizer slots) touched by the gradients.
+            Dense gradients are still applied by the optimizer.
+
         Args:
             optimizer (Optimizer): optimizer class or instance
+            lazy (bool): if True, sparse gradients only update the variable rows touched in each step
             **config : dictionary with parameters for the optimizer, if you want to modify these parameters during
             training pass an ``tx.Param`` as the value for the given parameter instead of constant value.
 
@@ -158,22 +381,31 @@ class Model:
             self.compiled[self.train_graph] = self.train_graph.as_function(ord_inputs=self.train_inputs)
         train_fn = self.compiled[self.train_graph]
 
+        lazy_updates = LazyUpdates(optimizer) if lazy else None
+        if lazy:
+            self.lazy_updates[optimizer] = lazy_updates
+
         @tf.function
         def optimization_step(*data):
             with tf.GradientTape() as tape:
                 *train_out, loss = train_fn(*data)
-                cfg = self.optimizer.get_config()
-
                 grads = tape.gradient(loss, self.trainable_variables)
 
-                if "clipnorm" in cfg:
-                    clipnorm = cfg["clipnorm"]
-                    grads = [tf.clip_by_norm(g, clipnorm) for g in grads]
-                if "clipvalue" in cfg:
-                    clipvalue = cfg["clipvalue"]
-                    grads = [tf.clip_by_value(g, -clipvalue, clipvalue) for g in grads]
+                # IndexedSlices are clipped without being converted to dense tensors
+                # get_config serializes (evaluates) the hyper-parameters which fails inside a tf.function
+                grads = clip_gradients(grads,
+                                       clipnorm=getattr(self.optimizer, "clipnorm", None),
+                                       clipvalue=getattr(self.optimizer, "clipvalue", None))
+                grads_and_vars = list(zip(grads, self.trainable_variables))
+
+                if lazy_updates is not None:
+                    sparse = [(g, v) for g, v in grads_and_vars if isinstance(g, tf.IndexedSlices)]
+                    grads_and_vars = [(g, v) for g, v in grads_and_vars if not isinstance(g, tf.IndexedSlices)]
+                    if sparse:
+                        lazy_updates.apply_gradients(sparse)
 
-                self.optimizer.apply_gradients(zip(grads, self.trainable_variables))
+                if grads_and_vars:
+                    self.optimizer.apply_gradients(grads_and_vars)
 
                 return train_out + [loss]
 
@@ -289,9 +521,20 @@ class Model:
         else:
             return None
 
-    def train(self, train_data, validation_data=None, test_data=None, epochs=1, steps_per_epoch=None, callbacks=[]):
+    def train(self, train_data, validation_data=None, test_data=None, epochs=1, steps_per_epoch=None, callbacks=[],
+              tbptt_steps=None, time_axis=1):
         """ Main training loop
 
+        !!! Note "Truncated Backpropagation Through Time"
+            If `tbptt_steps` is given, each batch in `train_data` is split in windows of `tbptt_steps` time steps
+            (see `Model.tbptt_windows`) and each window is a training step. Stateful layers (e.g.
+            `RNN(stateful=True)`) carry their state from one window to the next (and from one batch to the next),
+            but since this state is read from a variable, gradients only flow within a window. Long sequences can
+            then be given as contiguous chunks by the data source without keeping activations for the entire
+            sequence. A `"reset_state"` key in a feed with either `True` or a boolean mask with shape
+            `[batch_size]` resets the state (of the respective examples) before the step, e.g. at document
+            boundaries.
+
         Args:
             train_data: an iterable of dictionaries from Input Layers to values {Input:data}.
             (calling iter on this object should yield an iterator for an epoch.)
@@ -304,6 +547,8 @@ class Model:
             this number of steps pass even if the entire train_data has not been transversed.
 
             callbacks: ``Callback`` functions scheduled during the training.
+            tbptt_steps (int): if not None, the backpropagation horizon used to split each batch in windows.
+            time_axis (int): time dimension of sequence inputs split by `tbptt_steps`.
 
         """
         # train loop properties
@@ -336,6 +581,16 @@ class Model:
         for callback in callbacks:
             scheduler.register(callback)
 
+        if tbptt_steps is not None and train_data is not None:
+            batches = train_data
+
+            class Windows:
+                def __iter__(self):
+                    for batch in batches:
+                        yield from Model.tbptt_windows(batch, tbptt_steps, time_axis)
+
+            train_data = Windows()
+
         if steps_per_epoch is not None and train_data is not None:
             epoch_data = iter(train_data)
 
@@ -373,6 +628,14 @@ class Model:
 
                         feed_dict, param_feed = Model.parse_input(feed_dict, self.train_inputs)
 
+                        reset_mask = param_feed.pop("reset_state", None)
+                        if reset_mask is not None:
+                            if np.ndim(reset_mask) == 0:
+                                if reset_mask:
+                                    self.reset_state()
+                            else:
+                                self.reset_state(reset_mask)
+
                         optimizer_props = self.optimizer_params[self.optimizer]
                         for param_name in param_feed:
                             if param_name in optimizer_props:
@@ -68,13 +68,13 @@ def test_lstm_cell():
     for r1, r2 in zip(res1, res1_):
         assert tx.tensor_equal(r1, r2)
 
-    # the only difference is that keras kernels are fused together
-    kernel = tf.concat([w.weights.value() for w in lstm0.layer_state.w], axis=-1)
-    w_i, _, _, _ = tf.split(kernel, 4, axis=1)
-    assert tx.tensor_equal(w_i, lstm0.w[0].weights.value())
+    # kernels are fused in the same [i, f, c, o] order as keras
+    kernel = lstm0.layer_state.w.weights.value()
+    recurrent_kernel = lstm0.layer_state.u.weights.value()
+    bias = lstm0.layer_state.w.bias.value()
 
-    recurrent_kernel = tf.concat([u.weights for u in lstm0.layer_state.u], axis=-1)
-    bias = tf.concat([w.bias for w in lstm0.layer_state.w], axis=-1)
+    _, b_f, _, _ = tf.split(bias, 4, axis=-1)
+    assert tx.tensor_equal(b_f, tf.ones([n_units]))
 
     assert tx.tensor_equal(tf.shape(kernel), tf.shape(lstm1.kernel))
     assert tx.tensor_equal(tf.shape(recurrent_kernel), tf.shape(lstm1.recurrent_kernel))
@@ -132,9 +132,9 @@ def test_lstm_rnn_stateful():
     assert np.shape(state1[0]) == (batch_size, n_units)
 
     tx_cell = lstm_layer.cell
-    kernel = tf.concat([w.weights.value() for w in tx_cell.w], axis=-1)
-    recurrent_kernel = tf.concat([u.weights.value() for u in tx_cell.u], axis=-1)
-    bias = tf.concat([w.bias.value() for w in tx_cell.w], axis=-1)
+    kernel = tx_cell.w.weights.value()
+    recurrent_kernel = tx_cell.u.weights.value()
+    bias = tx_cell.w.bias.value()
 
     # create keras lstm and update with the same cell state
     # since LSTM initializes the cell state internally this was
@@ -234,10 +234,10 @@ def test_gru_cell():
     for r1, r2 in zip(res1, res1_):
         assert tx.tensor_equal(r1, r2)
 
-    # the only difference is that keras kernels are fused together
-    kernel = tf.concat([w.weights.value() for w in gru0.layer_state.w], axis=-1)
-    recurrent_kernel = tf.concat([u.weights for u in gru0.layer_state.u], axis=-1)
-    bias = tf.concat([w.bias for w in gru0.layer_state.w], axis=-1)
+    # kernels are fused in the same [z, r, c] order as keras
+    kernel = gru0.layer_state.w.weights.value()
+    recurrent_kernel = gru0.layer_state.u.weights.value()
+    bias = gru0.layer_state.w.bias.value()
 
     assert tx.same_shape(kernel, gru1.kernel)
     assert tx.same_shape(recurrent_kernel, gru1.recurrent_kernel)
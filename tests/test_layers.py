@@ -1,6 +1,7 @@
 # suppressing messages only works if set before tensorflow is imported
 
 import os
+import itertools
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
@@ -9,6 +10,14 @@ import numpy as np
 import pytest
 import tensorflow as tf
 
+# two logical CPU devices to test layers computed in multiple replicas
+try:
+    tf.config.set_logical_device_configuration(tf.config.list_physical_devices("CPU")[0],
+                                               [tf.config.LogicalDeviceConfiguration()] * 2)
+except RuntimeError:
+    # devices were already initialized
+    pass
+
 
 def test_input_spec():
     x = tx.Input()
@@ -892,17 +901,13 @@ def test_lstm_cell_regularization():
     assert not tx.tensor_equal(rnn1, rnn3)
     assert not tx.tensor_equal(rnn1, rnn3)
 
-    state2, state3 = rnn2.w_f.weight_mask, rnn3.w_f.weight_mask
+    state2, state3 = rnn2.w.weight_mask, rnn3.w.weight_mask
     assert tx.tensor_equal(state2, state3)
 
-    w2, w3 = rnn2.w_f, rnn3.w_f
-    assert tx.tensor_equal(w2, w3)
-    w2, w3 = rnn2.w_i, rnn3.w_i
-    assert tx.tensor_equal(w2, w3)
-    w2, w3 = rnn2.w_o, rnn3.w_o
-    assert tx.tensor_equal(w2, w3)
-    w2, w3 = rnn2.w_c, rnn3.w_c
+    w2, w3 = rnn2.w, rnn3.w
     assert tx.tensor_equal(w2, w3)
+    u2, u3 = rnn2.u, rnn3.u
+    assert tx.tensor_equal(u2, u3)
 
 
 def test_lstm_cell_state():
@@ -1031,6 +1036,28 @@ def test_biRNN():
     # assert tx.same_shape(rnn1(), rnn1_0())
 
 
+def test_residual_layer_norm():
+    x = tx.Input(tf.random.uniform([4, 6]) + 1e3, n_units=6, constant=False)
+    h = tx.Linear(x, 6)
+    norm = tx.ResidualLayerNorm(x, h, dropout=0.5)
+    assert len(norm.trainable_variables) == 2
+    expected = tx.LayerNorm(h).compute(x() + h())
+
+    # single-pass statistics are precise for large means
+    y = tf.cast(x() + h(), tf.float64)
+    mean, variance = tf.nn.moments(y, -1, keepdims=True)
+    exact = (y - mean) / tf.sqrt(variance)
+    assert tx.tensor_all_close(norm(), expected, atol=1e-4)
+    assert np.allclose(norm().numpy(), exact.numpy(), atol=1e-3)
+
+    norm_reg = norm.reuse_with(x, h, regularized=True)
+    assert norm_reg.bias is norm.bias
+    assert not tx.tensor_all_close(norm_reg(), norm())
+
+    with pytest.raises(ValueError):
+        tx.ResidualLayerNorm(x, tx.Linear(x, 3))
+
+
 def test_batch_norm():
     v = tf.random.uniform([3, 4])
     x = tx.Input(v, dtype=tf.float32)
@@ -1061,6 +1088,411 @@ def test_batch_norm():
     assert not tx.tensor_equal(before, after)
 
 
+@pytest.mark.parametrize("fused", [True, False])
+def test_batch_norm_estimates(fused):
+    dtype = tf.float32
+    decay = 0.9
+    x = tx.Input(n_units=4, dtype=dtype)
+    # an explicit axis uses the non-fused computation
+    bn = tx.BatchNorm(x, scale=True, decay_rate=decay, axis=None if fused else [0, 1])
+    bn.gamma.assign(tf.random.uniform([4], dtype=dtype))
+    bn.beta.assign(tf.random.uniform([4], dtype=dtype))
+    fn = tf.function(bn.compute)
+
+    biased_mean = np.zeros([4])
+    biased_var = np.zeros([4])
+    for step in range(1, 4):
+        v = tf.random.uniform([8, 3, 4], dtype=dtype) * 10 + 100
+        mean, var = tf.nn.moments(v, axes=[0, 1])
+        expected = tf.nn.batch_normalization(v, mean, var, bn.beta, bn.gamma, bn.eps)
+        assert tx.tensor_all_close(fn(v), expected, atol=1e-4)
+
+        # zero-debiased moving averages
+        biased_mean = decay * biased_mean + (1 - decay) * mean.numpy()
+        biased_var = decay * biased_var + (1 - decay) * var.numpy()
+        assert np.allclose(bn.moving_mean.numpy(), biased_mean / (1 - decay ** step), rtol=1e-3)
+        assert np.allclose(bn.moving_variance.numpy(), biased_var / (1 - decay ** step), rtol=1e-3)
+
+    # no extra variables are created by the updates
+    assert len(bn.variables) == 5
+
+    v = tf.random.uniform([8, 3, 4], dtype=dtype)
+    with tf.GradientTape() as tape:
+        tape.watch(v)
+        y = bn.compute(v) * v
+    with tf.GradientTape() as tape_expected:
+        tape_expected.watch(v)
+        mean, var = tf.nn.moments(v, axes=[0, 1])
+        expected = tf.nn.batch_normalization(v, mean, var, bn.beta, bn.gamma, bn.eps) * v
+    grads = tape.gradient(y, [v, bn.gamma])
+    expected_grads = tape_expected.gradient(expected, [v, bn.gamma])
+    for grad, expected_grad in zip(grads, expected_grads):
+        assert tx.tensor_all_close(grad, expected_grad, atol=1e-4)
+
+    bn.reset_estimates()
+    assert tx.tensor_equal(bn.moving_mean, tf.zeros([4], dtype=dtype))
+    assert bn.n_updates.numpy() == 0
+
+
+def test_batch_norm_sync():
+    devices = [device.name for device in tf.config.list_logical_devices("CPU")]
+    strategy = tf.distribute.MirroredStrategy(devices)
+    n_replicas = strategy.num_replicas_in_sync
+    local_batch = 3
+    data = tf.random.uniform([n_replicas * local_batch, 2, 4]) * 10
+
+    with strategy.scope():
+        x = tx.Input(n_units=4)
+        bn = tx.BatchNorm(x, scale=True, sync=True)
+        local_bn = tx.BatchNorm(x, scale=True, share_state_with=bn)
+        bn.gamma.assign(tf.random.uniform([4]))
+
+    def local_data(ctx):
+        i = ctx.replica_id_in_sync_group
+        return data[i * local_batch:(i + 1) * local_batch]
+
+    @tf.function
+    def step(layer):
+        inputs = strategy.experimental_distribute_values_from_function(local_data)
+        outputs = strategy.run(layer.compute, args=(inputs,))
+        return tf.concat(strategy.experimental_local_results(outputs), axis=0)
+
+    # statistics over the global batch
+    mean, var = tf.nn.moments(data, axes=[0, 1])
+    expected = tf.nn.batch_normalization(data, mean, var, bn.beta, bn.gamma, bn.eps)
+    assert tx.tensor_all_close(step(bn), expected, atol=1e-4)
+    assert tx.tensor_all_close(bn.moving_mean, mean, atol=1e-4)
+    assert tx.tensor_all_close(bn.moving_variance, var, atol=1e-3)
+
+    if n_replicas > 1:
+        assert not tx.tensor_all_close(step(local_bn), expected, atol=1e-4)
+
+
+@pytest.mark.parametrize("layer_type", ["linear", "transposed", "weight_norm", "transposed_weight_norm", "conv",
+                                        "grouped", "separable"])
+def test_fold_batch_norm(layer_type):
+    n_features = 4
+    n_units = 6
+    if layer_type in ("conv", "grouped", "separable"):
+        x = tx.Input(tf.random.uniform([2, 5, n_features]), n_units=n_features, constant=False)
+        h = tx.Conv1D(x, n_units=n_units, filter_size=3, groups=2 if layer_type == "grouped" else 1,
+                      separable=layer_type == "separable")
+    else:
+        x = tx.Input(tf.random.uniform([3, n_features]), n_units=n_features, constant=False)
+        transpose = layer_type.startswith("transposed")
+        weights = tf.Variable(tf.random.uniform([n_units, n_features] if transpose else [n_features, n_units]))
+        h = tx.Linear(x, n_units=n_units, weights=weights, transpose_weights=transpose,
+                      weight_norm=layer_type.endswith("weight_norm"))
+
+    bn = tx.BatchNorm(h, offset=True, scale=True, training=False)
+    bn.moving_mean.assign(tf.random.uniform([n_units]))
+    bn.moving_variance.assign(tf.random.uniform([n_units], 0.5, 2.))
+    bn.gamma.assign(tf.random.uniform([n_units]))
+    bn.beta.assign(tf.random.uniform([n_units]))
+    out = tx.Linear(tx.Activation(bn, tx.relu), 2)
+    # another user of the batch norm state
+    bn_train = bn.reuse_with(h, training=True)
+
+    folded = tx.fold_batch_norm(out)
+    graph = tx.Graph.build(inputs=None, outputs=folded)
+    assert not any(isinstance(node, tx.BatchNorm) for node in graph.nodes)
+    assert x in graph.in_nodes
+    assert folded.weights is out.weights
+    assert tx.tensor_all_close(folded(), out(), atol=1e-5)
+
+    # the original state is unchanged and still shared
+    assert bn_train.moving_mean is bn.moving_mean
+    before = bn.moving_mean.value()
+    bn_train()
+    assert not tx.tensor_equal(before, bn.moving_mean.value())
+
+    # nothing to fold in a training graph
+    y = tx.Linear(bn_train, 2)
+    assert tx.fold_batch_norm(y) is y
+
+
+@pytest.mark.parametrize("layer_type", ["rnn", "birnn", "attention"])
+def test_fold_batch_norm_sequence(layer_type):
+    # layers with inputs that are keyword arguments of reuse_with
+    data = tf.random.uniform([4, 3, 2])
+    x = tx.Input(data, n_units=2, constant=False)
+    lengths = tx.Input(tf.constant([4, 2, 1]), n_units=3, dtype=tf.int32, constant=False)
+    bn = tx.BatchNorm(tx.Linear(x, 5), training=False)
+    bn.moving_mean.assign(tf.random.uniform([5]))
+    bn.moving_variance.assign(tf.random.uniform([5], 0.5, 2.))
+
+    if layer_type == "rnn":
+        out = tx.RNN(bn, cell_config=tx.GRUCell.config(n_units=4), sequence_length=lengths)
+    elif layer_type == "birnn":
+        out = tx.BiRNN(bn, cell_config=tx.GRUCell.config(n_units=4), sequence_length=lengths)
+    else:
+        # batch-major [batch_size,seq_size,n_units]
+        out = tx.MHAttention(bn, bn, bn, n_units=4, key_length=tx.Input(tf.constant([1, 2, 2, 3]), n_units=4,
+                                                                         dtype=tf.int32, constant=False))
+
+    folded = tx.fold_batch_norm(out)
+    graph = tx.Graph.build(inputs=None, outputs=folded)
+    assert not any(isinstance(node, tx.BatchNorm) for node in graph.nodes)
+    assert folded.regularized is out.regularized
+    assert tx.tensor_all_close(folded(), out(), atol=1e-5)
+
+
+@pytest.mark.parametrize("cell_cls", [tx.RNNCell, tx.GRUCell, tx.LSTMCell])
+def test_rnn_projected_inputs(cell_cls):
+    seq_size = 4
+    batch_size = 2
+    n_features = 3
+    n_hidden = 5
+
+    data = tf.random.uniform([seq_size, batch_size, n_features])
+    seq = tx.Input(data, n_units=n_features)
+    n_states = 2 if cell_cls is tx.LSTMCell else 1
+    previous_state = [tf.random.uniform([batch_size, n_hidden]) for _ in range(n_states)]
+    rnn = tx.RNN(seq, previous_state=previous_state, cell_config=cell_cls.config(n_units=n_hidden),
+                 return_state=True)
+    cell = rnn.cell
+    assert cell.projectable
+
+    out, last_state = rnn()
+
+    # step the cell graph manually
+    state = tuple(s() for s in cell.previous_state)
+    outputs = []
+    for t in range(seq_size):
+        outputs.append(cell.compute(data[t], *state))
+        state = tuple(s.compute(data[t], *state) for s in cell.state)
+
+    assert tx.tensor_all_close(out, tf.stack(outputs), atol=1e-6)
+    for s1, s2 in zip(last_state, state):
+        assert tx.tensor_all_close(s1, s2, atol=1e-6)
+
+
+def test_rnn_cell_without_projection():
+    class GraphCell(tx.GRUCell):
+        supports_projection = False
+
+    data = tf.random.uniform([4, 2, 3])
+    rnn = tx.RNN(data, cell_config=GraphCell.config(n_units=5), return_state=True)
+    cell = rnn.cell
+    assert not cell.projectable
+    assert cell.input_projection(data) is None
+
+    # the RNN falls back to the cell graph
+    out, (last_state,) = rnn()
+    state = tuple(s() for s in cell.previous_state)
+    for t in range(4):
+        y, state = cell.step(data[t], *state)
+        assert tx.tensor_all_close(out[t], y, atol=1e-6)
+    assert tx.tensor_all_close(last_state, state[0], atol=1e-6)
+
+
+def test_lstm_assign_gate_weights():
+    n_inputs = 3
+    n_hidden = 4
+    batch_size = 2
+
+    x = tf.random.uniform([batch_size, n_inputs])
+    h = tf.random.uniform([batch_size, n_hidden])
+    m = tf.random.uniform([batch_size, n_hidden])
+    cell = tx.LSTMCell(x, n_hidden, previous_state=(h, m), w_dropconnect=0.5, u_dropconnect=0.5)
+    assert cell.w.weights.shape == [n_inputs, 4 * n_hidden]
+    assert cell.u.weights.shape == [n_hidden, 4 * n_hidden]
+
+    # per-gate [i, f, c, o] weights as in the unfused layout
+    w = [tf.random.uniform([n_inputs, n_hidden]) for _ in range(4)]
+    u = [tf.random.uniform([n_hidden, n_hidden]) for _ in range(4)]
+    b = [tf.random.uniform([n_hidden]) for _ in range(4)]
+    cell.assign_gate_weights(w, u, b)
+
+    i, f, c, o = [tf.matmul(x, wi) + tf.matmul(h, ui) + bi for wi, ui, bi in zip(w, u, b)]
+    memory = m * tf.sigmoid(f) + tf.tanh(c) * tf.sigmoid(i)
+    expected = tf.tanh(memory) * tf.sigmoid(o)
+
+    assert tx.tensor_all_close(cell(), expected)
+    assert tx.tensor_all_close(cell.state[1](), memory)
+
+    # dropconnect views the fused kernels
+    reg = cell.reuse_with(x, h, m, regularized=True)
+    assert isinstance(reg.w, tx.DropConnect)
+    assert reg.w.inner_layer.weights is cell.w.weights
+    assert reg.w.weight_mask.shape == [n_inputs, 4 * n_hidden]
+    assert not tx.tensor_all_close(reg(), expected)
+
+
+@pytest.mark.parametrize("cell_cls", [tx.RNNCell, tx.GRUCell, tx.LSTMCell])
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_rnn_sequence_length(cell_cls, compact, reverse):
+    seq_size = 5
+    batch_size = 3
+    n_features = 3
+    n_hidden = 4
+
+    data = tf.random.uniform([seq_size, batch_size, n_features])
+    lengths = tf.constant([2, 5, 3])
+    n_states = 2 if cell_cls is tx.LSTMCell else 1
+    previous_state = [tf.random.uniform([batch_size, n_hidden]) for _ in range(n_states)]
+
+    rnn = tx.RNN(data, previous_state=previous_state, cell_config=cell_cls.config(n_units=n_hidden),
+                 sequence_length=lengths, compact=compact, reverse=reverse, return_state=True)
+    out, last_state = rnn()
+    assert out.shape == [seq_size, batch_size, n_hidden]
+
+    for b, n in enumerate(lengths.numpy()):
+        state_b = [s[b:b + 1] for s in previous_state]
+        rnn_b = rnn.reuse_with(data[:n, b:b + 1], *state_b, sequence_length=tf.constant([n]))
+        out_b, last_b = rnn_b()
+        assert tx.tensor_all_close(out[:n, b:b + 1], out_b, atol=1e-6)
+        assert tx.tensor_equal(out[n:, b], tf.zeros([seq_size - n, n_hidden]))
+        for s1, s2 in zip(last_state, last_b):
+            assert tx.tensor_all_close(s1[b:b + 1], s2, atol=1e-6)
+
+
+def test_rnn_sequence_length_dropout():
+    data = tf.random.uniform([4, 3, 2])
+    lengths = tf.constant([1, 4, 2])
+    cell = tx.LSTMCell.config(n_units=3, x_dropout=0.2, r_dropout=0.2)
+    rnn = tx.RNN(data, cell_config=cell, regularized=True, sequence_length=lengths, compact=True)
+    assert not rnn.cell.projectable
+
+    out = rnn()
+    assert tx.tensor_equal(out[1:, 0], tf.zeros([3, 3]))
+    assert tx.tensor_equal(out[2:, 2], tf.zeros([2, 3]))
+
+
+@pytest.mark.parametrize("unroll", [True, 2, 3])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_rnn_unroll(unroll, reverse):
+    data = tf.random.uniform([7, 3, 2])
+    lengths = tf.constant([7, 2, 5])
+
+    rnn = tx.RNN(data, cell_config=tx.LSTMCell.config(n_units=4), reverse=reverse, sequence_length=lengths,
+                 return_state=True)
+    unrolled = tx.RNN(data, cell_config=tx.LSTMCell.config(n_units=4), reverse=reverse, sequence_length=lengths,
+                      return_state=True, unroll=unroll, parallel_iterations=4, share_state_with=rnn)
+    assert unrolled.reuse_with(data).unroll == unroll
+
+    out1, state1 = rnn()
+    out2, state2 = unrolled()
+    assert tx.tensor_all_close(out1, out2)
+    for s1, s2 in zip(state1, state2):
+        assert tx.tensor_all_close(s1, s2)
+
+    # falls back to a loop when the number of steps is unknown
+    fn = tf.function(unrolled.compute, input_signature=[tf.TensorSpec([None, None, 2]),
+                                                        tf.TensorSpec([None], dtype=tf.int32),
+                                                        tf.TensorSpec([None, 4]),
+                                                        tf.TensorSpec([None, 4])])
+    out3, _ = fn(data, lengths, *[s() for s in unrolled.previous_state])
+    assert tx.tensor_all_close(out1, out3)
+
+
+@pytest.mark.parametrize("merge_mode", ["concat", "sum"])
+def test_birnn(merge_mode):
+    seq_size = 4
+    batch_size = 3
+    n_hidden = 5
+
+    data = tf.random.uniform([seq_size, batch_size, 2])
+    lengths = tf.constant([4, 2, 1])
+    birnn = tx.BiRNN(data, cell_config=tx.GRUCell.config(n_units=n_hidden), merge_mode=merge_mode,
+                     sequence_length=lengths, return_state=True)
+    out, (fw_state, bw_state) = birnn()
+
+    fw, bw = birnn.forward, birnn.backward
+    assert not fw.reverse and bw.reverse
+    assert fw.cell.layer_state.w is not bw.cell.layer_state.w
+
+    fw_out, fw_last = fw.compute(data, lengths, *[s() for s in fw.previous_state])
+    bw_out, bw_last = bw.compute(data, lengths, *[s() for s in bw.previous_state])
+
+    if merge_mode == "concat":
+        assert birnn.n_units == 2 * n_hidden
+        assert tx.tensor_all_close(out, tf.concat([fw_out, bw_out], axis=-1))
+    else:
+        assert birnn.n_units == n_hidden
+        assert tx.tensor_all_close(out, fw_out + bw_out)
+    assert tx.tensor_all_close(fw_state[0], fw_last[0])
+    assert tx.tensor_all_close(bw_state[0], bw_last[0])
+
+    # shared cells
+    birnn2 = birnn.reuse_with(data, return_state=False)
+    assert birnn2.forward.cell.layer_state.w.weights is fw.cell.layer_state.w.weights
+    assert tx.tensor_all_close(birnn2(), out)
+
+    # shared cells without sequence lengths
+    birnn3 = tx.BiRNN(data, cell_config=tx.GRUCell.config(n_units=n_hidden), merge_mode=merge_mode,
+                      share_state_with=birnn)
+    assert birnn3.forward.sequence_length is None and birnn3.backward.sequence_length is None
+    full = birnn.reuse_with(data, return_state=False, sequence_length=tf.fill([batch_size], seq_size))
+    assert tx.tensor_all_close(birnn3(), full())
+
+
+def test_birnn_stateful():
+    data = tf.random.uniform([3, 2, 4])
+    birnn = tx.BiRNN(data, n_units=3, stateful=True)
+
+    out1 = birnn()
+    out2 = birnn()
+    assert not tx.tensor_all_close(out1, out2)
+
+    birnn.reset()
+    assert tx.tensor_all_close(birnn(), out1)
+
+
+@pytest.mark.parametrize("cell_cls", [tx.RNNCell, tx.GRUCell, tx.LSTMCell])
+def test_rnn_step_fn(cell_cls):
+    seq_size = 4
+    batch_size = 3
+    n_features = 2
+
+    data = tf.random.uniform([seq_size, batch_size, n_features])
+    rnn = tx.RNN(data, cell_config=cell_cls.config(n_units=5), return_state=True)
+    out, last_state = rnn()
+
+    step = rnn.step_fn()
+    state = tuple(tf.zeros([batch_size, 5]) for _ in rnn.cell.state_size)
+    for t in range(seq_size):
+        y, state = step(data[t], *state)
+        assert tx.tensor_all_close(y, out[t], atol=1e-6)
+    for s1, s2 in zip(state, last_state):
+        assert tx.tensor_all_close(s1, s2, atol=1e-6)
+
+
+def test_session_state():
+    seq_size = 3
+    n_features = 2
+    data = tf.random.uniform([seq_size, 2, n_features])
+    rnn = tx.RNN(data, cell_config=tx.LSTMCell.config(n_units=4))
+    expected = rnn()
+
+    sessions = tx.SessionState(rnn, capacity=8)
+    a, b = sessions.open(2)
+    assert sessions.active == 2
+
+    # sessions advance independently
+    for t in range(seq_size):
+        y = sessions.step(data[t, :1], [a])
+        assert tx.tensor_all_close(y, expected[t, :1], atol=1e-6)
+    for t in range(seq_size):
+        y = sessions.step(data[t, 1:], [b])
+        assert tx.tensor_all_close(y, expected[t, 1:], atol=1e-6)
+
+    sessions.close(a)
+    c, = sessions.open()
+    assert tx.tensor_equal(sessions.read(c)[0], tf.zeros([1, 4]))
+
+    # batched step over sessions in any order
+    y = sessions.step(data[0, ::-1], [c, b])
+    assert tx.tensor_all_close(y[0], expected[0, 1], atol=1e-6)
+
+    sessions.close(c)
+    with pytest.raises(ValueError):
+        sessions.close(c)
+    with pytest.raises(ValueError):
+        sessions.open(8)
+
+
 def test_stateful_rnn_layer():
     n_features = 5
     embed_size = 4
@@ -1095,7 +1527,7 @@ def test_stateful_rnn_layer():
     # state after single run
     # zero_state1 = [layer() for layer in ]
     zero_state1 = rnn1.previous_state[0]()
-    assert tx.tensor_equal(zero_state1, state1)
+    assert tx.tensor_equal(zero_state1, state1[0])
 
     rnn1.reset()
     reset_state = rnn1.previous_state[0]()
@@ -1445,7 +1877,68 @@ def test_drop_lookup():
                        embedding_shape=[vocab_size, embed_dim],
                        add_bias=True)
 
-    tx.DropLookup(lookup, probability=0.5)
+    drop_lookup = tx.DropLookup(lookup, probability=0.5, seed=1)
+    result = drop_lookup()
+    assert np.shape(result) == (3, seq_size, embed_dim)
+
+    # the same ids in the same sample are either all dropped or all kept
+    dropped = np.all(result.numpy() == 0, axis=-1)
+    ids = input_data.numpy()
+    for row, row_ids in enumerate(ids):
+        for i in np.unique(row_ids):
+            assert len(np.unique(dropped[row][row_ids == i])) == 1
+
+    # locked reuse shares the mask within the same evaluation
+    lookup2 = lookup.reuse_with(inputs)
+    drop_lookup2 = drop_lookup.reuse_with(lookup2)
+    both = tx.Module(inputs, tx.Concat(drop_lookup, drop_lookup2))
+    r1, r2 = tf.split(both(), 2, axis=-1)
+    assert tx.tensor_equal(r1, r2)
+
+    # sparse indices
+    sp_input = tx.Input(n_units=vocab_size, n_active=2, dtype=tf.int64)
+    sp_lookup = tx.Lookup(sp_input,
+                          seq_size=2,
+                          embedding_shape=[vocab_size, embed_dim],
+                          track_frequency=True)
+    sp_drop = tx.DropLookup(sp_lookup, probability=0.5, seed=1)
+    sp_ids = np.array([[1, 2], [1, 3], [4, 5], [1, 1]])
+    sp_input.value = sp_ids
+    result = sp_drop()
+    assert np.shape(result) == (2, 2, embed_dim)
+
+    # each position sums the kept embeddings (scaled by 1/keep_prob)
+    # the same ids in the same sample are either all dropped or all kept
+    embeddings = sp_lookup.weights.numpy()
+    for sample, sample_ids in enumerate(np.reshape(sp_ids, [2, 2, 2])):
+        unique_ids = np.unique(sample_ids)
+        consistent = False
+        for kept in itertools.product([False, True], repeat=len(unique_ids)):
+            kept_ids = set(unique_ids[list(kept)])
+            expected = [sum((embeddings[i] for i in row if i in kept_ids), np.zeros(embed_dim)) / 0.5
+                        for row in sample_ids]
+            consistent = consistent or np.allclose(result[sample], expected, atol=1e-5)
+        assert consistent
+
+    # the mask is deterministic for a fixed seed
+    tf.random.set_seed(1)
+    result = sp_drop()
+    tf.random.set_seed(1)
+    assert tx.tensor_equal(sp_drop(), result)
+
+    # locked reuse shares the mask within the same evaluation
+    sp_drop2 = sp_drop.reuse_with(sp_lookup.reuse_with(sp_input))
+    both = tx.Module(sp_input, tx.Concat(sp_drop, sp_drop2))
+    r1, r2 = tf.split(both(), 2, axis=-1)
+    assert tx.tensor_equal(r1, r2)
+
+    # the lookup frequency is only updated by the lookup layer
+    frequency = sp_lookup.frequency.numpy()
+    sp_drop()
+    assert np.array_equal(sp_lookup.frequency.numpy() - frequency, np.bincount(sp_ids.flatten(), minlength=vocab_size))
+
+    no_drop = tx.DropLookup(sp_lookup, probability=0.)
+    assert tx.tensor_equal(no_drop(), sp_lookup())
 
 
 def test_residual():
@@ -1532,6 +2025,108 @@ def test_conv1d():
                            [batch_size, seq_size, num_filters])
 
 
+@pytest.mark.parametrize("stride", [1, 2])
+def test_conv1d_causal(stride):
+    seq_size = 7
+    data = tf.random.uniform([2, seq_size, 3])
+    x = tx.Input(data, n_units=3, constant=False)
+    # strides > 1 are not supported with dilation_rate > 1
+    conv = tx.Conv1D(x, n_units=4, filter_size=3, dilation_rate=3 - stride, stride=stride, causal=True)
+
+    output = conv()
+    assert conv.shape.as_list() == [None, (seq_size + stride - 1) // stride, 4]
+    assert output.shape.as_list() == [2, (seq_size + stride - 1) // stride, 4]
+
+    # changing the future does not change the past
+    t = 4
+    x.value = tf.concat([data[:, :t + 1], tf.random.uniform([2, seq_size - t - 1, 3])], axis=1)
+    assert tx.tensor_all_close(conv()[:, :t // stride + 1], output[:, :t // stride + 1])
+
+    reused = conv.reuse_with(x)
+    assert reused.causal
+    assert tx.tensor_equal(reused(), conv())
+
+
+@pytest.mark.parametrize("filter_size,dilation_rate", [(1, 1), (2, 1), (3, 2)])
+@pytest.mark.parametrize("groups,separable", [(1, False), (2, False), (1, True)])
+def test_conv1d_stream(filter_size, dilation_rate, groups, separable):
+    batch_size = 2
+    seq_size = 9
+    data = tf.random.uniform([batch_size, seq_size, 4])
+    x = tx.Input(data, n_units=4, constant=False)
+    conv = tx.Conv1D(x, n_units=6, filter_size=filter_size, dilation_rate=dilation_rate, causal=True,
+                     groups=groups, separable=separable)
+    stream = tx.Conv1DStream(conv, batch_size=batch_size)
+    assert stream.buffer.shape.as_list() == [batch_size, (filter_size - 1) * dilation_rate, 4]
+
+    output = tf.stack([stream.step(data[:, t]) for t in range(seq_size)], axis=1)
+    assert tx.tensor_all_close(output, conv(), atol=1e-6)
+
+    stream.reset()
+    assert tx.tensor_all_close(stream.step(data[:, 0]), conv()[:, 0], atol=1e-6)
+
+    with pytest.raises(ValueError):
+        tx.Conv1DStream(tx.Conv1D(x, n_units=4, filter_size=2), batch_size=batch_size)
+
+
+@pytest.mark.parametrize("groups,separable", [(2, False), (4, False), (1, True)])
+def test_conv1d_grouped_separable(groups, separable):
+    n_inputs = 8
+    n_units = 12
+    filter_size = 3
+    seq_size = 5
+    x = tx.Input(tf.random.uniform([2, seq_size, n_inputs]), n_units=n_inputs, constant=False)
+    conv = tx.Conv1D(x, n_units=n_units, filter_size=filter_size, groups=groups, separable=separable)
+    standard = tx.Conv1D(x, n_units=n_units, filter_size=filter_size)
+
+    output = conv()
+    assert output.shape.as_list() == [2, seq_size, n_units]
+    if separable:
+        assert conv.filters.shape.as_list() == [filter_size, n_inputs, 1]
+        assert conv.pointwise_filters.shape.as_list() == [n_inputs, n_units]
+        assert conv.n_params == filter_size * n_inputs + n_inputs * n_units + n_units
+    else:
+        assert conv.filters.shape.as_list() == [filter_size, n_inputs // groups, n_units]
+        assert conv.n_params == (standard.n_params - n_units) // groups + n_units
+    assert len(conv.trainable_variables) == (3 if separable else 2)
+    assert conv.n_params == sum(np.prod(v.shape) for v in conv.trainable_variables)
+    assert conv.flops(seq_size) < standard.flops(seq_size)
+    assert standard.flops(seq_size) == 2 * seq_size * filter_size * n_inputs * n_units
+
+    # exact conversion to a standard convolution
+    dense = tx.convert_conv1d(conv)
+    assert dense.filters.shape.as_list() == [filter_size, n_inputs, n_units]
+    assert tx.tensor_all_close(dense(), output, atol=1e-5)
+
+    # and back
+    converted = tx.convert_conv1d(dense, groups=groups, separable=separable)
+    assert tx.tensor_all_close(converted(), output, atol=1e-5)
+    assert converted.filters is not conv.filters
+
+    reused = conv.reuse_with(x)
+    assert reused.pointwise_filters is conv.pointwise_filters
+    assert tx.tensor_equal(reused(), output)
+
+    with pytest.raises(ValueError):
+        tx.Conv1D(x, n_units=n_units, filter_size=filter_size, groups=5)
+
+
+def test_convert_conv1d():
+    x = tx.Input(tf.random.uniform([2, 5, 4]), n_units=4, constant=False)
+    conv = tx.Conv1D(x, n_units=6, filter_size=3)
+
+    # least squares projections of the standard filters
+    separable = tx.convert_conv1d(conv, separable=True)
+    grouped = tx.convert_conv1d(conv, groups=2)
+    dense_filters = tx.convert_conv1d(separable).filters
+    assert tx.tensor_all_close(tx.convert_conv1d(separable, separable=True)(), separable(), atol=1e-5)
+    residual = conv.filters - dense_filters
+    # the rank-1 residual of each input unit is orthogonal to the approximation
+    assert tx.tensor_all_close(tf.reduce_sum(residual * dense_filters, axis=[0, 2]), tf.zeros([4]), atol=1e-5)
+    assert tx.tensor_equal(grouped.filters[:, :, :3], conv.filters[:, :2, :3])
+    assert tx.tensor_equal(grouped.filters[:, :, 3:], conv.filters[:, 2:, 3:])
+
+
 def test_map_seq():
     n_features = 5
     embed_size = 4
@@ -1550,6 +2145,58 @@ def test_map_seq():
     assert tx.tensor_equal(tf.shape(seq_map), [seq_size, batch_size, n_units])
 
 
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("fold_time", [None, False])
+def test_map_seq_sequence_length(compact, fold_time):
+    seq_size = 4
+    batch_size = 3
+    data = tf.random.uniform([seq_size, batch_size, 5])
+    lengths = tf.constant([4, 1, 2])
+
+    seq_map = tx.SeqMap(data, layer_config=tx.Linear.config(n_units=2), sequence_length=lengths, compact=compact,
+                        fold_time=fold_time)
+    assert seq_map.folded == (fold_time is None)
+    linear = seq_map.layer_state.layer_instance
+    out = seq_map()
+
+    mask = tf.sequence_mask(lengths, seq_size, dtype=tf.float32)
+    expected = linear.compute(data) * tf.expand_dims(tf.transpose(mask), -1)
+    assert tx.tensor_all_close(out, expected)
+
+
+def test_map_seq_fold_time():
+    data = tf.random.uniform([4, 3, 5])
+
+    seq_map = tx.SeqMap(data, layer_config=tx.FC.config(n_units=2, activation=tx.relu))
+    assert seq_map.folded
+    unfolded = tx.SeqMap(data, layer_config=tx.FC.config(n_units=2, activation=tx.relu),
+                         fold_time=False, share_state_with=seq_map)
+    assert not unfolded.folded
+    assert tx.tensor_all_close(seq_map(), unfolded())
+
+    # unknown layers are not folded unless declared time independent
+    lambda_map = tx.SeqMap(data, layer_config=tx.Lambda.config(fn=lambda x: x * 2, n_units=5))
+    assert not lambda_map.folded
+    folded_lambda = tx.SeqMap(data, layer_config=tx.Lambda.config(fn=lambda x: x * 2, n_units=5), fold_time=True)
+    assert folded_lambda.folded
+    assert tx.tensor_all_close(lambda_map(), folded_lambda())
+
+    # reused layers keep fold_time
+    reused = folded_lambda.reuse_with(data[:2])
+    assert reused.fold_time and reused.folded
+    assert tx.tensor_all_close(reused(), lambda_map()[:2])
+
+
+@pytest.mark.parametrize("unroll", [True, 3])
+def test_map_seq_unroll(unroll):
+    data = tf.random.uniform([5, 3, 4])
+    seq_map = tx.SeqMap(data, layer_config=tx.Linear.config(n_units=2), fold_time=False)
+    unrolled = tx.SeqMap(data, layer_config=tx.Linear.config(n_units=2), fold_time=False, unroll=unroll,
+                         share_state_with=seq_map)
+
+    assert tx.tensor_all_close(seq_map(), unrolled())
+
+
 def test_multihead_attention():
     """
     TODO check causality
@@ -1597,3 +2244,267 @@ def test_multihead_attention():
     vars2 = map(lambda v: v.ref(), attention_2.variables)
 
     assert set(vars1) == set(vars2)
+
+
+@pytest.mark.parametrize("causality", [False, True])
+def test_multihead_attention_blockwise(causality):
+    seq = tf.random.uniform([2, 9, 8])
+    x = tx.Input(seq, n_units=8, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=causality)
+    blockwise = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=causality, block_size=4,
+                               share_state_with=attention)
+    assert blockwise.reuse_with(x, x, x).block_size == 4
+    assert tx.tensor_all_close(attention(), blockwise(), atol=1e-6)
+
+    with pytest.raises(ValueError):
+        tx.MHAttention(x, x, x, n_units=8, attention_dropout=0.1, block_size=4)
+
+
+@pytest.mark.parametrize("block_size", [None, 2])
+def test_multihead_attention_key_mask(block_size):
+    seq = tf.random.uniform([3, 5, 8])
+    lengths = tf.constant([5, 2, 3])
+    x = tx.Input(seq, n_units=8, constant=False)
+
+    attention = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=True, key_length=lengths,
+                               block_size=block_size)
+    masked = attention.reuse_with(x, x, x, key_mask=tf.sequence_mask(lengths, 5))
+    result = attention()
+    assert tx.tensor_all_close(result, masked(), atol=1e-6)
+
+    # padding doesn't change the result for the valid keys
+    for b, n in enumerate(lengths.numpy()):
+        xb = seq[b:b + 1, :n]
+        expected = attention.reuse_with(xb, xb, xb, key_length=tf.constant([n]))()
+        assert tx.tensor_all_close(result[b:b + 1, :n], expected, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        tx.MHAttention(x, x, x, n_units=8, key_mask=tf.ones([3, 5], tf.bool), key_length=lengths)
+
+
+def test_multihead_attention_window():
+    seq = tf.random.uniform([2, 10, 8])
+    x = tx.Input(seq, n_units=8, constant=False)
+
+    # a window larger than the sequence is the same as full attention
+    attention = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=True)
+    local = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=True, window=10, share_state_with=attention)
+    assert tx.tensor_all_close(attention(), local(), atol=1e-6)
+
+    assert local.reuse_with(x, x, x).window == 10
+    strided = tx.MHAttention(x, x, x, n_units=8, n_heads=2, window=2, stride=3, n_global=1,
+                             share_state_with=attention)
+    assert tx.same_shape(strided(), attention())
+
+    with pytest.raises(ValueError):
+        tx.MHAttention(x, x, x, n_units=8, stride=2)
+    with pytest.raises(ValueError):
+        tx.MHAttention(x, x, x, n_units=8, window=2, block_size=4)
+
+
+@pytest.mark.parametrize("pre_norm", [False, True])
+def test_transformer_block(pre_norm):
+    seq = tf.random.uniform([2, 5, 8])
+    x = tx.Input(seq, n_units=8, constant=False)
+    block = tx.TransformerBlock(x, n_heads=2, n_hidden=16, pre_norm=pre_norm, causality=True,
+                                dropout=0.1, attention_dropout=0.1)
+    assert block.n_hidden == 16
+    assert len(block.trainable_variables) == 11
+
+    # composed from the block layers
+    norm1, norm2 = block.attention_norm, block.ffn_norm
+
+    def ffn(h):
+        return block.ffn_output(tx.gelu(block.ffn_hidden(h)))
+
+    if pre_norm:
+        h = seq + block.attention(*[norm1.compute(seq)] * 3)
+        expected = h + ffn(norm2.compute(h))
+    else:
+        h = norm1.compute(seq + block.attention(seq, seq, seq))
+        expected = norm2.compute(h + ffn(h))
+
+    assert tx.tensor_all_close(block(), expected, atol=1e-5)
+
+    block_reg = block.reuse_with(x, regularized=True)
+    assert block_reg.attention.regularized
+    assert tx.same_shape(block_reg(), expected)
+    assert set(v.ref() for v in block_reg.trainable_variables) == set(v.ref() for v in block.trainable_variables)
+
+
+def test_transformer_block_key_length():
+    seq = tf.random.uniform([2, 5, 8])
+    x = tx.Input(seq, n_units=8, constant=False)
+    block = tx.TransformerBlock(x, n_heads=2, key_length=tf.constant([5, 3]))
+    result = block()
+
+    short = block.reuse_with(seq[1:, :3], key_length=tf.constant([3]))
+    assert tx.tensor_all_close(result[1:, :3], short(), atol=1e-5)
+
+
+@pytest.mark.parametrize("feature_map", ["elu", "random"])
+def test_multihead_attention_linear(feature_map):
+    seq = tf.random.uniform([2, 6, 8])
+    x = tx.Input(seq, n_units=8, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=8, n_heads=2, causality=True, feature_map=feature_map)
+    assert len(attention.trainable_variables) == 3
+    assert attention.reuse_with(x, x, x).feature_map == feature_map
+
+    # causal: each step only depends on the previous steps
+    result = attention()
+    prefix = attention.reuse_with(seq[:, :4], seq[:, :4], seq[:, :4])
+    assert tx.tensor_all_close(result[:, :4], prefix(), atol=1e-6)
+
+    with pytest.raises(ValueError):
+        tx.MHAttention(x, x, x, n_units=8, feature_map="relu")
+
+
+def test_kv_cache():
+    batch_size = 3
+    seq_size = 5
+    n_features = 6
+    n_units = 8
+
+    seq = tf.random.uniform([batch_size, seq_size, n_features])
+    x = tx.Input(seq, n_units=n_features, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=n_units, n_heads=2, causality=True)
+    expected = attention()
+
+    cache = tx.KVCache(attention, capacity=4, max_len=seq_size)
+    sessions = cache.open(batch_size)
+    assert cache.active == batch_size
+
+    for t in range(seq_size):
+        xt = seq[:, t]
+        yt = cache.step(xt, xt, xt, sessions)
+        assert tx.tensor_all_close(yt, expected[:, t], atol=1e-6)
+
+    keys, values, lengths = cache.read(sessions)
+    assert tx.tensor_equal(lengths, [seq_size] * batch_size)
+    assert tx.tensor_all_close(keys, attention.wk(seq))
+
+    # beam search: all sessions continue from the first one after 2 steps
+    cache.trim(sessions, 2)
+    cache.reorder(sessions, [sessions[0]] * batch_size)
+    first = tf.tile(seq[:1], [batch_size, 1, 1])
+    expected = attention.reuse_with(first, first, first)()
+    yt = cache.step(first[:, 2], first[:, 2], first[:, 2], sessions)
+    assert tx.tensor_all_close(yt, expected[:, 2], atol=1e-6)
+
+    cache.close(sessions)
+    with pytest.raises(ValueError):
+        cache.close(sessions[0])
+    with pytest.raises(ValueError):
+        cache.open(5)
+
+
+@pytest.mark.parametrize("config", [dict(window=1), dict(window=2, stride=2), dict(window=1, stride=2, n_global=2),
+                                    dict(block_size=2)])
+def test_kv_cache_local_attention(config):
+    batch_size = 2
+    seq_size = 9
+    seq = tf.random.uniform([batch_size, seq_size, 4])
+    x = tx.Input(seq, n_units=4, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=6, n_heads=2, causality=True, **config)
+    expected = attention()
+
+    cache = tx.KVCache(attention, capacity=batch_size, max_len=seq_size)
+    sessions = cache.open(batch_size)
+    for t in range(seq_size):
+        xt = seq[:, t]
+        assert tx.tensor_all_close(cache.step(xt, xt, xt, sessions), expected[:, t], atol=1e-5)
+
+
+@pytest.mark.parametrize("feature_map", ["elu", "random"])
+def test_kv_cache_linear_attention(feature_map):
+    batch_size = 3
+    seq_size = 5
+    seq = tf.random.uniform([batch_size, seq_size, 4])
+    x = tx.Input(seq, n_units=4, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=6, n_heads=2, causality=True, feature_map=feature_map)
+    expected = attention()
+
+    cache = tx.KVCache(attention, capacity=batch_size, max_len=seq_size)
+    assert cache.kv.shape[:2] == [batch_size, 2]
+    sessions = cache.open(batch_size)
+    for t in range(seq_size):
+        xt = seq[:, t]
+        assert tx.tensor_all_close(cache.step(xt, xt, xt, sessions), expected[:, t], atol=1e-5)
+
+    # the running state is recomputed from the kept steps
+    cache.trim(sessions, 2)
+    cache.reorder(sessions, [sessions[0]] * batch_size)
+    first = tf.tile(seq[:1], [batch_size, 1, 1])
+    expected = attention.reuse_with(first, first, first)()
+    yt = cache.step(first[:, 2], first[:, 2], first[:, 2], sessions)
+    assert tx.tensor_all_close(yt, expected[:, 2], atol=1e-5)
+
+
+@pytest.mark.parametrize("mask_type", ["key_mask", "key_length"])
+def test_kv_cache_key_mask(mask_type):
+    seq = tf.random.uniform([2, 3, 4])
+    x = tx.Input(seq, n_units=4, constant=False)
+    mask = tf.constant([[True, True, False], [True, False, False]])
+    masks = {"key_mask": mask, "key_length": tf.constant([2, 1])}
+    attention = tx.MHAttention(x, x, x, n_units=4, causality=True, **{mask_type: masks[mask_type]})
+    assert len(attention.inputs) == 4
+
+    with pytest.raises(ValueError, match=mask_type):
+        tx.KVCache(attention, capacity=2, max_len=3)
+
+    # the same attention without the mask can be cached
+    unmasked = tx.MHAttention(x, x, x, n_units=4, causality=True, share_state_with=attention)
+    cache = tx.KVCache(unmasked, capacity=2, max_len=3)
+    sessions = cache.open(2)
+    assert cache.step(seq[:, 0], seq[:, 0], seq[:, 0], sessions).shape == [2, 4]
+
+
+def test_kv_cache_max_len():
+    max_len = 3
+    seq = tf.random.uniform([2, max_len + 1, 4])
+    x = tx.Input(seq, n_units=4, constant=False)
+    attention = tx.MHAttention(x, x, x, n_units=4, causality=True)
+    cache = tx.KVCache(attention, capacity=2, max_len=max_len)
+    sessions = cache.open(2)
+
+    for t in range(max_len):
+        cache.step(seq[:, t], seq[:, t], seq[:, t], sessions)
+    with pytest.raises(ValueError, match="max_len"):
+        cache.step(seq[:, max_len], seq[:, max_len], seq[:, max_len], sessions)
+
+    # the cache is unchanged and a trimmed session can continue
+    assert tx.tensor_equal(cache.lengths, [max_len, max_len])
+    cache.trim(sessions[:1], max_len - 1)
+    with pytest.raises(ValueError):
+        cache.step(seq[:, max_len], seq[:, max_len], seq[:, max_len], sessions)
+    expected = attention()[:1, max_len - 1]
+    t = max_len - 1
+    assert tx.tensor_all_close(cache.step(seq[:1, t], seq[:1, t], seq[:1, t], sessions[:1]), expected, atol=1e-6)
+
+
+def test_lookup_frequency_compaction():
+    vocab_size = 10
+    embed_dim = 3
+    ids = tx.Input(tf.constant([[1, 2, 1], [2, 1, 5]]), n_units=3, dtype=tf.int64, constant=False)
+    lookup = tx.Lookup(ids, seq_size=3, embedding_shape=[vocab_size, embed_dim], track_frequency=True)
+    h = tx.Input(tf.ones([2, embed_dim]), n_units=embed_dim)
+    logits = tx.Linear(h, vocab_size, weights=lookup.weights, transpose_weights=True)
+
+    lookup()
+    lookup()
+    expected = np.zeros(vocab_size)
+    expected[[1, 2, 5]] = [6, 4, 2]
+    assert np.array_equal(lookup.frequency.numpy(), expected)
+
+    # ids 1 and 2 are kept, the rest go to 2 buckets
+    small, (small_logits,), remap, inverse = tx.compact_lookup(lookup, min_count=3, n_buckets=2, tied_layers=[logits])
+    assert small.weights.shape == [4, embed_dim]
+    assert small_logits().shape == [2, 4]
+    assert np.array_equal(inverse.numpy(), [1, 2, -1, -1])
+    assert np.array_equal(tf.gather(remap, [1, 2, 5, 0]).numpy(), [0, 1, 3, 2])
+
+    assert tx.tensor_equal(small()[:, :2], lookup()[:, :2])
+    assert tx.tensor_equal(tf.gather(small_logits(), [0, 1], axis=-1), tf.gather(logits(), [1, 2], axis=-1))
+    # bucket rows are the mean of the rare rows
+    odd = [i for i in range(vocab_size) if i % 2 == 1 and i not in (1,)]
+    assert tx.tensor_all_close(small.weights[3], tf.reduce_mean(tf.gather(lookup.weights, odd), axis=0))
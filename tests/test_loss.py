@@ -0,0 +1,112 @@
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import tensorx as tx
+import tensorflow as tf
+import numpy as np
+
+
+def test_adaptive_softmax():
+    vocab_size = 20
+    n_hidden = 8
+    cutoffs = [4, 10]
+
+    x = tx.Input(tf.random.uniform([3, n_hidden]), n_units=n_hidden)
+    labels = tx.Input(tf.constant([1, 5, 15], dtype=tf.int64), n_units=None, shape=[None], dtype=tf.int64)
+    adaptive = tx.AdaptiveSoftmax(x, vocab_size, cutoffs=cutoffs)
+
+    log_probs = adaptive()
+    assert log_probs.shape == [3, vocab_size]
+    assert tx.tensor_all_close(tf.reduce_sum(tf.exp(log_probs), axis=-1), tf.ones([3]))
+
+    # training loss matches the exact distribution
+    loss = tx.AdaptiveSoftmaxLoss(labels, adaptive)
+    expected = -tf.gather(log_probs, labels(), batch_dims=1)
+    assert tx.tensor_all_close(loss(), expected)
+    assert len(loss.trainable_variables) == len(adaptive.trainable_variables)
+
+    # sparse labels
+    sp_labels = tx.Input(tf.constant([[1], [5], [15]], dtype=tf.int64), n_units=vocab_size, n_active=1)
+    sp_loss = tx.AdaptiveSoftmaxLoss(sp_labels, adaptive)
+    assert tx.tensor_all_close(sp_loss(), expected)
+
+    # rank 3 inputs
+    x3 = tx.Input(tf.random.uniform([2, 3, n_hidden]), n_units=n_hidden)
+    adaptive3 = adaptive.reuse_with(x3)
+    assert adaptive3().shape == [2, 3, vocab_size]
+    assert adaptive3.nll(x3(), tf.ones([2, 3], dtype=tf.int64)).shape == [2, 3]
+
+
+def test_adaptive_softmax_tied():
+    vocab_size = 20
+    n_hidden = 8
+    embed_dim = 4
+    ids = tx.Input(tf.constant([[1, 5, 15]]), n_units=3, dtype=tf.int32)
+    lookup = tx.Lookup(ids, seq_size=3, embedding_shape=[vocab_size, embed_dim])
+    x = tx.Input(tf.random.uniform([3, n_hidden]), n_units=n_hidden)
+    adaptive = tx.AdaptiveSoftmax(x, vocab_size, cutoffs=[4, 10], tied_lookup=lookup)
+
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_mean(adaptive.nll(x(), tf.constant([1, 5, 15])))
+    grad = tape.gradient(loss, lookup.weights)
+    assert grad is not None
+    assert np.shape(tf.convert_to_tensor(grad)) == (vocab_size, embed_dim)
+    assert tx.tensor_all_close(tf.reduce_sum(tf.exp(adaptive()), axis=-1), tf.ones([3]))
+
+
+def test_sampled_softmax():
+    vocab_size = 50
+    n_hidden = 4
+    batch_size = 3
+
+    x = tx.Input(tf.random.uniform([batch_size, n_hidden]), n_units=n_hidden)
+    linear = tx.Linear(x, vocab_size)
+    labels = tx.Input(tf.constant([[1], [5], [15]], dtype=tf.int64), n_units=vocab_size, n_active=1)
+
+    loss = tx.SampledSoftmax(labels, x, linear, n_samples=10)
+    assert loss().shape == [batch_size]
+    assert len(loss.trainable_variables) == 2
+
+    with tf.GradientTape() as tape:
+        value = tf.reduce_mean(loss())
+    grads = tape.gradient(value, linear.trainable_variables)
+    assert all(g is not None for g in grads)
+
+    # tied lookup weights with per-example negatives
+    ids = tf.constant([[1, 2], [5, 6], [15, 16]], dtype=tf.int64)
+    lookup = tx.Lookup(tx.Input(ids, n_units=2, dtype=tf.int64), seq_size=2, embedding_shape=[vocab_size, n_hidden])
+    nce = tx.NCE(tx.Input(ids, n_units=2, dtype=tf.int64), x, lookup, n_samples=8, shared_negatives=False,
+                 unigrams=np.arange(vocab_size) + 1)
+    nce_value = nce()
+    assert nce_value.shape == [batch_size]
+    assert tf.reduce_all(nce_value > 0)
+
+
+def test_sampled_logits_accidental_hits():
+    hidden = tf.ones([2, 3])
+    weights = tf.ones([10, 3])
+    probs = tf.fill([10], 0.1)
+    sampled = tf.constant([1, 2, 3], dtype=tf.int64)
+    labels = tf.constant([1, 3], dtype=tf.int64)
+
+    _, logits = tx.sampled_logits(labels, hidden, weights, None, sampled, probs, n_samples=3)
+    hits = logits.numpy() == logits.dtype.min
+    assert np.array_equal(hits, [[True, False, False], [False, False, True]])
+
+
+def test_sampled_logits_expected_count():
+    counts = [10., 20., 30., 40.]
+    probs = tf.constant(counts) / 100.
+    n_samples = 5
+    n_batches = 20000
+    prob_table, alias_table = tx.alias_table(counts)
+    samples = tx.sample_alias(prob_table, alias_table, [n_batches, n_samples])
+    freq = tf.math.bincount(tf.cast(samples, tf.int32), minlength=4, dtype=tf.float32) / n_batches
+
+    # with zero logits the corrected logits are -log Q(y), Q(y) the expected number of times y is sampled
+    ids = tf.range(4, dtype=tf.int64)
+    true_logits, sampled_logits = tx.sampled_logits(ids, tf.zeros([4, 2]), tf.zeros([4, 2]), None, ids, probs,
+                                                    n_samples=n_samples, remove_accidental_hits=False)
+    assert tx.tensor_all_close(tf.exp(-true_logits[:, 0]), freq, atol=5e-2)
+    assert tx.tensor_all_close(tf.exp(-sampled_logits[0]), freq, atol=5e-2)
@@ -259,3 +259,95 @@ def test_filter_nd():
     sp_result = tx.filter_nd(tf.greater(inputs, 0), inputs)
     assert isinstance(sp_result, tf.SparseTensor)
     assert tx.tensor_equal(sp_result.values, [1, 2, 3, 4])
+
+
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("tq,tk", [(10, 10), (7, 13)])
+def test_blockwise_attention(causal, tq, tk):
+    query = tf.random.normal([3, tq, 4])
+    key = tf.random.normal([3, tk, 4])
+    value = tf.random.normal([3, tk, 5])
+
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch([query, key, value])
+        scores = tf.matmul(query, key, transpose_b=True) / 2.
+        if causal:
+            mask = tf.linalg.band_part(tf.ones([tq, tk]), -1, 0)
+            scores = tf.where(mask > 0, scores, -1e9)
+        expected = tf.matmul(tf.nn.softmax(scores), value)
+        result = tx.blockwise_attention(query, key, value, block_size=4, causal=causal)
+
+    assert tx.tensor_all_close(result, expected, atol=1e-6)
+
+    grad1 = tape.gradient(expected, [query, key, value])
+    grad2 = tape.gradient(result, [query, key, value])
+    for g1, g2 in zip(grad1, grad2):
+        assert tx.tensor_all_close(g1, g2, atol=1e-5)
+
+
+def test_blockwise_attention_key_mask():
+    query = tf.random.normal([2, 6, 4])
+    key = tf.random.normal([2, 7, 4])
+    value = tf.random.normal([2, 7, 3])
+    key_mask = tf.sequence_mask([7, 3], 7)
+
+    result = tx.blockwise_attention(query, key, value, block_size=4, key_mask=key_mask)
+    expected = tx.blockwise_attention(query[1:], key[1:, :3], value[1:, :3], block_size=4)
+    assert tx.tensor_all_close(result[1:], expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("window,stride,n_global", [(2, 1, 0), (3, 1, 2), (2, 3, 0), (1, 2, 1)])
+def test_local_attention(causal, window, stride, n_global):
+    seq_len = 11
+    query = tf.random.normal([2, seq_len, 4])
+    key = tf.random.normal([2, seq_len, 4])
+    value = tf.random.normal([2, seq_len, 3])
+    key_mask = tf.sequence_mask([seq_len, seq_len - 3], seq_len)
+
+    # dense attention with the equivalent mask
+    i = np.arange(seq_len)[:, None]
+    j = np.arange(seq_len)[None, :]
+    allowed = ((i - j) % stride == 0) & (np.abs(i - j) <= window * stride)
+    if causal:
+        allowed &= i >= j
+    allowed |= (i < n_global) | (j < n_global)
+    if causal:
+        allowed &= i >= j
+    allowed = tf.logical_and(allowed[None], key_mask[:, None, :])
+    scores = tf.matmul(query, key, transpose_b=True) / 2.
+    expected = tf.matmul(tf.nn.softmax(tf.where(allowed, scores, -1e9)), value)
+
+    result = tx.local_attention(query, key, value, window, stride, n_global, causal, key_mask=key_mask)
+    # steps without any valid keys are undefined
+    defined = tf.reduce_any(allowed, axis=-1)
+    assert tx.tensor_all_close(tf.boolean_mask(result, defined), tf.boolean_mask(expected, defined), atol=1e-6)
+
+
+@pytest.mark.parametrize("causal", [False, True])
+def test_linear_attention(causal):
+    query = tf.random.normal([2, 11, 4])
+    key = tf.random.normal([2, 11, 4])
+    value = tf.random.normal([2, 11, 3])
+    key_mask = tf.sequence_mask([11, 7], 11)
+
+    phi_q, phi_k = tx.elu_features(query), tx.elu_features(key)
+    scores = tf.matmul(phi_q, phi_k, transpose_b=True) * tf.cast(key_mask, tf.float32)[:, None, :]
+    if causal:
+        scores *= tf.linalg.band_part(tf.ones([11, 11]), -1, 0)
+    expected = tf.matmul(scores, value) / (tf.reduce_sum(scores, axis=-1, keepdims=True) + 1e-6)
+
+    result = tx.linear_attention(query, key, value, causal=causal, key_mask=key_mask, chunk_size=4)
+    assert tx.tensor_all_close(result, expected, atol=1e-6)
+
+
+def test_random_features():
+    x = tf.random.normal([6, 8]) * 0.3
+    projection = tf.random.normal([8, 8192], seed=1)
+    features = tx.random_features(x, projection)
+    assert tx.tensor_equal(tf.shape(features), [6, 8192])
+
+    # unbiased estimate of the softmax kernel
+    approx = tf.matmul(features, features, transpose_b=True)
+    exact = tf.exp(tf.matmul(x, x, transpose_b=True))
+    assert tx.tensor_all_close(approx, exact, rtol=0.2)
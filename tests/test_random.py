@@ -43,3 +43,28 @@ def test_sample_sigmoid():
     sample = tx.sample_sigmoid(logits, n_samples)
 
     assert tx.tensor_equal(tf.shape(sample), [n_samples] + shape)
+
+
+def test_hash_uniform():
+    rows = tf.constant([[0], [1]])
+    ids = tf.constant([[2, 2, 3], [2, 4, 2]])
+    u = tx.hash_uniform(rows, ids, seed=42)
+    assert u.shape == [2, 3]
+    assert u[0, 0] == u[0, 1]
+    assert u[1, 0] == u[1, 2]
+    assert tx.tensor_equal(u, tx.hash_uniform(rows, ids, seed=42))
+    assert not tx.tensor_equal(u, tx.hash_uniform(rows, ids, seed=43))
+
+    u = tx.hash_uniform(tf.range(10000), seed=0)
+    assert tf.reduce_all(u >= 0) and tf.reduce_all(u < 1)
+    assert abs(float(tf.reduce_mean(u)) - 0.5) < 0.05
+
+
+@pytest.mark.parametrize("seed", [None, 42])
+def test_sample_alias(seed):
+    counts = [10., 0., 30., 60.]
+    prob_table, alias_table = tx.alias_table(counts)
+    samples = tx.sample_alias(prob_table, alias_table, [20000], seed=seed)
+    freq = tf.math.bincount(tf.cast(samples, tf.int32), minlength=4, dtype=tf.float32) / 20000
+    assert tx.tensor_all_close(freq, tf.constant(counts) / 100., atol=2e-2)
+    assert freq[1] == 0
@@ -6,6 +6,7 @@ import tensorflow as tf
 import tensorx as tx
 import numpy as np
 import logging
+import pytest
 
 
 def test_model_run():
@@ -215,3 +216,149 @@ def test_model_train():
     w3 = y.weights.value()
 
     assert tx.tensor_equal(w2, w3)
+
+
+def test_clip_sparse_gradients():
+    grad = tf.IndexedSlices(tf.constant([[3., 0.], [0., 4.], [3., 0.]]),
+                            tf.constant([1, 2, 1]),
+                            tf.constant([5, 2]))
+    clipped, = tx.clip_gradients([grad], clipnorm=1.0, clipvalue=0.5)
+    assert isinstance(clipped, tf.IndexedSlices)
+
+    expected = tf.clip_by_value(tf.clip_by_norm(tf.convert_to_tensor(grad), 1.0), -0.5, 0.5)
+    assert tx.tensor_all_close(tf.convert_to_tensor(clipped), expected)
+
+
+def test_lazy_updates():
+    var = tf.Variable(tf.ones([6, 2]))
+    dense_var = tf.Variable(tf.ones([6, 2]))
+    grad = tf.IndexedSlices(tf.constant([[1., 2.], [3., 4.], [1., 1.]]),
+                            tf.constant([1, 3, 1]),
+                            tf.constant([6, 2]))
+
+    lazy = tx.LazyUpdates(tf.optimizers.Adam(learning_rate=0.1))
+    lazy.apply_gradients([(grad, var)])
+    tf.optimizers.Adam(learning_rate=0.1).apply_gradients([(tf.convert_to_tensor(grad), dense_var)])
+
+    # first Adam step is the same, untouched rows and slots are left as they were
+    assert tx.tensor_all_close(var, dense_var)
+    untouched = [0, 2, 4, 5]
+    assert tx.tensor_equal(tf.gather(var, untouched), tf.ones([4, 2]))
+    m = lazy.slot(var, "m")
+    assert tx.tensor_equal(tf.gather(m, untouched), tf.zeros([4, 2]))
+
+    # second step with different rows doesn't decay the slots of previous rows
+    grad2 = tf.IndexedSlices(tf.constant([[1., 1.]]), tf.constant([0]), tf.constant([6, 2]))
+    m_before = tf.identity(m)
+    lazy.apply_gradients([(grad2, var)])
+    assert tx.tensor_equal(tf.gather(m, [1, 3]), tf.gather(m_before, [1, 3]))
+
+    with pytest.raises(ValueError):
+        tx.LazyUpdates(tf.optimizers.Adam(amsgrad=True))
+
+
+def test_model_lazy_updates():
+    vocab_size = 8
+    ids = tx.Input(n_units=2, dtype=tf.int64, constant=False)
+    labels = tx.Input(n_units=2, constant=False)
+    lookup = tx.Lookup(ids, seq_size=2, embedding_shape=[vocab_size, 3])
+    features = tx.Lambda(lookup, fn=lambda x: tf.reduce_mean(x, axis=1), n_units=3)
+    out = tx.Linear(features, 2)
+
+    @tx.layer(n_units=2, name="loss")
+    def loss(pred, labs):
+        return tf.losses.categorical_crossentropy(labs, pred, from_logits=True)
+
+    model = tx.Model(run_inputs=ids, run_outputs=out, train_inputs=[ids, labels], train_outputs=out,
+                     train_loss=loss(out, labels))
+    opt = model.set_optimizer(tf.optimizers.Adam, lazy=True, learning_rate=0.1)
+    assert isinstance(model.lazy_updates[opt], tx.LazyUpdates)
+
+    embeddings = lookup.weights.numpy()
+    dense_weights = out.weights.numpy()
+    model.train_step({ids: [[1, 3], [3, 6]], labels: [[0., 1.], [1., 0.]]})
+
+    # the Lookup gradients (IndexedSlices) only update the touched rows and their slots
+    touched = [1, 3, 6]
+    untouched = [0, 2, 4, 5, 7]
+    assert tx.tensor_equal(tf.gather(lookup.weights, untouched), embeddings[untouched])
+    assert not tx.tensor_all_close(tf.gather(lookup.weights, touched), embeddings[touched])
+    m = model.lazy_updates[opt].slot(lookup.weights, "m")
+    assert tx.tensor_equal(tf.gather(m, untouched), tf.zeros([len(untouched), 3]))
+    assert tf.reduce_all(tf.reduce_any(tf.gather(m, touched) != 0, axis=-1))
+
+    # dense gradients are applied by the optimizer
+    assert not tx.tensor_all_close(out.weights, dense_weights)
+
+    # rows touched in the previous step don't keep moving with their momentum (as with dense Adam updates)
+    embeddings = lookup.weights.numpy()
+    m_before = m.numpy()
+    model.train_step({ids: [[0, 2], [2, 0]], labels: [[0., 1.], [1., 0.]]})
+    assert tx.tensor_equal(tf.gather(lookup.weights, touched), embeddings[touched])
+    assert tx.tensor_equal(tf.gather(m, touched), m_before[touched])
+
+
+def test_tbptt_windows():
+    x = tx.Input(n_units=5, name="x", constant=False, dtype=tf.int32)
+    labels = tx.Input(n_units=2, name="labels", constant=False)
+
+    seq = np.arange(14).reshape([2, 7])
+    feed = {x: seq, labels: np.ones([2, 2]), "reset_state": True}
+
+    windows = list(tx.Model.tbptt_windows(feed, steps=3))
+    assert len(windows) == 3
+    assert "reset_state" in windows[0]
+    assert all("reset_state" not in w for w in windows[1:])
+    assert tx.tensor_equal(tf.concat([w[x] for w in windows], axis=1), seq)
+    assert [w[x].shape[1] for w in windows] == [3, 3, 1]
+    # values without the time dimension are fed to every window
+    assert all(w[labels].shape == [2, 2] for w in windows)
+
+
+def test_model_reset_state():
+    batch_size = 3
+    data = tf.random.uniform([4, batch_size, 2])
+    x = tx.Input(data, n_units=2, constant=False)
+    rnn = tx.RNN(x, cell_config=tx.GRUCell.config(n_units=3), stateful=True)
+    loss = tx.Lambda(rnn, fn=lambda y: tf.reduce_mean(y, axis=0))
+    model = tx.Model(run_inputs=x, run_outputs=rnn, train_inputs=x, train_outputs=rnn, train_loss=loss)
+
+    state = rnn.cell.previous_state[0]
+    zero_state = state()
+    rnn()
+    state1 = state()
+    assert not tx.tensor_equal(state1, tf.zeros_like(state1))
+
+    # reset only the state of the second example
+    model.reset_state(mask=[False, True, False])
+    state2 = state()
+    assert tx.tensor_equal(state2[1], zero_state[0])
+    assert tx.tensor_equal(tf.gather(state2, [0, 2]), tf.gather(state1, [0, 2]))
+
+    model.reset_state()
+    assert tx.tensor_equal(state(), zero_state)
+
+
+def test_model_train_tbptt():
+    batch_size = 3
+    seq_size = 6
+    data = tf.random.uniform([seq_size, batch_size, 2])
+    x = tx.Input(data[:2], n_units=2, constant=False)
+    rnn = tx.RNN(x, cell_config=tx.GRUCell.config(n_units=3), stateful=True)
+    loss = tx.Lambda(rnn, fn=lambda y: tf.reduce_mean(y, axis=0))
+    model = tx.Model(run_inputs=x, run_outputs=rnn, train_inputs=x, train_outputs=rnn, train_loss=loss)
+    # the weights don't change so the state can be compared with a loop over the entire sequence
+    model.set_optimizer(tf.optimizers.SGD, learning_rate=0.)
+
+    step = rnn.step_fn()
+    state = (tf.zeros([batch_size, 3]),)
+    for t in range(seq_size):
+        _, state = step(data[t], *state)
+
+    # the state of a fresh stateful layer has no batch dimension
+    model.train(train_data=[{x: data}], tbptt_steps=2, time_axis=0)
+    assert tx.tensor_all_close(rnn.cell.previous_state[0](), state[0], atol=1e-6)
+
+    # windows continue from the state of the previous batch unless the state is reset
+    model.train(train_data=[{x: data, "reset_state": True}], tbptt_steps=4, time_axis=0)
+    assert tx.tensor_all_close(rnn.cell.previous_state[0](), state[0], atol=1e-6)